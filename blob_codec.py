@@ -0,0 +1,81 @@
+import pickle
+import struct
+import numpy as np
+
+# Версионированный бинарный формат массивов в BLOB:
+#   MAGIC (3 байта) | версия (1) | код dtype (1) | ndim (1) | shape (ndim x uint32 LE) | данные (LE)
+# Старые записи - это pickle (начинаются с 0x80) и читаются через fallback.
+MAGIC = b'NDB'
+FORMAT_VERSION = 1
+
+_DTYPE_CODES = {
+    np.dtype(np.uint8): b'B',
+    np.dtype('<f2'): b'e',
+    np.dtype('<f4'): b'f',
+    np.dtype('<f8'): b'd',
+    np.dtype('<i8'): b'q',
+}
+_CODE_DTYPES = {code: dtype for dtype, code in _DTYPE_CODES.items()}
+
+
+def is_encoded(blob):
+    """True, если BLOB записан в бинарном формате (а не pickle)"""
+    return blob is not None and bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+def encode_array(array, dtype):
+    """Кодирует массив в BLOB с заголовком dtype/shape"""
+    array = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder('<'))
+    header = MAGIC + bytes([FORMAT_VERSION]) + _DTYPE_CODES[array.dtype] + bytes([array.ndim])
+    header += struct.pack(f'<{array.ndim}I', *array.shape)
+    return header + array.tobytes()
+
+
+def decode_array(blob):
+    """Декодирует BLOB без копирования (np.frombuffer, только для чтения)"""
+    version = blob[3]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Неизвестная версия формата BLOB: {version}")
+
+    dtype = _CODE_DTYPES[bytes(blob[4:5])]
+    ndim = blob[5]
+    shape = struct.unpack_from(f'<{ndim}I', blob, 6)
+    offset = 6 + 4 * ndim
+    return np.frombuffer(blob, dtype=dtype, offset=offset).reshape(shape)
+
+
+def encode_image(image):
+    """Изображение (float в [0, 1] или uint8) -> BLOB с uint8 пикселями (784 байта данных)"""
+    array = np.asarray(image)
+    if array.dtype != np.uint8:
+        array = np.clip(np.rint(array.astype(np.float32) * 255.0), 0, 255).astype(np.uint8)
+    return encode_array(array.reshape(28, 28), np.uint8)
+
+
+def decode_image(blob):
+    """BLOB -> uint8 изображение 28x28 (понимает и старый pickle-формат)"""
+    if blob is None:
+        return None
+    if is_encoded(blob):
+        return decode_array(blob)
+
+    array = np.asarray(pickle.loads(blob), dtype=np.float32)
+    if array.max() <= 1.0:
+        array = array * 255.0
+    return np.clip(np.rint(array), 0, 255).astype(np.uint8).reshape(28, 28)
+
+
+def encode_features(features, dtype=np.float32):
+    """Вектор признаков -> BLOB (float32 по умолчанию, float16 для экономии места)"""
+    if features is None:
+        return None
+    return encode_array(np.asarray(features).ravel(), dtype)
+
+
+def decode_features(blob):
+    """BLOB -> вектор признаков (понимает и старый pickle-формат)"""
+    if blob is None:
+        return None
+    if is_encoded(blob):
+        return decode_array(blob)
+    return np.asarray(pickle.loads(blob), dtype=np.float32)
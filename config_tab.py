@@ -1,6 +1,13 @@
 import tkinter as tk
 from tkinter import ttk
-import numpy as np
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+import training_worker
+from database import MODEL_FILE_SUFFIXES
 
 
 class ConfigTab:
@@ -8,6 +15,15 @@ class ConfigTab:
         self.frame = parent_frame
         self.db = database
         self.ml_core = ml_core
+
+        # Состояние фонового обучения
+        self.training_process = None
+        self.progress_queue = None
+        self.cancel_event = None
+        self._ready_queue = queue.Queue()
+        self._training_state = 'idle'  # 'idle' | 'running' | 'loading'
+        self._training_configs = None   # (feature_config, clustering_config) текущего запуска
+
         self.setup_ui()
     
     def setup_ui(self):
@@ -302,6 +318,13 @@ class ConfigTab:
                                   state="disabled")
         self.reload_btn.pack(side='left', padx=(0, 10))
         
+        # Кнопка отмены фонового обучения
+        self.cancel_btn = tk.Button(button_frame,
+                                  text="Отменить обучение",
+                                  command=self.cancel_training,
+                                  state="disabled")
+        self.cancel_btn.pack(side='left', padx=(0, 10))
+        
         # Опасная кнопка сброса
         self.reset_btn = tk.Button(button_frame,
                                  text="СБРОСИТЬ ВСЁ ОБУЧЕНИЕ",
@@ -312,192 +335,6 @@ class ConfigTab:
     def on_algorithm_change(self, event):
         self.setup_algorithm_params()
     
-    def prepare_training_data(self, feature_config):
-        """Подготовить обучающие данные согласно настройкам"""
-        try:
-            from tensorflow.keras.datasets import mnist
-        except ImportError:
-            print("❌ TensorFlow не установлен. Используем заглушку.")
-            return self.prepare_dummy_data(feature_config)
-        
-        # Загружаем MNIST
-        (x_train, y_train), (x_test, y_test) = mnist.load_data()
-        
-        # Нормализуем пиксели
-        x_train = x_train.astype('float32') / 255.0
-        x_test = x_test.astype('float32') / 255.0
-        
-        # Объединяем для гибкости
-        x_all = np.concatenate([x_train, x_test])
-        y_all = np.concatenate([y_train, y_test])
-        
-        # Выбираем случайные реальные данные
-        real_count = feature_config['real_data_count']
-        if real_count > len(x_all):
-            real_count = len(x_all)
-            print(f"⚠️  Запрошено больше реальных данных чем есть. Используем {real_count}")
-            
-        indices = np.random.choice(len(x_all), real_count, replace=False)
-        x_real = x_all[indices]
-        y_real = y_all[indices]
-        
-        # Генерируем синтетические данные
-        synth_count = feature_config['synthetic_data_count']
-        if synth_count > 0:
-            x_synth, y_synth = self.generate_synthetic_data(x_real, y_real, 
-                                                           synth_count, 
-                                                           feature_config['noise_level'])
-        else:
-            x_synth, y_synth = np.array([]), np.array([])
-        
-        # Объединяем
-        if synth_count > 0:
-            x_combined = np.concatenate([x_real, x_synth])
-            y_combined = np.concatenate([y_real, y_synth])
-        else:
-            x_combined = x_real
-            y_combined = y_real
-        
-        print(f"✅ Данные подготовлены: {len(x_real)} реальных + {len(x_synth)} синтетических")
-        
-        return {
-            'x_train': x_combined,
-            'y_train': y_combined,
-            'x_real': x_real,
-            'y_real': y_real,
-            'x_synthetic': x_synth if synth_count > 0 else None,
-            'y_synthetic': y_synth if synth_count > 0 else None,
-            'real_count': len(x_real),
-            'synthetic_count': len(x_synth),
-            'noise_level': feature_config['noise_level']
-        }
-    
-    def generate_synthetic_data(self, x_real, y_real, synth_count, noise_level):
-        """Генерируем зашумленные синтетические данные"""
-        if len(x_real) == 0:
-            return np.array([]), np.array([])
-            
-        x_synth = []
-        y_synth = []
-        
-        for i in range(synth_count):
-            # Выбираем случайный реальный пример как основу
-            base_idx = np.random.randint(0, len(x_real))
-            image = x_real[base_idx].copy()
-            true_label = y_real[base_idx]
-            
-            # Применяем различные искажения в зависимости от уровня шума
-            if noise_level > 0.3:
-                # Поворот
-                if np.random.random() < noise_level:
-                    k = np.random.randint(1, 4)  # 1, 2 или 3 поворота на 90°
-                    image = np.rot90(image, k)
-                
-                # Отражение
-                if np.random.random() < noise_level * 0.7:
-                    image = np.flipud(image) if np.random.random() < 0.5 else np.fliplr(image)
-            
-            if noise_level > 0.5:
-                # Добавляем гауссов шум
-                noise = np.random.normal(0, noise_level * 0.3, image.shape)
-                image = np.clip(image + noise, 0, 1)
-                
-                # Размытие (простое)
-                if np.random.random() < noise_level * 0.5:
-                    from scipy.ndimage import gaussian_filter
-                    image = gaussian_filter(image, sigma=0.5)
-            
-            # Иногда меняем метку (ошибочная разметка)
-            final_label = true_label
-            if np.random.random() < noise_level * 0.3:  # До 30% ошибок при высоком шуме
-                wrong_label = np.random.randint(0, 10)
-                while wrong_label == true_label:
-                    wrong_label = np.random.randint(0, 10)
-                final_label = wrong_label
-            
-            x_synth.append(image)
-            y_synth.append(final_label)
-        
-        return np.array(x_synth), np.array(y_synth)
-    
-    def prepare_dummy_data(self, feature_config):
-        """Заглушка если нет TensorFlow"""
-        print("🔶 Используем заглушечные данные (без TensorFlow)")
-        return {
-            'x_train': np.random.random((100, 28, 28)),
-            'y_train': np.random.randint(0, 10, 100),
-            'real_count': feature_config['real_data_count'],
-            'synthetic_count': feature_config['synthetic_data_count'],
-            'noise_level': feature_config['noise_level']
-        }
-    
-    def train_feature_extractor_and_cluster(self, training_data, feature_config, clustering_config):
-        """РЕАЛЬНОЕ обучение экстрактора и кластеризация"""
-        try:
-            print("🚀 Запуск обучения системы...")
-
-            # 1. Создаем и обучаем экстрактор
-            self.ml_core.create_feature_extractor(
-            feature_config['architecture'],
-            feature_config['embedding_size']
-            )
-
-            # 2. Обучаем экстрактор
-            history = self.ml_core.train_feature_extractor(training_data, epochs=5)
-
-            # 3. Извлекаем признаки
-            features = self.ml_core.extract_features(training_data['x_train'])
-
-            # 4. Выполняем кластеризацию c передачей настоящих меток
-            cluster_labels = self.ml_core.perform_clustering(
-                features, 
-                clustering_config,
-                true_labels=training_data['y_train']  # ← ПЕРЕДАЕМ РЕАЛЬНЫЕ МЕТКИ!
-                )
-            
-
-            # 5. Возвращаем данные для сохранения в БД
-            clusters_data = self.ml_core.get_clusters_data_for_db()
-            self.db.save_clusters(clusters_data)
-
-            # 6. Сохраняем сам ml_core для использования в DigitTab
-            self.ml_core.save_models()
-
-            print("=" * 50)
-            print("🎉 СИСТЕМА УСПЕШНО ОБУЧЕНА!")
-            print(f"📊 Создано кластеров: {len(clusters_data)}")
-            print(f"🔍 Размерность признаков: {feature_config['embedding_size']}")
-            if history and 'accuary' in history:
-                print(f"📈 Точность экстрактора: {history['accuracy'][-1]:.3f}")
-            print("=" * 50)
-            return clusters_data
-        except Exception as e:
-            print(f"❌ Критическая ошибка обучения: {e}")
-            import traceback
-            traceback.print_exc()
-            return self.train_feature_extractor_and_cluster_fallback(feature_config, clustering_config)
-        
-    def train_feature_extractor_and_cluster_fallback(self, feature_config, clustering_config):
-        """Fallback метод когда основное обучение не работает"""
-        print("🔄 Используем fallback метод...")
-
-        # Создаем простые заглушечные кластеры 
-        clusters_data = []
-        n_clusters = clustering_config.get('k_value', 5)
-
-        for i in range(n_clusters):
-            cluster = {
-                'cluster_id': i,
-                'centroid': [0.1 * i] * feature_config['embedding_size'],  # Простой центроид
-                'weights': {digit: 1.0/10 for digit in range(10)},
-                'params': clustering_config,
-                'size': 10
-                }
-            clusters_data.append(cluster)
-        print(f"✅ Fallback: создано {len(clusters_data)} заглушечных кластеров")
-        return clusters_data
-        
-    
     def initialize_system(self):
         """Инициализировать всю систему и сохранить настройки в БД"""
         try:
@@ -529,30 +366,181 @@ class ConfigTab:
             # 2. Сохраняем настройки в БД
             self.db.save_system_config(feature_config, clustering_config, weights_config)
             
-            # 3. Генерируем данные согласно настройкам
-            training_data = self.prepare_training_data(feature_config)
-            
-            # 4. Обучаем экстрактор и проводим кластеризацию (пока заглушка)
-            clusters_data = self.train_feature_extractor_and_cluster(training_data, feature_config, clustering_config)
-            
-            # 5. Сохраняем кластеры в БД
-            self.db.save_clusters(clusters_data)
-            
-            self.status_label.config(text="✅ Система инициализирована и готова к работе", fg="green")
-            self.reload_btn.config(state="normal")
-            
-            print("=" * 50)
-            print("СИСТЕМА УСПЕШНО ИНИЦИАЛИЗИРОВАНА")
-            print(f"Данные: {training_data['real_count']} реальных + {training_data['synthetic_count']} синтетических")
-            print(f"Шум: {feature_config['noise_level']}")
-            print(f"Кластеров создано: {len(clusters_data)}")
-            print("=" * 50)
+            # 3. Запускаем обучение в отдельном процессе, окно остается отзывчивым
+            self.start_training(feature_config, clustering_config)
             
         except Exception as e:
             self.status_label.config(text=f"❌ Ошибка инициализации: {str(e)}", fg="red")
             import traceback
             traceback.print_exc()
     
+    # ===== ФОНОВОЕ ОБУЧЕНИЕ =====
+
+    def start_training(self, feature_config, clustering_config):
+        """Запускает подготовку данных, обучение и кластеризацию в отдельном процессе"""
+        if self._training_state != 'idle':
+            self.status_label.config(text="⏳ Обучение уже идет", fg="orange")
+            return
+
+        ctx = multiprocessing.get_context('spawn')
+        self.progress_queue = ctx.Queue()
+        self.cancel_event = ctx.Event()
+        self._training_configs = (feature_config, clustering_config)
+
+        self.training_process = ctx.Process(
+            target=training_worker.run_training,
+            args=(feature_config, clustering_config, self.progress_queue, self.cancel_event),
+            name="hybrid-training",
+            daemon=True
+        )
+        self.training_process.start()
+        self._training_state = 'running'
+        print(f"🚀 Обучение запущено в процессе {self.training_process.pid}")
+
+        self.init_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
+        self.status_label.config(text="⏳ Запуск обучения...", fg="blue")
+        self.frame.after(100, self._poll_training)
+
+    def cancel_training(self):
+        """Просит рабочий процесс остановиться; при зависании завершает его"""
+        if self._training_state != 'running':
+            return
+        self.cancel_event.set()
+        self.cancel_btn.config(state="disabled")
+        self.status_label.config(text="⏹️ Отмена обучения...", fg="orange")
+        self.frame.after(10000, self._terminate_training, self.training_process)
+
+    def _terminate_training(self, process):
+        if process.is_alive():
+            print("⚠️ Рабочий процесс не ответил на отмену - завершаем принудительно")
+            process.terminate()
+
+    def _poll_training(self):
+        """Забирает сообщения рабочего процесса и обновляет статус (поток Tk)"""
+        try:
+            if self._training_state == 'running':
+                self._drain_progress_queue()
+                if self._training_state == 'running' and not self.training_process.is_alive():
+                    # Процесс вышел - забираем то, что он успел отправить перед выходом
+                    self._drain_progress_queue()
+                    if self._training_state == 'running':
+                        self._finish_training("❌ Процесс обучения завершился неожиданно", "red")
+
+            elif self._training_state == 'loading':
+                try:
+                    new_core, result = self._ready_queue.get_nowait()
+                    self._on_core_ready(new_core, result)
+                except queue.Empty:
+                    pass
+        except Exception as e:
+            # Ошибка обработки не должна оставлять кнопку инициализации выключенной
+            print(f"❌ Ошибка обработки обучения: {e}")
+            import traceback
+            traceback.print_exc()
+            self._finish_training(f"❌ Ошибка обучения: {e}", "red")
+
+        if self._training_state != 'idle':
+            self.frame.after(100, self._poll_training)
+
+    def _drain_progress_queue(self):
+        while self._training_state == 'running':
+            try:
+                kind, payload = self.progress_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._handle_training_message(kind, payload)
+
+    def _handle_training_message(self, kind, payload):
+        """Обрабатывает одно сообщение рабочего процесса"""
+        if kind == 'stage_started':
+            self.status_label.config(text=f"⏳ {payload}...", fg="blue")
+        elif kind == 'stage_finished':
+            print(f"⏱️  {payload['stage']}: {payload['seconds']:.2f} с")
+        elif kind == 'epoch':
+            self.status_label.config(
+                text=(f"⏳ Эпоха {payload['epoch']}/{payload['epochs']}: "
+                      f"loss={payload['loss']:.4f}, acc={payload['accuracy']:.3f}, "
+                      f"{payload['examples_per_sec']:.0f} примеров/с"),
+                fg="blue")
+        elif kind == 'done':
+            self.status_label.config(text="⏳ Загружаем обученную модель...", fg="blue")
+            self.cancel_btn.config(state="disabled")
+            self._training_state = 'loading'
+            threading.Thread(target=self._build_core, args=(payload,), daemon=True).start()
+        elif kind == 'cancelled':
+            self._finish_training("⏹️ Обучение отменено", "orange")
+        elif kind == 'failed':
+            # Активное поколение не трогаем: при следующем запуске
+            # восстановится последняя удачно обученная модель
+            print(f"❌ Критическая ошибка обучения: {payload}")
+            self._finish_training(f"❌ Ошибка обучения: {payload}", "red")
+
+    def _build_core(self, result):
+        """Собирает новое ядро из результатов обучения (вспомогательный поток)"""
+        from ml_core import HybridMLCore
+        try:
+            new_core = HybridMLCore()
+            new_core.load_models(result['models_path'])
+            new_core.cluster_metric = result['cluster_metric']
+            new_core.load_clusters_from_db(result['clusters_data'])
+        except Exception as e:
+            print(f"❌ Ошибка загрузки обученной модели: {e}")
+            new_core = None
+        self._ready_queue.put((new_core, result))
+
+    def _on_core_ready(self, new_core, result):
+        """Атомарно подменяет состояние общего ml_core и сохраняет кластеры"""
+        if new_core is None:
+            self._finish_training("❌ Не удалось загрузить обученную модель", "red")
+            return
+
+        # Файлы обученной модели получают собственный уникальный путь поколения
+        models_path = f"models/generation_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        try:
+            cluster_ids = self.db.save_clusters(result['clusters_data'], models_path=models_path)
+        except Exception as e:
+            # Общее ядро и активное поколение не тронуты, файлы остаются в PENDING_MODELS_PATH
+            print(f"❌ Ошибка сохранения кластеров: {e}")
+            self._finish_training(f"❌ Не удалось сохранить кластеры: {e}", "red")
+            return
+
+        # Поколение зафиксировано - переносим файлы на его путь
+        for suffix in MODEL_FILE_SUFFIXES:
+            pending = f"{result['models_path']}{suffix}"
+            try:
+                if os.path.exists(pending):
+                    os.replace(pending, f"{models_path}{suffix}")
+            except OSError as e:
+                print(f"⚠️ Не удалось перенести {pending}: {e}")
+
+        # ID из БД назначаются новому ядру до подмены: общее ядро ни в какой
+        # момент не отдает номера кластеров sklearn, которых нет в БД
+        new_core.assign_cluster_ids(cluster_ids)
+        self.ml_core.swap_state(new_core)
+
+        feature_config, _ = self._training_configs
+        print("=" * 50)
+        print("СИСТЕМА УСПЕШНО ИНИЦИАЛИЗИРОВАНА")
+        print(f"Данные: {result['real_count']} реальных + {result['synthetic_count']} синтетических")
+        print(f"Шум: {feature_config['noise_level']}")
+        print(f"Кластеров создано: {len(result['clusters_data'])}")
+        for stage, seconds in result['stage_times'].items():
+            print(f"   {stage}: {seconds:.2f} с")
+        print("=" * 50)
+
+        self._finish_training("✅ Система инициализирована и готова к работе", "green")
+        self.reload_btn.config(state="normal")
+
+    def _finish_training(self, text, color):
+        self._training_state = 'idle'
+        self.status_label.config(text=text, fg=color)
+        self.init_btn.config(state="normal")
+        self.cancel_btn.config(state="disabled")
+        if self.training_process:
+            self.training_process.join(timeout=0.1)
+        self.training_process = None
+    
     def train_extractor(self):
         """Заглушка: Обучение экстрактора признаков"""
         print("🔶 Заглушка: Обучение экстрактора признаков")
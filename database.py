@@ -1,7 +1,112 @@
 import sqlite3
 import os
 import json
-import pickle
+import hashlib
+import numpy as np
+from blob_codec import (encode_image, decode_image, encode_features, decode_features,
+                        encode_array, decode_array, MAGIC)
+from db_writer import WriteBehindQueue
+from dataset_store import get_dataset_store
+from feedback_replay import DEFAULT_PARAMS, replay_weights
+from system_config import SystemConfig
+
+DB_PATH = 'data/feedback.db'
+
+# Сколько последних поколений модели хранить (активное + предыдущее для отката)
+KEEP_GENERATIONS = 2
+MODEL_FILE_SUFFIXES = ('_extractor.h5', '_clusterer.pkl')
+
+# ===== ГОРЯЧИЕ ЗАПРОСЫ ВКЛАДОК И ИХ ИНДЕКСЫ =====
+
+# Очередь верификации (VerifyTab): страница после курсора sample_id, без изображений
+PENDING_SAMPLES_SQL = '''
+    SELECT sample_id, predicted_label, user_feedback, cluster_id, true_label
+    FROM samples
+    WHERE verified_label IS NULL
+    AND user_feedback IN ('no', 'unsure')
+    AND sample_id > ?
+    ORDER BY sample_id
+    LIMIT ?
+'''
+PENDING_COUNT_SQL = '''
+    SELECT COUNT(*) FROM samples
+    WHERE verified_label IS NULL
+    AND user_feedback IN ('no', 'unsure')
+    AND sample_id > ?
+'''
+# Матрица ошибок верификации (ResultsTab): не более 10 x 10 строк, только
+# по покрывающему индексу idx_samples_verified, уже упорядоченному по группам
+CONFUSION_MATRIX_SQL = '''
+    SELECT true_label, verified_label, COUNT(*)
+    FROM samples
+    WHERE verified_label IS NOT NULL AND true_label IS NOT NULL
+    GROUP BY true_label, verified_label
+'''
+# Колонки BLOB примера для запросов-шаблонов. Пока фоновая миграция
+# (start_blob_migration) не перенесла старые BLOB из samples, читаем и их
+BLOB_COLUMNS = {
+    'image': 'COALESCE(i.image_data, b.image_data)',
+    'features': 'b.features',
+}
+LEGACY_BLOB_COLUMNS = {
+    'image': 'COALESCE(i.image_data, b.image_data, s.image_data)',
+    'features': 'COALESCE(b.features, s.features)',
+}
+UNUSED_SAMPLES_SQL = '''
+    SELECT s.sample_id, s.dataset_id, s.dataset_index, {image}, {features}
+    FROM samples s
+    LEFT JOIN sample_blobs b ON b.sample_id = s.sample_id
+    LEFT JOIN image_store i ON i.image_hash = b.image_hash
+    WHERE s.is_used = FALSE
+    LIMIT ?
+'''
+STATISTICS_HISTORY_SQL = '''
+    SELECT * FROM statistics
+    WHERE timestamp >= datetime('now', ?)
+    ORDER BY timestamp
+'''
+LATEST_STATISTICS_SQL = '''
+    SELECT * FROM statistics
+    ORDER BY timestamp DESC
+    LIMIT 1
+'''
+
+# (имя, SQL, параметры) - проверяются Database.explain()
+HOT_QUERIES = [
+    ('pending_verification', PENDING_SAMPLES_SQL, (0, 200)),
+    ('pending_count', PENDING_COUNT_SQL, (0,)),
+    ('confusion_matrix', CONFUSION_MATRIX_SQL, ()),
+    ('unused_samples', UNUSED_SAMPLES_SQL.format(**BLOB_COLUMNS), (100,)),
+    ('statistics_history', STATISTICS_HISTORY_SQL, ('-24 hours',)),
+    ('latest_statistics', LATEST_STATISTICS_SQL, ()),
+]
+
+# Индексы горячих запросов (создаются миграцией 5). Частичные индексы
+# хранят только нужные строки: очередь верификации и непоказанные примеры
+# остаются маленькими даже при миллионе примеров. Условие частичного
+# индекса должно дословно повторяться в WHERE запроса.
+SAMPLE_INDEXES = [
+    ('idx_samples_pending', '''
+        CREATE INDEX IF NOT EXISTS idx_samples_pending ON samples(verified_label)
+        WHERE verified_label IS NULL AND user_feedback IN ('no', 'unsure')
+    '''),
+    ('idx_samples_feedback', '''
+        CREATE INDEX IF NOT EXISTS idx_samples_feedback ON samples(user_feedback)
+    '''),
+    ('idx_samples_verified', '''
+        CREATE INDEX IF NOT EXISTS idx_samples_verified
+        ON samples(true_label, verified_label, predicted_label)
+        WHERE verified_label IS NOT NULL AND true_label IS NOT NULL
+    '''),
+    ('idx_samples_unused', '''
+        CREATE INDEX IF NOT EXISTS idx_samples_unused ON samples(is_used)
+        WHERE is_used = FALSE
+    '''),
+    ('idx_statistics_timestamp', '''
+        CREATE INDEX IF NOT EXISTS idx_statistics_timestamp ON statistics(timestamp)
+    '''),
+]
+
 
 class Database:
     def __init__(self):
@@ -9,13 +114,65 @@ class Database:
         if not os.path.exists('data'):
             os.makedirs('data')
 
-        # Подключаемся к БД
-        self.conn = sqlite3.connect('data/feedback.db')
+        # Разобранный system_config (SystemConfig) и подписчики на его изменение
+        self._config = None
+        self._config_loaded = False
+        self._config_raw = None             # JSON-колонки, из которых разобран self._config
+        self._config_data_version = None    # PRAGMA data_version на момент проверки
+        self._config_subscribers = []
+
+        # Агрегаты для ResultsTab: (data_version, результат get_result_aggregates)
+        self._aggregates_cache = None
+
+        # Подключаемся к БД (это соединение - для чтения и схемы)
+        self.db_path = DB_PATH
+        self.conn = sqlite3.connect(self.db_path)
+        self.configure_connection(self.conn)
         self.create_tables()
         self.check_statistics_table()
 
         self.add_true_label_column()
+        self.apply_schema_migrations()
+
+        # В samples еще есть BLOB-колонки до миграции 6: их переносит start_blob_migration
+        columns = [column[1] for column in self.conn.execute('PRAGMA table_info(samples)')]
+        self._legacy_blob_columns = 'image_data' in columns
+
+        # Все записи идут через отдельный поток с групповой фиксацией
+        self.writer = WriteBehindQueue(self.db_path, configure=self.configure_connection)
         print("✅ База данных инициализирована")
+
+    @staticmethod
+    def configure_connection(conn):
+        """WAL + synchronous=NORMAL: читатели не ждут писателя, fsync только на checkpoint"""
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+
+    def open_read_connection(self):
+        """Отдельное соединение для чтения из фонового потока (в WAL не мешает записи)"""
+        conn = sqlite3.connect(self.db_path)
+        self.configure_connection(conn)
+        return conn
+
+    def _write(self, op, wait=False):
+        """Выполняет op(cursor) в потоке записи.
+
+        Возвращает Future, а при wait=True - дожидается фиксации и
+        возвращает результат операции.
+        """
+        future = self.writer.submit(op)
+        return future.result() if wait else future
+
+    def flush(self):
+        """Барьер: ждет фиксации всех поставленных в очередь записей"""
+        self.writer.flush()
+
+    def data_version(self):
+        """PRAGMA data_version основного соединения: меняется, когда другое
+        соединение (поток записи, другой процесс) фиксирует транзакцию.
+        Дешевая проверка "изменилось ли что-нибудь" без чтения таблиц."""
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
     
     def create_tables(self):
         """Создаем таблицы если их нет"""
@@ -69,8 +226,8 @@ class Database:
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS samples (
                 sample_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                image_data BLOB,                        -- Бинарные данные изображения
-                features BLOB,                          -- Вектор признаков от экстрактора
+                image_data BLOB,                        -- Бинарные данные изображения (миграция 6 -> sample_blobs)
+                features BLOB,                          -- Вектор признаков от экстрактора (миграция 6 -> sample_blobs)
                 cluster_id INTEGER,                     -- В какой кластер попал
                 predicted_label INTEGER,                -- Что система предположила
                 user_feedback TEXT,                     -- 'yes', 'no', 'unsure'
@@ -104,155 +261,508 @@ class Database:
     
     def save_system_config(self, feature_config, clustering_config, weights_config):
         """Сохранить настройки системы"""
-        cursor = self.conn.cursor()
-        
         # Преобразуем в JSON
         feature_json = json.dumps(feature_config)
         clustering_json = json.dumps(clustering_config)
         weights_json = json.dumps(weights_config)
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO system_config 
-            (id, feature_extractor_config, clustering_config, weights_config, updated_at)
-            VALUES (1, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (feature_json, clustering_json, weights_json))
+        def op(cursor):
+            cursor.execute('''
+                INSERT OR REPLACE INTO system_config 
+                (id, feature_extractor_config, clustering_config, weights_config, updated_at)
+                VALUES (1, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (feature_json, clustering_json, weights_json))
         
-        self.conn.commit()
+        self._write(op, wait=True)
         print("✅ Настройки системы сохранены")
-    
+        self._reload_config()
+
     def load_system_config(self):
-        """Загрузить настройки системы"""
+        """Загрузить настройки системы: SystemConfig (неизменяемый) или None.
+
+        Настройки держатся в памяти. Повторный вызов стоит одного
+        PRAGMA data_version; если другое соединение что-то зафиксировало,
+        сравниваются сырые JSON-колонки, и разбор идет только при изменении.
+        """
+        data_version = self.data_version()
+        if data_version == self._config_data_version:
+            return self._config
+
         cursor = self.conn.cursor()
         cursor.execute('SELECT * FROM system_config WHERE id = 1')
-        result = cursor.fetchone()
-        
-        if result:
-            return {
-                'feature_extractor': json.loads(result[1]),
-                'clustering': json.loads(result[2]),
-                'weights': json.loads(result[3]),
-                'created_at': result[4],
-                'updated_at': result[5]
-            }
-        else:
-            return None
-    
+        row = cursor.fetchone()
+        raw = row[1:4] if row else None
+
+        self._config_data_version = data_version
+        if raw != self._config_raw or not self._config_loaded:
+            # Первая загрузка - без уведомления: подписчики читают настройки сами
+            self._set_config(SystemConfig.from_row(row) if row else None, raw, notify=self._config_loaded)
+            self._config_loaded = True
+        return self._config
+
+    def _reload_config(self):
+        """Перечитывает настройки после записи этим процессом"""
+        self._config_data_version = None
+        self.load_system_config()
+
+    def _set_config(self, config, raw, notify=True):
+        self._config, self._config_raw = config, raw
+        if not notify:
+            return
+        for callback in list(self._config_subscribers):
+            try:
+                callback(config)
+            except Exception as e:
+                print(f"⚠️ Ошибка подписчика настроек: {e}")
+
+    def subscribe_config(self, callback):
+        """callback(config) вызывается при каждом изменении настроек (config может быть None)"""
+        self._config_subscribers.append(callback)
+        return callback
+
+    def unsubscribe_config(self, callback):
+        if callback in self._config_subscribers:
+            self._config_subscribers.remove(callback)
+
+    def get_feedback_params(self):
+        """Коэффициенты обновления весов (alpha, beta, gamma, min_weight) из настроек"""
+        config = self.load_system_config()
+        return config.feedback_params if config else dict(DEFAULT_PARAMS)
+
     def reset_system_config(self):
         """Удалить все настройки и состояние системы"""
-        cursor = self.conn.cursor()
+        def op(cursor):
+            # Удаляем все данные (кроме фидбеков, если хочешь их сохранить)
+            cursor.execute('DELETE FROM system_config')
+            cursor.execute('DELETE FROM clusters')
+            cursor.execute('DELETE FROM cluster_weights')
+            cursor.execute('DELETE FROM samples')
+            cursor.execute('DELETE FROM image_store')
+            cursor.execute('DELETE FROM feedback_events')
+            cursor.execute('DELETE FROM weight_snapshots')
+            cursor.execute('UPDATE active_generation SET generation_id = NULL WHERE id = 1')
+            cursor.execute('DELETE FROM model_generations')
+            cursor.execute('UPDATE sqlite_sequence SET seq=0 WHERE name="clusters"')  # Сброс автоинкремента
+            cursor.execute('UPDATE sqlite_sequence SET seq=0 WHERE name="samples"')
         
-        # Удаляем все данные (кроме фидбеков, если хочешь их сохранить)
-        cursor.execute('DELETE FROM system_config')
-        cursor.execute('DELETE FROM clusters')
-        cursor.execute('DELETE FROM cluster_weights')
-        cursor.execute('DELETE FROM samples')
-        cursor.execute('UPDATE sqlite_sequence SET seq=0 WHERE name="clusters"')  # Сброс автоинкремента
-        cursor.execute('UPDATE sqlite_sequence SET seq=0 WHERE name="samples"')
-        
-        self.conn.commit()
+        self._write(op, wait=True)
         print("✅ Все настройки и данные системы сброшены")
+        self._reload_config()
 
     # ===== МЕТОДЫ ДЛЯ КЛАСТЕРОВ =====
     
-    def save_clusters(self, clusters_data):
-        """Сохранить кластеры и их веса"""
+    def save_clusters(self, clusters_data, models_path=None):
+        """Сохранить кластеры и их веса новым поколением модели и сделать его активным.
+
+        Центроиды (K x D) и веса (K x 10) поколения хранятся одним float32
+        BLOB каждый в model_generations; в clusters остаются только ID.
+        models_path - префикс файлов экстрактора этого поколения. Кластеры,
+        веса, снимок и переключение указателя пишутся одной транзакцией,
+        затем старые поколения (сверх KEEP_GENERATIONS) удаляются вместе с файлами.
+        Возвращает список ID, выданных БД, в порядке clusters_data.
+        """
+        if clusters_data:
+            centroids = np.stack([np.asarray(c['centroid'], dtype=np.float32).ravel() for c in clusters_data])
+        else:
+            centroids = np.zeros((0, 0), dtype=np.float32)
+        weights = np.array([[c['weights'][digit] for digit in range(10)] for c in clusters_data],
+                           dtype=np.float32).reshape(len(clusters_data), 10)
+        params = json.dumps(clusters_data[0].get('params', {}) if clusters_data else {})
+
+        def op(cursor):
+            cursor.execute('''
+                INSERT INTO model_generations (models_path, cluster_count, params)
+                VALUES (?, ?, ?)
+            ''', (models_path, len(clusters_data), params))
+            generation_id = cursor.lastrowid
+
+            # Строки clusters только выдают ID (на них ссылаются примеры и журнал)
+            cursor.executemany('INSERT INTO clusters (generation_id) VALUES (?)',
+                               [(generation_id,)] * len(clusters_data))
+            cursor.execute('SELECT cluster_id FROM clusters WHERE generation_id = ? ORDER BY cluster_id',
+                           (generation_id,))
+            cluster_ids = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute('''
+                UPDATE model_generations SET cluster_ids = ?, centroids = ?, weights = ?
+                WHERE generation_id = ?
+            ''', (encode_array(cluster_ids, np.int64), encode_array(centroids, np.float32),
+                  encode_array(weights, np.float32), generation_id))
+
+            # Начальные веса - точка отсчета для воспроизведения журнала
+            if cluster_ids:
+                self._insert_weight_snapshot(cursor, cluster_ids, weights, 'initial', generation_id)
+
+            self._activate_generation(cursor, generation_id)
+            removed_paths = self._collect_generations(cursor)
+            return generation_id, cluster_ids, removed_paths
+
+        generation_id, cluster_ids, removed_paths = self._write(op, wait=True)
+        self._remove_model_files(removed_paths)
+        print(f"✅ Сохранено {len(clusters_data)} кластеров (поколение {generation_id})")
+        return cluster_ids
+
+    # ===== ПОКОЛЕНИЯ МОДЕЛИ =====
+
+    def _activate_generation(self, cursor, generation_id):
+        """Переключает указатель активного поколения (счетчик кластеров - триггером)"""
+        cursor.execute('UPDATE active_generation SET generation_id = ? WHERE id = 1', (generation_id,))
+
+    def activate_generation(self, generation_id):
+        """Делает активным одно из сохраненных поколений (например, для отката)"""
+        def op(cursor):
+            cursor.execute('SELECT 1 FROM model_generations WHERE generation_id = ?', (generation_id,))
+            if cursor.fetchone() is None:
+                raise ValueError(f"Поколение {generation_id} не найдено")
+            self._activate_generation(cursor, generation_id)
+
+        self._write(op, wait=True)
+        print(f"✅ Активно поколение модели {generation_id}")
+
+    def get_active_generation(self):
+        """Активное поколение: {'generation_id', 'models_path', 'cluster_count', 'created_at'} или None"""
         cursor = self.conn.cursor()
-        
-        for cluster in clusters_data:
-            # Сохраняем кластер
-            centroid_blob = pickle.dumps(cluster['centroid'])
-            algorithm_params = json.dumps(cluster.get('params', {}))
-            
+        cursor.execute('''
+            SELECT g.generation_id, g.models_path, g.cluster_count, g.created_at
+            FROM active_generation a
+            JOIN model_generations g ON g.generation_id = a.generation_id
+            WHERE a.id = 1
+        ''')
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(('generation_id', 'models_path', 'cluster_count', 'created_at'), row))
+
+    def _collect_generations(self, cursor, keep=KEEP_GENERATIONS):
+        """Удаляет поколения старше keep последних (активное не трогается).
+
+        Возвращает префиксы файлов моделей удаленных поколений.
+        """
+        cursor.execute('''
+            SELECT generation_id, models_path FROM model_generations
+            WHERE generation_id NOT IN (SELECT generation_id FROM model_generations
+                                        ORDER BY generation_id DESC LIMIT ?)
+              AND generation_id IS NOT (SELECT generation_id FROM active_generation WHERE id = 1)
+        ''', (keep,))
+        stale = cursor.fetchall()
+
+        for generation_id, _ in stale:
             cursor.execute('''
-                INSERT INTO clusters (centroid, algorithm_params)
-                VALUES (?, ?)
-            ''', (centroid_blob, algorithm_params))
-            
-            cluster_id = cursor.lastrowid
-            
-            # Сохраняем веса для этого кластера
-            for digit, weight in cluster['weights'].items():
-                cursor.execute('''
-                    INSERT INTO cluster_weights (cluster_id, digit, weight)
-                    VALUES (?, ?, ?)
-                ''', (cluster_id, digit, weight))
-        
-        self.conn.commit()
-        print(f"✅ Сохранено {len(clusters_data)} кластеров")
-    
-    def load_clusters(self):
-        """Загрузить все кластеры с весами"""
+                DELETE FROM cluster_weights
+                WHERE cluster_id IN (SELECT cluster_id FROM clusters WHERE generation_id = ?)
+            ''', (generation_id,))
+            cursor.execute('DELETE FROM clusters WHERE generation_id = ?', (generation_id,))
+            cursor.execute('DELETE FROM weight_snapshots WHERE generation_id = ?', (generation_id,))
+            cursor.execute('DELETE FROM model_generations WHERE generation_id = ?', (generation_id,))
+
+        if stale:
+            print(f"🧹 Удалено старых поколений модели: {len(stale)}")
+        # Файлы, на которые ссылается оставшееся поколение, не трогаем
+        cursor.execute('SELECT models_path FROM model_generations WHERE models_path IS NOT NULL')
+        in_use = {row[0] for row in cursor.fetchall()}
+        return [path for _, path in stale if path and path not in in_use]
+
+    @staticmethod
+    def _remove_model_files(paths):
+        for path in paths:
+            for suffix in MODEL_FILE_SUFFIXES:
+                try:
+                    os.remove(f'{path}{suffix}')
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"⚠️ Не удалось удалить {path}{suffix}: {e}")
+
+    def save_cluster_weights(self, rows, events=(), snapshot=None, wait=False):
+        """Записывает измененные веса [(cluster_id, digit, weight), ...] одним UPSERT.
+
+        В той же транзакции в журнал дописываются события
+        [(cluster_id, код фидбека, true_label, rate, min_weight), ...], которые
+        привели к этим весам, и, если передан, снимок (cluster_ids, матрица K x 10).
+        Строки удаленных кластеров (после переобучения или сброса) пропускаются.
+        """
+        def op(cursor):
+            if events:
+                cursor.executemany('''
+                    INSERT INTO feedback_events (cluster_id, kind, true_label, rate, min_weight)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', events)
+            cursor.executemany('''
+                INSERT INTO cluster_weights (cluster_id, digit, weight)
+                SELECT ?1, ?2, ?3 WHERE EXISTS (SELECT 1 FROM clusters WHERE cluster_id = ?1)
+                ON CONFLICT (cluster_id, digit) DO UPDATE SET weight = excluded.weight
+            ''', rows)
+            updated = cursor.rowcount
+            if snapshot is not None:
+                self._insert_weight_snapshot(cursor, *snapshot, 'periodic')
+            return updated
+
+        return self._write(op, wait=wait)
+
+    # ===== ЖУРНАЛ СОБЫТИЙ ФИДБЕКА =====
+
+    def _insert_weight_snapshot(self, cursor, cluster_ids, weights, kind, generation_id=None):
+        """Снимок весов, учитывающий все события журнала на момент записи.
+
+        Без generation_id снимок относится к активному поколению.
+        """
+        cursor.execute('''
+            INSERT INTO weight_snapshots (kind, last_event_id, cluster_ids, weights, generation_id)
+            VALUES (?, (SELECT COALESCE(MAX(event_id), 0) FROM feedback_events), ?, ?,
+                    COALESCE(?, (SELECT generation_id FROM active_generation WHERE id = 1)))
+        ''', (kind, encode_array(cluster_ids, np.int64), encode_array(weights, np.float32), generation_id))
+
+    def load_weight_snapshot(self, initial=False):
+        """Последний снимок весов активного поколения.
+
+        initial=True - снимок на момент сохранения кластеров (для воспроизведения
+        с другими параметрами). Возвращает (last_event_id, cluster_ids, weights) или None.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT last_event_id, cluster_ids, weights FROM weight_snapshots
+            WHERE generation_id = (SELECT generation_id FROM active_generation WHERE id = 1)
+              AND (? = 0 OR kind = 'initial')
+            ORDER BY snapshot_id DESC
+            LIMIT 1
+        ''', (int(initial),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0], decode_array(row[1]), decode_array(row[2])
+
+    def load_feedback_events(self, after_event_id=0):
+        """События журнала после after_event_id колонками numpy:
+        (cluster_ids, kinds, true_labels (-1 если нет), rates, min_weights)
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT cluster_id, kind, COALESCE(true_label, -1), rate, min_weight
+            FROM feedback_events
+            WHERE event_id > ?
+            ORDER BY event_id
+        ''', (after_event_id,))
+        events = np.fromiter(cursor, dtype=[('cluster_id', np.int64), ('kind', np.int64),
+                                            ('true_label', np.int64), ('rate', np.float64),
+                                            ('min_weight', np.float64)])
+        return (events['cluster_id'], events['kind'], events['true_label'],
+                events['rate'], events['min_weight'])
+
+    def replay_cluster_weights(self, params=None, from_initial=False):
+        """Восстанавливает матрицу весов (K x 10) из снимка и хвоста журнала.
+
+        params - словарь alpha/beta/gamma/min_weight для воспроизведения
+        "что если"; тогда имеет смысл from_initial=True, чтобы начать с
+        весов до первого события. Возвращает (cluster_ids, weights) или None.
+        """
+        self.flush()
+        snapshot = self.load_weight_snapshot(initial=from_initial)
+        if snapshot is None:
+            return None
+
+        last_event_id, cluster_ids, weights = snapshot
+        clusters, kinds, labels, rates, min_weights = self.load_feedback_events(last_event_id)
+        weights = replay_weights(cluster_ids, weights, clusters, kinds, labels,
+                                 rates, min_weights, params=params)
+        return cluster_ids, weights
+
+    def load_cluster_weights_matrix(self):
+        """Текущие веса активного поколения: (cluster_ids, матрица K x 10)"""
+        generation = self.load_generation_matrices()
+        if generation is None:
+            return np.empty(0, dtype=np.int64), np.empty((0, 10), dtype=np.float32)
+        cluster_ids, _, weights, _ = generation
+        return cluster_ids, weights
+
+    @staticmethod
+    def _weights_rows_to_matrix(rows):
+        cluster_ids = sorted({row[0] for row in rows})
+        row_of = {cluster_id: i for i, cluster_id in enumerate(cluster_ids)}
+        weights = np.zeros((len(cluster_ids), 10), dtype=np.float64)
+        for cluster_id, digit, weight in rows:
+            weights[row_of[cluster_id], digit] = weight
+        return np.array(cluster_ids, dtype=np.int64), weights
+
+    def load_generation_matrices(self):
+        """Загружает активное поколение одной строкой без разбора по кластерам.
+
+        Возвращает (cluster_ids [K], centroids [K x D], weights [K x 10], params)
+        или None. Центроиды - представление BLOB через np.frombuffer (только
+        чтение); веса - копия, поверх которой наложены строки cluster_weights,
+        записанные онлайн-обучением.
+        """
         cursor = self.conn.cursor()
-        
         cursor.execute('''
-            SELECT c.cluster_id, c.centroid, c.algorithm_params, 
-                   cw.digit, cw.weight
-            FROM clusters c
-            JOIN cluster_weights cw ON c.cluster_id = cw.cluster_id
-            ORDER BY c.cluster_id, cw.digit
+            SELECT g.generation_id, g.cluster_ids, g.centroids, g.weights, g.params
+            FROM active_generation a
+            JOIN model_generations g ON g.generation_id = a.generation_id
+            WHERE a.id = 1
         ''')
-        
-        results = cursor.fetchall()
-        
-        if not results:
+        row = cursor.fetchone()
+        if row is None or row[1] is None:
+            return None
+
+        generation_id, ids_blob, centroids_blob, weights_blob, params_json = row
+        cluster_ids = decode_array(ids_blob)
+        centroids = decode_array(centroids_blob)
+        weights = decode_array(weights_blob).copy()
+
+        # Измененные онлайн веса - только у кластеров, получавших фидбек
+        cursor.execute('''
+            SELECT cw.cluster_id, cw.digit, cw.weight
+            FROM cluster_weights cw
+            JOIN clusters c ON c.cluster_id = cw.cluster_id
+            WHERE c.generation_id = ?
+        ''', (generation_id,))
+        updates = np.fromiter(cursor, dtype=[('cluster_id', np.int64), ('digit', np.int64),
+                                             ('weight', np.float32)])
+        if len(updates):
+            order = np.argsort(cluster_ids)
+            rows = order[np.searchsorted(cluster_ids, updates['cluster_id'], sorter=order)]
+            weights[rows, updates['digit']] = updates['weight']
+
+        return cluster_ids, centroids, weights, json.loads(params_json or '{}')
+
+    def load_clusters(self):
+        """Загрузить кластеры активного поколения с весами (списком словарей)"""
+        generation = self.load_generation_matrices()
+        if generation is None:
             return []
-        
-        clusters = {}
-        for row in results:
-            cluster_id, centroid_blob, params_json, digit, weight = row
-            
-            if cluster_id not in clusters:
-                clusters[cluster_id] = {
-                    'cluster_id': cluster_id,
-                    'centroid': pickle.loads(centroid_blob),
-                    'params': json.loads(params_json),
-                    'weights': {}
-                }
-            
-            clusters[cluster_id]['weights'][digit] = weight
-        
-        return list(clusters.values())
+
+        cluster_ids, centroids, weights, params = generation
+        return [{
+            'cluster_id': int(cluster_id),
+            'centroid': centroids[row],
+            'params': params,
+            'weights': dict(enumerate(weights[row].tolist()))
+        } for row, cluster_id in enumerate(cluster_ids)]
 
     # ===== МЕТОДЫ ДЛЯ ПРИМЕРОВ =====
     
-    def save_sample(self, image_data, features, cluster_id, predicted_label, user_feedback, verified_label=None, true_label=None):
-        """Сохранить пример с фидбеком"""
-        cursor = self.conn.cursor()
-        
-        image_blob = pickle.dumps(image_data)
-        features_blob = pickle.dumps(features) if features is not None else None
+    def save_sample(self, image_data, features, cluster_id, predicted_label, user_feedback, verified_label=None, true_label=None, wait=False,
+                    dataset_ref=None, snapshot=False):
+        """Сохранить пример с фидбеком.
+
+        dataset_ref=(dataset_id, индекс) - пример из известного набора данных:
+        хранится только ссылка, пиксели берутся из dataset_store. Остальные
+        изображения пишутся в image_store по хешу содержимого, одинаковые
+        картинки хранятся один раз. snapshot=True - в той же транзакции
+        записать снимок статистики (save_statistics_snapshot).
+
+        Запись идет через очередь; возвращает Future с sample_id
+        (или сам sample_id при wait=True).
+        """
+        dataset_id, dataset_index = dataset_ref if dataset_ref is not None else (None, None)
+        image_blob = image_hash = None
+        if dataset_ref is None and image_data is not None:
+            # Компактный бинарный формат: uint8 пиксели
+            image_blob = encode_image(image_data)
+            image_hash = hashlib.blake2b(image_blob, digest_size=16).digest()
+        features_blob = encode_features(features)
+
+        # numpy-скаляры (uint8 метки MNIST) sqlite3 записал бы как BLOB
+        cluster_id = int(cluster_id) if cluster_id is not None else None
+        predicted_label = int(predicted_label) if predicted_label is not None else None
+        verified_label = int(verified_label) if verified_label is not None else None
+        true_label = int(true_label) if true_label is not None else None
+
+        def op(cursor):
+            cursor.execute('''
+                INSERT INTO samples
+                (dataset_id, dataset_index, cluster_id, predicted_label, user_feedback, verified_label, true_label, is_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?, TRUE)
+            ''', (dataset_id, dataset_index, cluster_id, predicted_label, user_feedback, verified_label, true_label))
+            sample_id = cursor.lastrowid
+
+            if image_hash is not None:
+                cursor.execute('INSERT OR IGNORE INTO image_store (image_hash, image_data) VALUES (?, ?)',
+                               (image_hash, image_blob))
+            if image_hash is not None or features_blob is not None:
+                cursor.execute('INSERT INTO sample_blobs (sample_id, image_hash, features) VALUES (?, ?, ?)',
+                               (sample_id, image_hash, features_blob))
+            if snapshot:
+                self._insert_statistics_snapshot(cursor)
+            return sample_id
         
-        cursor.execute('''
-            INSERT INTO samples 
-            (image_data, features, cluster_id, predicted_label, user_feedback, verified_label, true_label, is_used)
-            VALUES (?, ?, ?, ?, ?, ?, ?, TRUE)
-        ''', (image_blob, features_blob, cluster_id, predicted_label, user_feedback, verified_label, true_label))
+        return self._write(op, wait=wait)
+
+    def save_verification(self, sample_id, verified_label, wait=False):
+        """Зафиксировать верифицированную метку примера"""
+        def op(cursor):
+            cursor.execute('''
+                UPDATE samples 
+                SET verified_label = ?, user_feedback = 'verified'
+                WHERE sample_id = ?
+            ''', (verified_label, sample_id))
         
-        self.conn.commit()
-        return cursor.lastrowid
+        return self._write(op, wait=wait)
 
     def get_unused_samples(self, limit=100):
         """Получить примеры, которые еще не показывались пользователю"""
         cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT sample_id, image_data, features 
-            FROM samples 
-            WHERE is_used = FALSE 
-            LIMIT ?
-        ''', (limit,))
+        self._execute_blob_query(cursor, UNUSED_SAMPLES_SQL, (limit,))
         
         results = cursor.fetchall()
         samples = []
         for row in results:
-            sample_id, image_blob, features_blob = row
+            sample_id, dataset_id, dataset_index, image_blob, features_blob = row
             samples.append({
                 'sample_id': sample_id,
-                'image_data': pickle.loads(image_blob),
-                'features': pickle.loads(features_blob)
+                'image_data': self._resolve_image(dataset_id, dataset_index, image_blob),
+                'features': decode_features(features_blob)
             })
-        
+
         return samples
 
+    def load_sample_image(self, sample_id):
+        """Изображение примера (uint8) или None, если его нет"""
+        return self.load_sample_images([sample_id]).get(int(sample_id))
+
+    def load_sample_images(self, sample_ids, conn=None):
+        """Изображения (uint8) нескольких примеров одним запросом: {sample_id: массив или None}.
+
+        conn - соединение из open_read_connection() для чтения из другого потока.
+        """
+        sample_ids = [int(sample_id) for sample_id in sample_ids]
+        if not sample_ids:
+            return {}
+
+        cursor = (conn or self.conn).cursor()
+        placeholders = ', '.join('?' * len(sample_ids))
+        self._execute_blob_query(cursor, '''
+            SELECT s.sample_id, s.dataset_id, s.dataset_index, {image}
+            FROM samples s
+            LEFT JOIN sample_blobs b ON b.sample_id = s.sample_id
+            LEFT JOIN image_store i ON i.image_hash = b.image_hash
+            WHERE s.sample_id IN ({placeholders})
+        ''', sample_ids, placeholders=placeholders)
+
+        images = dict.fromkeys(sample_ids)
+        for sample_id, dataset_id, dataset_index, image_blob in cursor.fetchall():
+            images[sample_id] = self._resolve_image(dataset_id, dataset_index, image_blob)
+        return images
+
+    def _execute_blob_query(self, cursor, template, params, **fields):
+        """Выполняет запрос-шаблон с колонками {image}/{features} (BLOB_COLUMNS)"""
+        if self._legacy_blob_columns:
+            try:
+                return cursor.execute(template.format(**LEGACY_BLOB_COLUMNS, **fields), params)
+            except sqlite3.OperationalError as e:
+                # Старые колонки уже удалены (миграция закончилась, в т.ч. в другом процессе)
+                if 'no such column' not in str(e):
+                    raise
+                self._legacy_blob_columns = False
+        return cursor.execute(template.format(**BLOB_COLUMNS, **fields), params)
+
+    @staticmethod
+    def _resolve_image(dataset_id, dataset_index, image_blob):
+        """Пиксели по ссылке на датасет, из image_store или из старой копии в sample_blobs"""
+        if dataset_id is not None:
+            return np.array(get_dataset_store(dataset_id).get_images(dataset_index))
+        if image_blob is None:
+            return None
+        return decode_image(image_blob)
+
     # ===== СТАТИСТИКА =====
     
     def get_stats(self):
@@ -279,16 +789,179 @@ class Database:
             'config_exists': self.load_system_config() is not None
         }
 
+    def start_blob_migration(self, batch_size=200):
+        """Запускает онлайн-миграцию BLOB примеров.
+
+        Сначала BLOB, оставшиеся в samples от схемы до миграции 6, переносятся
+        в sample_blobs и старые колонки удаляются; затем старые pickle-BLOB
+        перекодируются в бинарный формат. Каждая пачка - отдельная операция
+        в очереди записи, поэтому клики пользователя не ждут окончания миграции.
+        """
+        def move(cursor, last_id=0):
+            moved, last_id = self._move_blob_batch(cursor, last_id, batch_size)
+            if moved:
+                self.writer.submit(lambda c: move(c, last_id))
+            else:
+                self.writer.submit(drop).add_done_callback(on_dropped)
+            return moved
+
+        def drop(cursor):
+            self._drop_sample_blob_columns(cursor)
+            self.writer.submit(encode)
+
+        def on_dropped(future):
+            # Читатели переключаются на новые запросы только после COMMIT
+            if future.exception() is None:
+                self._legacy_blob_columns = False
+                print("✅ BLOB перенесены из samples в sample_blobs")
+
+        def encode(cursor, last_id=0):
+            migrated, last_id = self._migrate_blob_batch(cursor, last_id, batch_size)
+            if migrated:
+                self.writer.submit(lambda c: encode(c, last_id))
+            else:
+                print("✅ Миграция BLOB завершена")
+            return migrated
+
+        return self._write(move if self._legacy_blob_columns else encode)
+
+    def _move_blob_batch(self, cursor, last_id, batch_size):
+        """Переносит BLOB одной пачки строк samples после last_id в sample_blobs;
+        возвращает (число, новый last_id)"""
+        cursor.execute('''
+            SELECT sample_id FROM samples
+            WHERE sample_id > ? AND (image_data IS NOT NULL OR features IS NOT NULL)
+            ORDER BY sample_id
+            LIMIT ?
+        ''', (last_id, batch_size))
+        sample_ids = [row[0] for row in cursor.fetchall()]
+
+        if not sample_ids:
+            return 0, last_id
+
+        placeholders = ', '.join('?' * len(sample_ids))
+        cursor.execute(f'''
+            INSERT INTO sample_blobs (sample_id, image_data, features)
+            SELECT sample_id, image_data, features FROM samples
+            WHERE sample_id IN ({placeholders})
+        ''', sample_ids)
+        cursor.execute(f'''
+            UPDATE samples SET image_data = NULL, features = NULL
+            WHERE sample_id IN ({placeholders})
+        ''', sample_ids)
+
+        print(f"🔧 Перенесено BLOB {len(sample_ids)} примеров (до sample_id {sample_ids[-1]})")
+        return len(sample_ids), sample_ids[-1]
+
+    def _drop_sample_blob_columns(self, cursor):
+        """Удаляет из samples опустевшие колонки image_data и features"""
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            # DROP COLUMN переписывает таблицу без BLOB; индексы и триггеры сохраняются
+            cursor.execute('ALTER TABLE samples DROP COLUMN image_data')
+            cursor.execute('ALTER TABLE samples DROP COLUMN features')
+        else:
+            self._rebuild_table_without(cursor, 'samples', ('image_data', 'features'))
+
+    def _rebuild_table_without(self, cursor, table, dropped):
+        """Пересоздает таблицу без колонок dropped (SQLite < 3.35 не умеет DROP COLUMN).
+
+        Порядок из документации SQLite: новая таблица, копия строк, DROP старой,
+        RENAME новой, затем заново индексы и триггеры старой таблицы.
+        """
+        columns = [column for column in cursor.execute(f'PRAGMA table_info({table})')
+                   if column[1] not in dropped]
+        foreign_keys = cursor.execute(f'PRAGMA foreign_key_list({table})').fetchall()
+        cursor.execute('''
+            SELECT sql FROM sqlite_master
+            WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        ''', (table,))
+        schema = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+        sequence = cursor.fetchone()
+
+        definitions = []
+        for _, name, column_type, notnull, default, pk in columns:
+            definition = f'{name} {column_type}'
+            if pk:
+                definition += ' PRIMARY KEY AUTOINCREMENT' if sequence else ' PRIMARY KEY'
+            if notnull:
+                definition += ' NOT NULL'
+            if default is not None:
+                definition += f' DEFAULT {default}'
+            definitions.append(definition)
+        for _, _, parent, column, parent_column, *_ in foreign_keys:
+            if column not in dropped:
+                definitions.append(f'FOREIGN KEY ({column}) REFERENCES {parent}({parent_column})')
+        names = ', '.join(column[1] for column in columns)
+
+        cursor.execute(f'CREATE TABLE {table}_rebuild ({", ".join(definitions)})')
+        cursor.execute(f'INSERT INTO {table}_rebuild ({names}) SELECT {names} FROM {table}')
+        cursor.execute(f'DROP TABLE {table}')
+        # Без legacy_alter_table RENAME перепроверяет триггеры других таблиц,
+        # ссылающиеся на уже удаленную таблицу
+        cursor.execute('PRAGMA legacy_alter_table = ON')
+        try:
+            cursor.execute(f'ALTER TABLE {table}_rebuild RENAME TO {table}')
+        finally:
+            cursor.execute('PRAGMA legacy_alter_table = OFF')
+        for sql in schema:
+            cursor.execute(sql)
+        if sequence:
+            cursor.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (sequence[0], table))
+
+    def _migrate_blob_batch(self, cursor, last_id, batch_size):
+        """Перекодирует одну пачку строк после last_id; возвращает (число, новый last_id)"""
+        cursor.execute('''
+            SELECT sample_id, image_data, features
+            FROM sample_blobs
+            WHERE sample_id > ?
+            AND ((image_data IS NOT NULL AND substr(image_data, 1, 3) != ?)
+                 OR (features IS NOT NULL AND substr(features, 1, 3) != ?))
+            ORDER BY sample_id
+            LIMIT ?
+        ''', (last_id, MAGIC, MAGIC, batch_size))
+        rows = cursor.fetchall()
+
+        if not rows:
+            return 0, last_id
+
+        updates = []
+        for sample_id, image_blob, features_blob in rows:
+            try:
+                image_blob = encode_image(decode_image(image_blob)) if image_blob is not None else None
+                features_blob = encode_features(decode_features(features_blob))
+                updates.append((image_blob, features_blob, sample_id))
+            except Exception as e:
+                print(f"⚠️ Не удалось перекодировать sample_id {sample_id}: {e}")
+
+        cursor.executemany('''
+            UPDATE sample_blobs SET image_data = ?, features = ? WHERE sample_id = ?
+        ''', updates)
+
+        print(f"🔧 Перекодировано {len(updates)} примеров (до sample_id {rows[-1][0]})")
+        return len(rows), rows[-1][0]
+
     def close_connection(self):
         """Закрыть соединение с БД"""
+        if self.writer:
+            self.writer.close()  # Дописывает очередь перед закрытием
+            self.writer = None
         if self.conn:
+            try:
+                self.conn.execute('PRAGMA optimize')  # Обновляет статистику планировщика при необходимости
+            except sqlite3.Error as e:
+                print(f"⚠️ PRAGMA optimize: {e}")
             self.conn.close()
             print("🔌 Соединение с БД закрыто")
     
     def reconnect(self):
         """Переподключиться к БД"""
         self.close_connection()
-        self.conn = sqlite3.connect('data/feedback.db')
+        self.conn = sqlite3.connect(self.db_path)
+        self.configure_connection(self.conn)
+        self.writer = WriteBehindQueue(self.db_path, configure=self.configure_connection)
+        self._config_data_version = None  # data_version нового соединения не сравнима со старой
+        self._aggregates_cache = None
         print("🔌 Соединение с БД восстановлено")
 
     def add_true_label_column(self):
@@ -315,64 +988,448 @@ class Database:
             print(f"❌ Ошибка добавления колонки true_label: {e}")
 
     def save_statistics_snapshot(self):
-        """Сохраняет снимок текущей статистики"""
-        cursor = self.conn.cursor()
-    
-        # Собираем текущие данные
-        cursor.execute("SELECT COUNT(*) FROM samples")
-        total_samples = cursor.fetchone()[0]
-    
-        cursor.execute("SELECT COUNT(*) FROM samples WHERE user_feedback = 'yes'")
-        correct_predictions = cursor.fetchone()[0]
-    
-        cursor.execute("SELECT COUNT(*) FROM clusters")
-        active_clusters = cursor.fetchone()[0]
-    
-        # Статистика по фидбекам
-        cursor.execute("SELECT COUNT(*) FROM samples WHERE user_feedback = 'yes'")
-        feedback_yes = cursor.fetchone()[0]
-    
-        cursor.execute("SELECT COUNT(*) FROM samples WHERE user_feedback = 'no'")
-        feedback_no = cursor.fetchone()[0]
-    
-        cursor.execute("SELECT COUNT(*) FROM samples WHERE user_feedback = 'unsure'")
-        feedback_unsure = cursor.fetchone()[0]
-    
-        cursor.execute("SELECT COUNT(*) FROM samples WHERE user_feedback = 'verified'")
-        feedback_verified = cursor.fetchone()[0]
-    
-        accuracy = correct_predictions / total_samples if total_samples > 0 else 0
-    
-        # Сохраняем снимок
+        """Сохраняет снимок текущей статистики (в потоке записи).
+
+        Счетчики поддерживаются триггерами, поэтому снимок - это O(1)
+        копирование одной строки feedback_counters.
+        """
+        return self._write(self._insert_statistics_snapshot)
+
+    @staticmethod
+    def _insert_statistics_snapshot(cursor):
         cursor.execute('''
             INSERT INTO statistics 
             (total_samples, correct_predictions, accuracy, active_clusters,
             feedback_yes, feedback_no, feedback_unsure, feedback_verified)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (total_samples, correct_predictions, accuracy, active_clusters,
-              feedback_yes, feedback_no, feedback_unsure, feedback_verified))
-    
-        self.conn.commit()
+            SELECT total_samples, feedback_yes,
+                   CASE WHEN total_samples > 0 THEN feedback_yes * 1.0 / total_samples ELSE 0 END,
+                   active_clusters,
+                   feedback_yes, feedback_no, feedback_unsure, feedback_verified
+            FROM feedback_counters WHERE id = 1
+        ''')
 
-    def get_latest_statistics(self):
-        """Возвращает последнюю статистику"""
+    # ===== СЧЕТЧИКИ ФИДБЕКА =====
+
+    def _create_counter_triggers(self, cursor):
+        """Триггеры, поддерживающие feedback_counters в той же транзакции, что и запись"""
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS samples_counters_insert AFTER INSERT ON samples
+            BEGIN
+                UPDATE feedback_counters SET
+                    total_samples = total_samples + 1,
+                    feedback_yes = feedback_yes + (NEW.user_feedback IS 'yes'),
+                    feedback_no = feedback_no + (NEW.user_feedback IS 'no'),
+                    feedback_unsure = feedback_unsure + (NEW.user_feedback IS 'unsure'),
+                    feedback_verified = feedback_verified + (NEW.user_feedback IS 'verified')
+                WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS samples_counters_delete AFTER DELETE ON samples
+            BEGIN
+                UPDATE feedback_counters SET
+                    total_samples = total_samples - 1,
+                    feedback_yes = feedback_yes - (OLD.user_feedback IS 'yes'),
+                    feedback_no = feedback_no - (OLD.user_feedback IS 'no'),
+                    feedback_unsure = feedback_unsure - (OLD.user_feedback IS 'unsure'),
+                    feedback_verified = feedback_verified - (OLD.user_feedback IS 'verified')
+                WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS samples_counters_update AFTER UPDATE OF user_feedback ON samples
+            BEGIN
+                UPDATE feedback_counters SET
+                    feedback_yes = feedback_yes - (OLD.user_feedback IS 'yes') + (NEW.user_feedback IS 'yes'),
+                    feedback_no = feedback_no - (OLD.user_feedback IS 'no') + (NEW.user_feedback IS 'no'),
+                    feedback_unsure = feedback_unsure - (OLD.user_feedback IS 'unsure') + (NEW.user_feedback IS 'unsure'),
+                    feedback_verified = feedback_verified - (OLD.user_feedback IS 'verified') + (NEW.user_feedback IS 'verified')
+                WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS clusters_counters_insert AFTER INSERT ON clusters
+            BEGIN
+                UPDATE feedback_counters SET active_clusters = active_clusters + 1 WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS clusters_counters_delete AFTER DELETE ON clusters
+            BEGIN
+                UPDATE feedback_counters SET active_clusters = active_clusters - 1 WHERE id = 1;
+            END
+        ''')
+
+    def _count_feedback(self, cursor):
+        """Считает счетчики полным сканированием (эталон для проверки)"""
+        cursor.execute('''
+            SELECT COUNT(*),
+                   COALESCE(SUM(user_feedback IS 'yes'), 0),
+                   COALESCE(SUM(user_feedback IS 'no'), 0),
+                   COALESCE(SUM(user_feedback IS 'unsure'), 0),
+                   COALESCE(SUM(user_feedback IS 'verified'), 0)
+            FROM samples
+        ''')
+        total, yes, no, unsure, verified = cursor.fetchone()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'active_generation'")
+        if cursor.fetchone():
+            cursor.execute('''
+                SELECT COUNT(*) FROM clusters
+                WHERE generation_id = (SELECT generation_id FROM active_generation WHERE id = 1)
+            ''')
+        else:
+            cursor.execute('SELECT COUNT(*) FROM clusters')  # До миграции 3 поколений нет
+        active_clusters = cursor.fetchone()[0]
+        return {
+            'total_samples': total,
+            'feedback_yes': yes,
+            'feedback_no': no,
+            'feedback_unsure': unsure,
+            'feedback_verified': verified,
+            'active_clusters': active_clusters
+        }
+
+    def _rebuild_counters(self, cursor):
+        counts = self._count_feedback(cursor)
+        cursor.execute('''
+            INSERT OR REPLACE INTO feedback_counters
+            (id, total_samples, feedback_yes, feedback_no, feedback_unsure, feedback_verified, active_clusters)
+            VALUES (1, :total_samples, :feedback_yes, :feedback_no, :feedback_unsure,
+                    :feedback_verified, :active_clusters)
+        ''', counts)
+        return counts
+
+    def get_feedback_counters(self):
+        """Текущие счетчики фидбека (одна строка, O(1))"""
         cursor = self.conn.cursor()
         cursor.execute('''
-            SELECT * FROM statistics 
-            ORDER BY timestamp DESC 
-            LIMIT 1
+            SELECT total_samples, feedback_yes, feedback_no, feedback_unsure,
+                   feedback_verified, active_clusters
+            FROM feedback_counters WHERE id = 1
+        ''')
+        row = cursor.fetchone()
+        keys = ('total_samples', 'feedback_yes', 'feedback_no', 'feedback_unsure',
+                'feedback_verified', 'active_clusters')
+        return dict(zip(keys, row)) if row else dict.fromkeys(keys, 0)
+
+    def check_counters(self, rebuild=False):
+        """Сверяет счетчики с полным пересчетом.
+
+        Возвращает {счетчик: (хранимое, фактическое)} для расхождений.
+        При rebuild=True счетчики пересчитываются и сохраняются.
+        """
+        if self.writer:
+            self.writer.flush()
+        stored = self.get_feedback_counters()
+        actual = self._count_feedback(self.conn.cursor())
+        mismatches = {key: (stored[key], actual[key]) for key in actual if stored[key] != actual[key]}
+
+        if mismatches:
+            print(f"⚠️ Расхождения счетчиков: {mismatches}")
+        else:
+            print("✅ Счетчики согласованы")
+
+        if rebuild:
+            if self.writer:
+                self._write(self._rebuild_counters, wait=True)
+            else:
+                self._rebuild_counters(self.conn.cursor())
+                self.conn.commit()
+            print("✅ Счетчики пересчитаны")
+        return mismatches
+
+    # ===== МИГРАЦИИ СХЕМЫ =====
+
+    def _migration_1_feedback_counters(self, cursor):
+        """Таблица счетчиков фидбека и триггеры для нее"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS feedback_counters (
+                id INTEGER PRIMARY KEY CHECK (id = 1),  -- Всегда одна запись
+                total_samples INTEGER NOT NULL DEFAULT 0,
+                feedback_yes INTEGER NOT NULL DEFAULT 0,
+                feedback_no INTEGER NOT NULL DEFAULT 0,
+                feedback_unsure INTEGER NOT NULL DEFAULT 0,
+                feedback_verified INTEGER NOT NULL DEFAULT 0,
+                active_clusters INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self._rebuild_counters(cursor)
+        self._create_counter_triggers(cursor)
+
+    def _migration_2_feedback_journal(self, cursor):
+        """Журнал событий фидбека и снимки весов кластеров"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS feedback_events (
+                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cluster_id INTEGER NOT NULL,
+                kind INTEGER NOT NULL,                  -- Код из weight_store.FEEDBACK_CODES
+                true_label INTEGER,                     -- Только для верификации
+                rate REAL NOT NULL,                     -- Примененный alpha/gamma/beta
+                min_weight REAL NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS weight_snapshots (
+                snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,                     -- 'initial' или 'periodic'
+                last_event_id INTEGER NOT NULL,         -- Снимок учитывает события до него
+                cluster_ids BLOB NOT NULL,              -- int64 [K]
+                weights BLOB NOT NULL,                  -- float32 [K x 10]
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Текущие веса становятся точкой отсчета журнала
+        cursor.execute('SELECT cluster_id, digit, weight FROM cluster_weights ORDER BY cluster_id, digit')
+        rows = cursor.fetchall()
+        if rows:
+            cluster_ids, weights = self._weights_rows_to_matrix(rows)
+            cursor.execute('''
+                INSERT INTO weight_snapshots (kind, last_event_id, cluster_ids, weights)
+                VALUES ('initial', 0, ?, ?)
+            ''', (encode_array(cluster_ids, np.int64), encode_array(weights, np.float32)))
+
+    def _migration_3_model_generations(self, cursor):
+        """Поколения модели и указатель активного поколения"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS model_generations (
+                generation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                models_path TEXT,                       -- Префикс файлов экстрактора/кластеризатора
+                cluster_count INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS active_generation (
+                id INTEGER PRIMARY KEY CHECK (id = 1),  -- Всегда одна запись
+                generation_id INTEGER REFERENCES model_generations(generation_id)
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO active_generation (id, generation_id) VALUES (1, NULL)')
+        cursor.execute('ALTER TABLE clusters ADD COLUMN generation_id INTEGER')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_clusters_generation ON clusters(generation_id)')
+        cursor.execute('ALTER TABLE weight_snapshots ADD COLUMN generation_id INTEGER')
+
+        # Все накопленные кластеры становятся первым поколением
+        cursor.execute('SELECT COUNT(*) FROM clusters')
+        cluster_count = cursor.fetchone()[0]
+        if cluster_count:
+            legacy_path = 'models/hybrid_system'
+            models_path = legacy_path if os.path.exists(f'{legacy_path}_extractor.h5') else None
+            cursor.execute('INSERT INTO model_generations (models_path, cluster_count) VALUES (?, ?)',
+                           (models_path, cluster_count))
+            generation_id = cursor.lastrowid
+            cursor.execute('UPDATE clusters SET generation_id = ?', (generation_id,))
+            cursor.execute('UPDATE weight_snapshots SET generation_id = ?', (generation_id,))
+            cursor.execute('UPDATE active_generation SET generation_id = ? WHERE id = 1', (generation_id,))
+
+        # Активные кластеры теперь считаются по указателю, а не по всей таблице
+        cursor.execute('DROP TRIGGER IF EXISTS clusters_counters_insert')
+        cursor.execute('DROP TRIGGER IF EXISTS clusters_counters_delete')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS active_generation_counters
+            AFTER UPDATE OF generation_id ON active_generation
+            BEGIN
+                UPDATE feedback_counters SET active_clusters =
+                    (SELECT COUNT(*) FROM clusters WHERE generation_id = NEW.generation_id)
+                WHERE id = 1;
+            END
+        ''')
+        self._rebuild_counters(cursor)
+
+    def _migration_4_generation_blobs(self, cursor):
+        """Центроиды и веса поколения одним BLOB каждый"""
+        cursor.execute('ALTER TABLE model_generations ADD COLUMN cluster_ids BLOB')   # int64 [K]
+        cursor.execute('ALTER TABLE model_generations ADD COLUMN centroids BLOB')     # float32 [K x D]
+        cursor.execute('ALTER TABLE model_generations ADD COLUMN weights BLOB')       # float32 [K x 10]
+        cursor.execute('ALTER TABLE model_generations ADD COLUMN params TEXT')        # JSON параметров кластеризации
+
+        cursor.execute('SELECT generation_id FROM model_generations')
+        for (generation_id,) in cursor.fetchall():
+            cursor.execute('''
+                SELECT cluster_id, centroid, algorithm_params FROM clusters
+                WHERE generation_id = ? ORDER BY cluster_id
+            ''', (generation_id,))
+            clusters = cursor.fetchall()
+            cursor.execute('''
+                SELECT cw.cluster_id, cw.digit, cw.weight FROM cluster_weights cw
+                JOIN clusters c ON c.cluster_id = cw.cluster_id
+                WHERE c.generation_id = ?
+            ''', (generation_id,))
+            weight_ids, weights = self._weights_rows_to_matrix(cursor.fetchall())
+
+            cluster_ids = np.array([row[0] for row in clusters], dtype=np.int64)
+            if clusters:
+                centroids = np.stack([decode_features(row[1]).astype(np.float32).ravel() for row in clusters])
+            else:
+                centroids = np.zeros((0, 0), dtype=np.float32)
+            matrix = np.full((len(cluster_ids), 10), 0.1, dtype=np.float32)
+            matrix[np.searchsorted(cluster_ids, weight_ids)] = weights
+            params = clusters[0][2] if clusters and clusters[0][2] else '{}'
+
+            cursor.execute('''
+                UPDATE model_generations SET cluster_ids = ?, centroids = ?, weights = ?, params = ?
+                WHERE generation_id = ?
+            ''', (encode_array(cluster_ids, np.int64), encode_array(centroids, np.float32),
+                  encode_array(matrix, np.float32), params, generation_id))
+
+        # Данные перенесены в BLOB поколения - по-строчные копии больше не нужны
+        cursor.execute('UPDATE clusters SET centroid = NULL, algorithm_params = NULL')
+        cursor.execute('DELETE FROM cluster_weights')
+
+    def _migration_5_hot_query_indexes(self, cursor):
+        """Индексы для горячих запросов вкладок"""
+        for name, sql in SAMPLE_INDEXES:
+            cursor.execute(sql)
+        cursor.execute('ANALYZE')
+
+    def _migration_6_sample_blobs(self, cursor):
+        """BLOB примеров в отдельную таблицу sample_blobs"""
+        # Строка samples остается в несколько десятков байт: COUNT, GROUP BY
+        # и фильтры по метаданным не листают страницы с изображениями.
+        # Сами BLOB переносит пачками фоновая миграция (start_blob_migration),
+        # она же удаляет старые колонки - запуск не ждет копирования
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sample_blobs (
+                sample_id INTEGER PRIMARY KEY,          -- = samples.sample_id
+                image_data BLOB,                        -- Бинарные данные изображения
+                features BLOB                           -- Вектор признаков от экстрактора
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS samples_blobs_delete AFTER DELETE ON samples
+            BEGIN
+                DELETE FROM sample_blobs WHERE sample_id = OLD.sample_id;
+            END
+        ''')
+
+    def _migration_7_dataset_refs(self, cursor):
+        """Ссылки на датасет вместо пикселей и image_store с дедупликацией по хешу"""
+        cursor.execute('ALTER TABLE samples ADD COLUMN dataset_id TEXT')         # 'mnist' и т.п.
+        cursor.execute('ALTER TABLE samples ADD COLUMN dataset_index INTEGER')   # Глобальный индекс в наборе
+        cursor.execute('ALTER TABLE sample_blobs ADD COLUMN image_hash BLOB')    # -> image_store
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_store (
+                image_hash BLOB PRIMARY KEY,            -- blake2b-128 от закодированного изображения
+                image_data BLOB NOT NULL
+            ) WITHOUT ROWID
         ''')
+        # Уже сохраненные копии пикселей остаются в sample_blobs.image_data и читаются как раньше
+
+    def _migration_8_integer_labels(self, cursor):
+        """Метки, записанные numpy-скалярами как BLOB, - в INTEGER"""
+        # До приведения в save_sample uint8/int64 из numpy попадали в БД байтами;
+        # GROUP BY и сравнения меток такие строки считали отдельными значениями
+        for column in ('cluster_id', 'predicted_label', 'true_label', 'verified_label'):
+            cursor.execute(f"SELECT sample_id, {column} FROM samples WHERE typeof({column}) = 'blob'")
+            fixed = [
+                # 1 байт - uint8 (метки MNIST), длиннее - знаковые int32/int64 (cluster_id = -1)
+                (int.from_bytes(value, byteorder='little', signed=len(value) > 1), sample_id)
+                for sample_id, value in cursor.fetchall()
+            ]
+            if fixed:
+                cursor.executemany(f'UPDATE samples SET {column} = ? WHERE sample_id = ?', fixed)
+                print(f"   {column}: исправлено строк {len(fixed)}")
+
+    def explain(self, assert_indexed=True):
+        """Печатает планы горячих запросов (EXPLAIN QUERY PLAN).
+
+        При assert_indexed=True бросает AssertionError, если какой-то запрос
+        сканирует таблицу без индекса или сортирует через временное B-дерево.
+        Возвращает {имя запроса: [строки плана]}.
+        """
+        cursor = self.conn.cursor()
+        plans = {}
+        slow = []
+        for name, sql, params in HOT_QUERIES:
+            details = [row[3] for row in cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+            plans[name] = details
+            bad = [d for d in details
+                   if (d.startswith('SCAN') and 'INDEX' not in d) or 'TEMP B-TREE' in d]
+            print(f"{'❌' if bad else '✅'} {name}: {'; '.join(details)}")
+            if bad:
+                slow.append(name)
+
+        if assert_indexed and slow:
+            raise AssertionError(f"Запросы без индекса: {', '.join(slow)}")
+        return plans
+
+    def _schema_migrations(self):
+        """Упорядоченный список миграций; номер версии = позиция в списке"""
+        return [
+            self._migration_1_feedback_counters,
+            self._migration_2_feedback_journal,
+            self._migration_3_model_generations,
+            self._migration_4_generation_blobs,
+            self._migration_5_hot_query_indexes,
+            self._migration_6_sample_blobs,
+            self._migration_7_dataset_refs,
+            self._migration_8_integer_labels,
+        ]
+
+    def apply_schema_migrations(self):
+        """Применяет недостающие миграции по PRAGMA user_version"""
+        cursor = self.conn.cursor()
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        migrations = self._schema_migrations()
+
+        for number, migration in enumerate(migrations[version:], start=version + 1):
+            print(f"🔧 Миграция схемы {number}: {migration.__doc__}")
+            try:
+                cursor.execute('BEGIN')  # DDL + данные + версия - одной транзакцией
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {number}')
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def get_latest_statistics(self):
+        """Возвращает последнюю статистику"""
+        cursor = self.conn.cursor()
+        cursor.execute(LATEST_STATISTICS_SQL)
         return cursor.fetchone()
 
     def get_statistics_history(self, hours=24):
         """Возвращает историю статистики за указанные часы"""
         cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM statistics 
-            WHERE timestamp >= datetime('now', ?)
-            ORDER BY timestamp
-        ''', (f'-{hours} hours',))
+        cursor.execute(STATISTICS_HISTORY_SQL, (f'-{hours} hours',))
         return cursor.fetchall()
+
+    def get_result_aggregates(self):
+        """Агрегаты для вкладки результатов, посчитанные на стороне SQLite.
+
+        Возвращает словарь:
+            counters        - get_feedback_counters() (строка, поддерживаемая триггерами)
+            confusion       - матрица 10 x 10: [истинная цифра][выбранная при верификации]
+            digit_accuracy  - {цифра: {'correct': n, 'total': n}} по матрице
+
+        Результат кэшируется до изменения PRAGMA data_version, так что
+        повторный вызов без новых записей ничего не читает из таблиц.
+        Возвращаемый словарь общий - не изменяйте его.
+        """
+        data_version = self.data_version()
+        if self._aggregates_cache and self._aggregates_cache[0] == data_version:
+            return self._aggregates_cache[1]
+
+        cursor = self.conn.cursor()
+        confusion = [[0] * 10 for _ in range(10)]
+        for true_label, verified_label, count in cursor.execute(CONFUSION_MATRIX_SQL):
+            if true_label in range(10) and verified_label in range(10):
+                confusion[true_label][verified_label] = count
+
+        aggregates = {
+            'counters': self.get_feedback_counters(),
+            'confusion': confusion,
+            'digit_accuracy': {
+                digit: {'correct': confusion[digit][digit], 'total': sum(confusion[digit])}
+                for digit in range(10)
+            }
+        }
+        self._aggregates_cache = (data_version, aggregates)
+        return aggregates
     
     def check_statistics_table(self):
         """Проверяет структуру таблицы statistics"""
@@ -381,4 +1438,65 @@ class Database:
         columns = cursor.fetchall()
         print("🔍 Структура таблицы statistics:")
         for col in columns:
-            print(f"   {col}")
\ No newline at end of file
+            print(f"   {col}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных")
+    parser.add_argument('--check-counters', action='store_true',
+                        help="сверить счетчики фидбека с полным пересчетом")
+    parser.add_argument('--rebuild-counters', action='store_true',
+                        help="пересчитать счетчики фидбека")
+    parser.add_argument('--explain', action='store_true',
+                        help="показать планы горячих запросов и проверить индексы")
+    parser.add_argument('--replay-weights', action='store_true',
+                        help="воспроизвести журнал фидбека и сравнить с текущими весами")
+    parser.add_argument('--rebuild-weights', action='store_true',
+                        help="восстановить cluster_weights из снимка и журнала")
+    for name in ('alpha', 'beta', 'gamma', 'min-weight'):
+        parser.add_argument(f'--{name}', type=float,
+                            help="параметр для воспроизведения \"что если\" (с начальных весов)")
+    args = parser.parse_args()
+
+    db = Database()
+    try:
+        if args.check_counters or args.rebuild_counters:
+            db.check_counters(rebuild=args.rebuild_counters)
+
+        if args.explain:
+            db.explain()
+
+        if args.replay_weights or args.rebuild_weights:
+            import time
+
+            params = {key: value for key, value in
+                      (('alpha', args.alpha), ('beta', args.beta),
+                       ('gamma', args.gamma), ('min_weight', args.min_weight))
+                      if value is not None} or None
+            start = time.perf_counter()
+            replayed = db.replay_cluster_weights(params, from_initial=params is not None)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            if replayed is None:
+                print("⚠️ Нет снимков весов для воспроизведения")
+            else:
+                cluster_ids, weights = replayed
+                current_ids, current = db.load_cluster_weights_matrix()
+                print(f"⏱️  Воспроизведение журнала: {elapsed_ms:.1f} мс, {len(cluster_ids)} кластеров")
+                if np.array_equal(cluster_ids, current_ids):
+                    changed = np.flatnonzero(weights.argmax(axis=1) != current.argmax(axis=1))
+                    print(f"   Макс. отличие от текущих весов: {np.abs(weights - current).max():.2e}")
+                    print(f"   Кластеров со сменой предсказанной цифры: {len(changed)}")
+                    for row in changed:
+                        print(f"      кластер {cluster_ids[row]}: "
+                              f"{current[row].argmax()} -> {weights[row].argmax()}")
+
+                if args.rebuild_weights:
+                    rows = [(int(cluster_id), digit, float(weights[row, digit]))
+                            for row, cluster_id in enumerate(cluster_ids) for digit in range(10)]
+                    db.save_cluster_weights(rows, wait=True)
+                    print("✅ Веса кластеров восстановлены из журнала")
+    finally:
+        db.close_connection()
@@ -0,0 +1,133 @@
+import os
+import threading
+import numpy as np
+
+# MNIST хранится один раз в виде uint8 в memory-mapped файлах:
+# сначала 60000 обучающих, затем 10000 тестовых изображений
+MNIST_IMAGES_PATH = 'data/mnist_images.u8'
+MNIST_LABELS_PATH = 'data/mnist_labels.u8'
+MNIST_TRAIN_SIZE = 60000
+IMAGE_SHAPE = (28, 28)
+
+
+class DatasetView:
+    """Срез набора данных без копирования.
+
+    Индексация возвращает float32 изображения в [0, 1], нормализация
+    выполняется лениво только для запрошенных элементов.
+    """
+
+    def __init__(self, store, start, stop):
+        self.store = store
+        self.start = start
+        self.stop = stop
+        self.images = store.images[start:stop]  # uint8 memmap view
+        self.labels = store.labels[start:stop]  # uint8 memmap view
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, idx):
+        return normalize(self.images[idx])
+
+    def raw(self, idx):
+        """uint8 пиксели без нормализации"""
+        return self.images[idx]
+
+    def global_index(self, idx):
+        """Индекс элемента во всем наборе (для ссылок на датасет)"""
+        return self.start + int(idx)
+
+    def reference(self, idx):
+        """Ссылка (dataset_id, глобальный индекс), которую пример хранит вместо пикселей"""
+        return self.store.dataset_id, self.global_index(idx)
+
+
+class MnistStore:
+    """Общий memory-mapped MNIST для всех вкладок и обучения"""
+
+    dataset_id = 'mnist'
+
+    def __init__(self, images_path=MNIST_IMAGES_PATH, labels_path=MNIST_LABELS_PATH):
+        if not (os.path.exists(images_path) and os.path.exists(labels_path)):
+            self._build(images_path, labels_path)
+
+        image_size = IMAGE_SHAPE[0] * IMAGE_SHAPE[1]
+        count = os.path.getsize(images_path) // image_size
+
+        self.images = np.memmap(images_path, dtype=np.uint8, mode='r', shape=(count,) + IMAGE_SHAPE)
+        self.labels = np.memmap(labels_path, dtype=np.uint8, mode='r', shape=(count,))
+        print(f"✅ MNIST подключен из {images_path}: {count} изображений (uint8, memmap)")
+
+    def _build(self, images_path, labels_path):
+        """Однократно распаковывает MNIST в memmap-файлы"""
+        from tensorflow.keras.datasets import mnist
+
+        print("📦 Распаковываем MNIST в memory-mapped хранилище...")
+        (x_train, y_train), (x_test, y_test) = mnist.load_data()
+
+        os.makedirs(os.path.dirname(images_path), exist_ok=True)
+        for path, parts in ((images_path, (x_train, x_test)), (labels_path, (y_train, y_test))):
+            # Пишем во временный файл и атомарно переименовываем,
+            # чтобы параллельный процесс не увидел недописанный файл
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                for part in parts:
+                    f.write(np.ascontiguousarray(part, dtype=np.uint8).tobytes())
+            os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.images)
+
+    def split(self, name):
+        """Возвращает DatasetView для 'train', 'test' или 'all'"""
+        if name == 'train':
+            return DatasetView(self, 0, MNIST_TRAIN_SIZE)
+        if name == 'test':
+            return DatasetView(self, MNIST_TRAIN_SIZE, len(self))
+        if name == 'all':
+            return DatasetView(self, 0, len(self))
+        raise ValueError(f"Неизвестная часть датасета: {name}")
+
+    def get_images(self, indices):
+        """uint8 изображения по глобальным индексам"""
+        return self.images[indices]
+
+    def get_normalized(self, indices):
+        """float32 изображения в [0, 1] по глобальным индексам"""
+        return normalize(self.images[indices])
+
+    def get_labels(self, indices):
+        return np.asarray(self.labels[indices])
+
+
+def normalize(images):
+    """uint8 -> float32 в [0, 1]"""
+    return np.asarray(images, dtype=np.float32) / 255.0
+
+
+_mnist_store = None
+_mnist_lock = threading.Lock()
+
+
+def get_mnist_store():
+    """Возвращает общий экземпляр MnistStore (создается при первом вызове)"""
+    global _mnist_store
+    with _mnist_lock:
+        if _mnist_store is None:
+            _mnist_store = MnistStore()
+        return _mnist_store
+
+
+# dataset_id -> функция, возвращающая хранилище (по ним разрешаются ссылки из samples)
+DATASET_STORES = {
+    MnistStore.dataset_id: get_mnist_store,
+}
+
+
+def get_dataset_store(dataset_id):
+    """Хранилище набора данных по dataset_id"""
+    try:
+        return DATASET_STORES[dataset_id]()
+    except KeyError:
+        raise ValueError(f"Неизвестный набор данных: {dataset_id}") from None
@@ -0,0 +1,136 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Отдельный поток-писатель SQLite с групповой фиксацией.
+
+    Поток владеет собственным соединением и принимает операции через
+    очередь. Операция - это функция f(cursor), ее результат возвращается
+    через Future после COMMIT. Операции собираются в одну транзакцию, пока
+    не пройдет flush_interval_ms или не наберется max_batch_ops.
+    """
+
+    def __init__(self, db_path, configure=None, flush_interval_ms=50, max_batch_ops=64):
+        self.db_path = db_path
+        self.configure = configure
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_batch_ops = max_batch_ops
+        self._queue = queue.Queue()
+        self._closed = False
+        # Проверка _closed и постановка в очередь - под одной блокировкой:
+        # после _STOP в очередь ничего не попадает, все до него будет дописано
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, op):
+        """Ставит операцию f(cursor) в очередь, возвращает Future с ее результатом"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Очередь записи закрыта")
+            self._queue.put((op, future, False))
+        return future
+
+    def flush(self, timeout=None):
+        """Барьер: ждет, пока все ранее поставленные операции будут зафиксированы"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                return
+            self._queue.put((None, future, True))
+        future.result(timeout)
+
+    def close(self):
+        """Фиксирует оставшиеся операции и останавливает поток"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        if self.configure:
+            self.configure(conn)
+        cursor = conn.cursor()
+
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            # Барьер фиксирует то, что уже накоплено, не дожидаясь таймера
+            while not batch[-1][2] and len(batch) < self.max_batch_ops:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._commit_batch(conn, cursor, batch)
+
+        # Дописываем все, что осталось в очереди
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftovers.append(item)
+        if leftovers:
+            self._commit_batch(conn, cursor, leftovers)
+
+        conn.close()
+
+    def _commit_batch(self, conn, cursor, batch):
+        results = []
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for op, future, _ in batch:
+                if op is None:
+                    results.append((future, None, None))
+                    continue
+                # Каждая операция в своей точке сохранения: ошибка одной
+                # не откатывает остальные операции пачки
+                cursor.execute('SAVEPOINT op')
+                try:
+                    result = op(cursor)
+                    cursor.execute('RELEASE op')
+                    results.append((future, result, None))
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO op')
+                    cursor.execute('RELEASE op')
+                    print(f"❌ Ошибка операции записи: {e}")
+                    results.append((future, None, e))
+            cursor.execute('COMMIT')
+        except Exception as e:
+            print(f"❌ Ошибка фиксации пачки записей: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
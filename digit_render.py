@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+
+def render_digit(digit_array, scale=8):
+    """Массив цифры -> PIL-изображение в оттенках серого, увеличенное в scale раз.
+
+    Принимает uint8 (0..255) или float в [0, 1], 2D или плоский массив.
+    Увеличение - ближайшим соседом: пиксели остаются четкими квадратами.
+    """
+    array = np.asarray(digit_array)
+    if array.ndim == 1:
+        side = int(np.sqrt(array.shape[0]))
+        array = array.reshape(side, side)
+
+    if array.dtype != np.uint8:
+        # Денормализуем для отображения; округление, а не отбрасывание дробной части
+        if array.max() <= 1.0:
+            array = array * 255
+        array = np.rint(np.clip(array, 0, 255)).astype(np.uint8)
+
+    image = Image.fromarray(np.ascontiguousarray(array), mode='L')
+    height, width = array.shape
+    return image.resize((width * scale, height * scale), Image.NEAREST)
+
+
+class RenderCache:
+    """LRU-кэш отрисованных цифр по ключу (индекс в датасете или sample_id).
+
+    Хранит PIL-изображения, поэтому им можно пользоваться из фонового
+    потока; ImageTk.PhotoImage из результата создается уже на потоке Tk.
+    """
+
+    def __init__(self, scale=8, maxsize=512):
+        self.scale = scale
+        self.maxsize = maxsize
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, digit_array):
+        """Отрисованная цифра из кэша или новая отрисовка digit_array"""
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                return image
+
+        image = render_digit(digit_array, self.scale)
+
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.maxsize:
+                self._images.popitem(last=False)
+        return image
+
+    def render(self, digit_array):
+        """Отрисовка без кэширования (для изображений без ключа)"""
+        return render_digit(digit_array, self.scale)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
@@ -1,10 +1,9 @@
 import tkinter as tk
-import numpy as np
-import matplotlib.pyplot as plt
-from PIL import Image, ImageTk
-import io
-from tensorflow.keras.datasets import mnist
-from ml_core import HybridMLCore  # ← ДОБАВИЛИ ИМПОРТ
+from PIL import ImageTk
+from dataset_store import get_mnist_store
+from digit_render import RenderCache
+from prefetch import PredictionPrefetcher
+import perf
 
 class DigitTab:
     def __init__(self, parent_frame, database, ml_core):
@@ -12,10 +11,10 @@ class DigitTab:
         self.db = database
         self.ml_core = ml_core
         
-        # Загружаем данные MNIST
-        (_, _), (self.X_test, self.y_test) = mnist.load_data()
-        # Нормализуем как в ConfigTab
-        self.X_test = self.X_test.astype('float32') / 255.0
+        # Тестовая часть общего MNIST (uint8 memmap, нормализация при обращении)
+        self.dataset = get_mnist_store().split('test')
+        self.X_test = self.dataset
+        self.y_test = self.dataset.labels
         
         self.current_idx = 0
         self.current_prediction = None
@@ -23,9 +22,25 @@ class DigitTab:
         self.current_cluster_id = None
         self.current_features = None
 
+        # Отрисованные цифры по индексу в датасете (LRU)
+        self.render_cache = RenderCache(scale=8)
+
+        # Фоновая очередь готовых предсказаний
+        self.prefetcher = PredictionPrefetcher(self.ml_core, self.X_test, self.render_index)
+
         self.setup_ui()
         self.load_ml_model()  # ← ЗАГРУЖАЕМ МОДЕЛЬ ПРИ СТАРТЕ
         self.show_random_digit()
+        self.prefetcher.start()
+
+    def on_show(self):
+        """Вызывается главным окном при повторной активации вкладки"""
+        self.prefetcher.start()
+
+    def on_hide(self):
+        """Вкладка скрыта (или окно закрывается) - останавливаем предзагрузку.
+        Готовые элементы остаются в очереди: take() сам отбросит устаревшие."""
+        self.prefetcher.stop()
 
     def load_ml_model(self):
         """Проверяет готовность ML модели"""
@@ -129,41 +144,33 @@ class DigitTab:
         
         self.counter = 0
 
-    def array_to_image(self, digit_array):
-        """Конвертируем массив numpy в изображение для tkinter"""
-        # Денормализуем для отображения
-        display_array = (digit_array * 255).astype('uint8')
-        
-        plt.figure(figsize=(3, 3))
-        plt.imshow(display_array, cmap='gray')
-        plt.axis('off')
-        
-        # Сохраняем в буфер вместо файла
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, dpi=80)
-        buf.seek(0)
-        plt.close()
-        
-        return Image.open(buf)
-    
+    def render_index(self, idx):
+        """Изображение цифры по индексу тестовой выборки для tkinter"""
+        # uint8 пиксели сразу в увеличенное изображение, без matplotlib и PNG;
+        # вызывается и из фонового потока предзагрузки
+        return self.render_cache.get(self.dataset.reference(idx), self.dataset.raw(idx))
+
     def show_random_digit(self):
         """Показываем случайную цифру и получаем предсказание от системы"""
         if not self.ml_core:
             self.status_label.config(text="❌ Модель не загружена! Обучите в настройках ИИ", fg="red")
             return
         
-        self.current_idx = np.random.randint(0, len(self.X_test))
-        digit_image = self.X_test[self.current_idx]
-        self.current_label = self.y_test[self.current_idx]  # Правильный ответ (для отладки)
-        
-        # Получаем ПРЕДСКАЗАНИЕ от системы
+        # Получаем ПРЕДСКАЗАНИЕ от системы (из очереди или синхронно)
         try:
-            predicted_digit, confidence, cluster_id, features = self.ml_core.predict(digit_image)
-            
+            item = self.prefetcher.take()
+            if item is None:
+                item = self.prefetcher.produce()
+
+            self.current_idx = item['idx']
+            self.current_label = self.y_test[self.current_idx]  # Правильный ответ (для отладки)
+            predicted_digit = item['prediction']
+            confidence = item['confidence']
+
             self.current_prediction = predicted_digit
             self.current_confidence = confidence
-            self.current_cluster_id = cluster_id
-            self.current_features = features
+            self.current_cluster_id = item['cluster_id']
+            self.current_features = item['features']
             
             # Обновляем интерфейс с предсказанием
             self.prediction_label.config(text=f"Система предполагает: {predicted_digit}")
@@ -183,12 +190,14 @@ class DigitTab:
             self.confidence_label.config(text="")
             return
         
-        # Конвертируем и показываем изображение
-        image = self.array_to_image(digit_image)
-        photo = ImageTk.PhotoImage(image)
+        # Показываем уже отрисованное изображение
+        photo = ImageTk.PhotoImage(item['image'])
         
         self.image_label.configure(image=photo)
         self.image_label.image = photo  # сохраняем ссылку!
+        if 'first_prediction' not in perf.get_marks():
+            perf.mark("first_prediction")
+            perf.report()  # Время до первой отрисовки и первого предсказания
         
         # Показываем правильный ответ (для отладки - можно убрать)
         #self.answer_label.config(text=f"Правильный ответ: {self.current_label} (ID: {self.current_idx})")
@@ -202,124 +211,62 @@ class DigitTab:
     
     def on_yes(self):
         """Пользователь подтверждает предсказание"""
-        if not self.ml_core or self.current_prediction is None:
-            return
-            
-        self.counter += 1
-
-        # ПРОВЕРЯЕМ что кластер существует перед обновлением
-        config = self.db.load_system_config()
-        alpha = config['weights']['alpha'] if config else 0.2
-        if self.current_cluster_id != -1:  # ← Только если не fallback
-            # ОБНОВЛЯЕМ ВЕСА В МОДЕЛИ
-            self.ml_core.update_cluster_weights(
-                self.current_cluster_id, 
-                'yes',
-                alpha=alpha  # Можно брать из настроек БД
-            )
-        
-        # СОХРАНЯЕМ В БД
-        try:
-            sample_id = self.db.save_sample(
-                image_data=self.X_test[self.current_idx].tolist(),  # Сохраняем изображение
-                features=self.current_features.tolist() if self.current_features is not None else None,
-                cluster_id=self.current_cluster_id,
-                predicted_label=self.current_prediction,
-                user_feedback='yes',
-                verified_label=None,
-                true_label=self.current_label    # Пока не верифицировано
-            )
-            print(f"✅ YES сохранен: sample_id={sample_id}, prediction={self.current_prediction}")
-        except Exception as e:
-            print(f"❌ Ошибка сохранения YES: {e}")
-        
-        self.status_label.config(text=f"✅ Подтверждено: {self.current_prediction}", fg="green")
-        self.counter_label.config(text=f"Обработано: {self.counter} цифр")
-        
-        # Деактивируем кнопки до следующего предсказания
-        self._disable_feedback_buttons()
-        self.show_random_digit()
-        # ⭐⭐ СОХРАНЯЕМ СТАТИСТИКУ ПОСЛЕ КАЖДОГО ОТВЕТА
-        self.db.save_statistics_snapshot()
-    
-        self._disable_feedback_buttons()
-        self.show_random_digit()
+        self._submit_feedback('yes', "✅ YES", "✅ Подтверждено", "green")
 
-    
     def on_no(self):
         """Пользователь отвергает предсказание"""
-        if not self.ml_core or self.current_prediction is None:
-            return
-            
-        self.counter += 1
-        
-        # ОБНОВЛЯЕМ ВЕСА В МОДЕЛИ (только если не fallback)
-        config = self.db.load_system_config()
-        gamma = config['weights']['gamma'] if config else 0.5
-        if self.current_cluster_id != -1:
-            self.ml_core.update_cluster_weights(
-                self.current_cluster_id, 
-                'no',
-                gamma=gamma  # Можно брать из настроек БД
-            )
-        
-        # СОХРАНЯЕМ В БД для отложенной верификации
-        try:
-            sample_id = self.db.save_sample(
-                image_data=self.X_test[self.current_idx].tolist(),
-                features=self.current_features.tolist() if self.current_features is not None else None,
-                cluster_id=self.current_cluster_id,
-                predicted_label=self.current_prediction,
-                user_feedback='no',
-                verified_label=None,
-                true_label=self.current_label  # ⭐⭐ СОХРАНЯЕМ ДЛЯ СТАТИСТИКИ, НО НЕ ПОКАЗЫВАЕМ
-            )
-            print(f"❌ NO сохранен: sample_id={sample_id}, prediction={self.current_prediction}")
-        except Exception as e:
-            print(f"❌ Ошибка сохранения NO: {e}")
-        
-        self.status_label.config(text=f"❌ Отвергнуто: {self.current_prediction}", fg="red")
-        self.counter_label.config(text=f"Обработано: {self.counter} цифр")
-        
-        self._disable_feedback_buttons()
-        self.show_random_digit()
+        # Сохраняется для отложенной верификации; true_label - для статистики, не показываем
+        self._submit_feedback('no', "❌ NO", "❌ Отвергнуто", "red")
 
-        self.db.save_statistics_snapshot()
-        self._disable_feedback_buttons()
-        self.show_random_digit()
-    
     def on_later(self):
         """Пользователь не уверен"""
+        # Веса не меняем, пример уходит на верификацию
+        self._submit_feedback('unsure', "⏰ LATER", "⏰ Отложено", "orange")
+
+    def _submit_feedback(self, user_feedback, log_prefix, status_text, color):
+        """Обработка одного клика: одно обновление весов, одна запись в БД, один переход.
+
+        Пример и снимок статистики пишутся одной транзакцией; время каждого
+        этапа попадает в журнал perf (feedback.*).
+        """
         if not self.ml_core or self.current_prediction is None:
             return
-            
+
         self.counter += 1
-        
-        # СОХРАНЯЕМ В БД для верификации позже
-        try:
-            sample_id = self.db.save_sample(
-                image_data=self.X_test[self.current_idx].tolist(),
-                features=self.current_features.tolist() if self.current_features is not None else None,
-                cluster_id=self.current_cluster_id,
-                predicted_label=self.current_prediction,
-                user_feedback='unsure',
-                verified_label=None,
-                true_label=self.current_label  # ⭐⭐ СОХРАНЯЕМ - ПОКАЖЕМ ПРИ ВЕРИФИКАЦИИ
-            )
-            print(f"⏰ LATER сохранен: sample_id={sample_id}, prediction={self.current_prediction}")
-        except Exception as e:
-            print(f"❌ Ошибка сохранения LATER: {e}")
-        
-        self.status_label.config(text=f"⏰ Отложено: {self.current_prediction}", fg="orange")
-        self.counter_label.config(text=f"Обработано: {self.counter} цифр")
-        
+        # Деактивируем кнопки до следующего предсказания
         self._disable_feedback_buttons()
-        self.show_random_digit()
 
-        self.db.save_statistics_snapshot()
-        self._disable_feedback_buttons()
-        self.show_random_digit()
-    
+        with perf.timed("feedback.total"):
+            # ОБНОВЛЯЕМ ВЕСА В МОДЕЛИ (только если не fallback); коэффициенты
+            # ядро получает из настроек по подписке, БД здесь не читается
+            if user_feedback != 'unsure' and self.current_cluster_id != -1:
+                with perf.timed("feedback.weights"):
+                    self.ml_core.update_cluster_weights(self.current_cluster_id, user_feedback)
+
+            # СОХРАНЯЕМ В БД вместе со снимком статистики
+            with perf.timed("feedback.save"):
+                try:
+                    self.db.save_sample(
+                        image_data=None,
+                        dataset_ref=self.dataset.reference(self.current_idx),  # Ссылка на MNIST вместо копии пикселей
+                        features=self.current_features,
+                        cluster_id=self.current_cluster_id,
+                        predicted_label=self.current_prediction,
+                        user_feedback=user_feedback,
+                        verified_label=None,
+                        true_label=self.current_label,
+                        snapshot=True
+                    )
+                    print(f"{log_prefix} поставлен в очередь записи: prediction={self.current_prediction}")
+                except Exception as e:
+                    print(f"❌ Ошибка сохранения {log_prefix}: {e}")
+
+            self.status_label.config(text=f"{status_text}: {self.current_prediction}", fg=color)
+            self.counter_label.config(text=f"Обработано: {self.counter} цифр")
+
+            with perf.timed("feedback.advance"):
+                self.show_random_digit()
+
     def _disable_feedback_buttons(self):
         """Деактивирует кнопки обратной связи"""
         self.btn_yes.config(state="disabled")
@@ -0,0 +1,38 @@
+import numpy as np
+from weight_store import ClusterWeightStore, YES, NO, VERIFIED
+
+DEFAULT_PARAMS = {'alpha': 0.2, 'beta': 0.5, 'gamma': 0.5, 'min_weight': 0.05}
+
+
+def replay_weights(cluster_ids, weights, event_clusters, event_kinds, event_labels,
+                   event_rates=None, event_min_weights=None, params=None):
+    """Применяет журнал событий к матрице весов (K x 10), как update_cluster_weights.
+
+    Используется то же векторное ядро ClusterWeightStore.apply_events, что и
+    при живых обновлениях, поэтому результат совпадает с ними бит в бит.
+
+    Без params используются коэффициенты, записанные в журнале (восстановление);
+    с params - заданные alpha/beta/gamma/min_weight ("что если").
+    Возвращает новую float32 матрицу, исходная не меняется.
+    """
+    store = ClusterWeightStore(cluster_ids, weights)
+    if len(event_clusters) == 0 or len(store) == 0:
+        return store.matrix
+
+    rows = store.rows(event_clusters)
+    kinds = np.asarray(event_kinds, dtype=np.int64)
+    labels = np.asarray(event_labels, dtype=np.int64)
+
+    if params is None:
+        rates = np.asarray(event_rates, dtype=np.float64)
+        min_weights = np.asarray(event_min_weights, dtype=np.float64)
+    else:
+        params = {**DEFAULT_PARAMS, **params}
+        rates = np.select([kinds == YES, kinds == NO, kinds == VERIFIED],
+                          [params['alpha'], params['gamma'], params['beta']], 0.0)
+        min_weights = np.full(len(kinds), params['min_weight'], dtype=np.float64)
+
+    # События удаленных кластеров пропускаем
+    known = rows >= 0
+    store.apply_events(rows[known], kinds[known], labels[known], rates[known], min_weights[known])
+    return store.matrix
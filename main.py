@@ -1,13 +1,47 @@
+import perf  # ← ПЕРВЫМ: отметка времени запуска
+import importlib
+import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk
-from digit_tab import DigitTab
-from verify_tab import VerifyTab
-from config_tab import ConfigTab
-from about_tab import AboutTab
 from database import Database
 #from db_tab import DBTab
-from results_tab import ResultsTab
 
+# Модули вкладок (без TensorFlow): после них окно уже рабочее.
+# matplotlib и results_tab здесь нет - они импортируются при первом показе вкладки "Результаты"
+UI_MODULES = (
+    'numpy',
+    'ml_core',
+    'digit_tab',
+    'verify_tab',
+    'config_tab',
+)
+# Тяжелые модули догружаются в фоне, пока вкладки уже работают
+HEAVY_MODULES = (
+    'tensorflow',
+    'sklearn.cluster',
+)
+# Что нужно вкладке, чтобы ее построить: 'db' - открытая БД, 'core' - еще и
+# модули вкладок с общим ML-ядром, 'model' - еще и загруженный экстрактор
+TAB_REQUIREMENTS = {
+    'digit_tab': 'model',
+    'verify_tab': 'core',
+    'config_tab': 'core',
+    'results_tab': 'db',
+    'about_tab': None,
+}
+# Подпись заглушки, пока вкладка ждет свое требование
+PLACEHOLDER_TEXTS = {
+    'db': "⏳ Открываем базу данных...",
+    'core': "⏳ Загружаем модули...",
+    'model': "⏳ Загружаем модель (TensorFlow)...",
+}
+
+# Как часто измененные веса кластеров пишутся в БД
+WEIGHTS_FLUSH_INTERVAL_MS = 5000
+# Через сколько событий фидбека сохранять снимок весов для быстрого воспроизведения
+WEIGHTS_SNAPSHOT_EVERY_EVENTS = 1000
 
 
 class HybridTrainer:
@@ -16,44 +50,289 @@ class HybridTrainer:
         self.window.title("Тест гибридной модели")
         self.window.geometry("1000x800")
 
-        # Инициализируем БД
-        self.db = Database()
+        # БД (с миграциями) открывается после первой отрисовки окна
+        self.db = None
+        self.ml_core = None
+        self._events_since_snapshot = 0
+        self._model_ready = False
+        self._model_queue = queue.Queue()
+        self._placeholders = {}  # атрибут вкладки -> метка ожидания
+
+        # Окно и вкладки показываем сразу; содержимое вкладки строится,
+        # когда готово ее требование (TAB_REQUIREMENTS)
+        self.notebook = ttk.Notebook(self.window)
+        self.notebook.pack(expand=True, fill='both', padx=10, pady=10)
+        self.setup_tabs()
+
+        self._ui_modules_done = threading.Event()
+        self._preload_done = threading.Event()
+        threading.Thread(target=self._preload_modules, name="preload", daemon=True).start()
+        # Первая отрисовка - по первому событию Expose, а не по таймеру
+        # (after(0) срабатывает раньше, чем Tk что-либо нарисует)
+        self.window.bind('<Expose>', self._on_first_expose)
+        self.window.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def _preload_modules(self):
+        """Импортирует модули в фоновом потоке: сначала модули вкладок, потом TensorFlow"""
+        for modules, done in ((UI_MODULES, self._ui_modules_done), (HEAVY_MODULES, self._preload_done)):
+            for name in modules:
+                try:
+                    with perf.timed(f"import {name}", log=True):
+                        importlib.import_module(name)
+                except ImportError as e:
+                    print(f"⚠️  Не удалось загрузить {name}: {e}")
+            done.set()
 
-        # ⭐⭐ ДОБАВЛЯЕМ ОБЩИЙ ML_CORE ДЛЯ ВСЕХ ВКЛАДОК ⭐⭐
+    def _on_first_expose(self, event):
+        self.window.unbind('<Expose>')
+        # Перерисовка Tk тоже в очереди idle: наш обработчик встанет после нее
+        self.window.after_idle(self._on_first_paint)
+
+    def _on_first_paint(self):
+        perf.mark("first_paint")
+        try:
+            with perf.timed("open database", log=True):
+                self.db = Database()
+        except Exception as e:
+            print(f"❌ Не удалось открыть БД: {e}")
+            return
+        # Фоновая миграция BLOB примеров (перенос в sample_blobs, перекодирование) пачками в потоке записи
+        self.db.start_blob_migration()
+        self.window.after(WEIGHTS_FLUSH_INTERVAL_MS, self._weights_flush_loop)
+        self._build_selected_tab()
+        self._wait_for_preload()
+
+    def _wait_for_preload(self):
+        if not self._ui_modules_done.is_set():
+            self.window.after(50, self._wait_for_preload)
+            return
+
+        perf.mark("modules_loaded")
+        # ⭐⭐ ОБЩИЙ ML_CORE ДЛЯ ВСЕХ ВКЛАДОК ⭐⭐
         from ml_core import HybridMLCore
         self.ml_core = HybridMLCore()
+        # Коэффициенты весов из настроек; дальше ядро узнает об изменениях само
+        self.ml_core.on_config_changed(self.db.load_system_config())
+        self.db.subscribe_config(self.ml_core.on_config_changed)
+        models_path = self._restore_saved_model()
+        self._build_selected_tab()
 
-        self.setup_tabs()
+        # Экстрактор (TensorFlow) загружается в фоне; вкладки БД уже работают
+        if models_path:
+            threading.Thread(target=self._load_extractor, name="load-model",
+                             args=(models_path, self.ml_core.model_version), daemon=True).start()
+            self._wait_for_model()
+        else:
+            self._on_model_ready()
+
+    def _restore_saved_model(self):
+        """Загружает кластеры и веса активного поколения (без TensorFlow).
+
+        Возвращает путь файлов экстрактора, если его нужно догрузить, иначе None.
+        """
+        try:
+            with perf.timed("restore clusters", log=True):
+                matrices = self.db.load_generation_matrices()
+                if matrices is None:
+                    return None
+                generation = self.db.get_active_generation()
+                models_path = generation['models_path'] if generation else None
+                self.ml_core.load_generation(*matrices)
+            if models_path and os.path.exists(f'{models_path}_extractor.h5'):
+                return models_path
+        except Exception as e:
+            print(f"⚠️ Не удалось восстановить модель: {e}")
+        return None
+
+    def _load_extractor(self, models_path, model_version):
+        """Загружает экстрактор в отдельное ядро (фоновый поток, после импорта TensorFlow)"""
+        from ml_core import HybridMLCore
+        self._preload_done.wait()
+        core = None
+        try:
+            with perf.timed("load extractor", log=True):
+                core = HybridMLCore()
+                core.load_models(models_path)
+        except Exception as e:
+            print(f"⚠️ Не удалось загрузить экстрактор: {e}")
+        self._model_queue.put((core, model_version))
+
+    def _wait_for_model(self):
+        try:
+            core, model_version = self._model_queue.get_nowait()
+        except queue.Empty:
+            self.window.after(50, self._wait_for_model)
+            return
+
+        # Если за время загрузки модель сменилась (обучение), загруженный экстрактор устарел
+        if core is not None and core.is_trained:
+            self.ml_core.adopt_extractor(core, model_version)
+        self._on_model_ready()
+
+    def _on_model_ready(self):
+        """Модель восстановлена: строим отложенные вкладки"""
+        perf.mark("model_loaded")
+        self._model_ready = True
+        self._build_selected_tab()
+
+    def _tab_ready(self, attr):
+        """Готово ли все, что нужно для построения вкладки"""
+        requirement = TAB_REQUIREMENTS[attr]
+        if requirement == 'model':
+            return self._model_ready
+        if requirement == 'core':
+            return self.ml_core is not None
+        if requirement == 'db':
+            return self.db is not None
+        return True
+
+    def _build_selected_tab(self):
+        """Строит открытую вкладку, если она ждала заглушкой и теперь готова"""
+        if self._current_tab is None:
+            return
+        attr, factory, frame = self._tabs[self._current_tab]
+        if getattr(self, attr) is not None or not self._tab_ready(attr):
+            return
+        placeholder = self._placeholders.pop(attr, None)
+        if placeholder is not None:
+            placeholder.destroy()
+        # Первая активация: конструктор сам загружает данные
+        with perf.timed(f"build {attr}", log=True):
+            setattr(self, attr, factory(frame))
+
+    def flush_cluster_weights(self):
+        """Ставит в очередь записи веса кластеров, измененные с прошлого раза,
+        вместе с событиями журнала фидбека"""
+        if self.ml_core is None:
+            return
+        rows = self.ml_core.take_dirty_weights()
+        events = self.ml_core.take_feedback_events()
+        if not rows and not events:
+            return
+
+        snapshot = None
+        self._events_since_snapshot += len(events)
+        if self._events_since_snapshot >= WEIGHTS_SNAPSHOT_EVERY_EVENTS:
+            snapshot = self.ml_core.get_weights_snapshot()
+            self._events_since_snapshot = 0
+
+        cluster_ids = {row[0] for row in rows}
+
+        def on_done(future):
+            # Не удалось записать - попробуем в следующий раз
+            if future.exception() is not None:
+                self.ml_core.mark_weights_dirty(cluster_ids, events)
+
+        self.db.save_cluster_weights(rows, events, snapshot).add_done_callback(on_done)
+
+    def _weights_flush_loop(self):
+        try:
+            self.flush_cluster_weights()
+        except Exception as e:
+            print(f"⚠️ Ошибка записи весов кластеров: {e}")
+        try:
+            # Дешевая проверка (PRAGMA data_version): подписчики узнают о
+            # настройках, измененных другим процессом
+            self.db.load_system_config()
+        except Exception as e:
+            print(f"⚠️ Ошибка проверки настроек: {e}")
+        self.window.after(WEIGHTS_FLUSH_INTERVAL_MS, self._weights_flush_loop)
 
     def setup_tabs(self):
-        #Создаем панедь вкладок
-        notebook = ttk.Notebook(self.window)
-
-        #Создаем вкладки
-        digit_frame = ttk.Frame(notebook)
-        verify_frame = ttk.Frame(notebook)
-        config_frame = tk.ttk.Frame(notebook)
-        #db_frame = tk.ttk.Frame(notebook)
-        results_frame = tk.ttk.Frame(notebook)
-        about_frame = tk.ttk.Frame(notebook)
-
-        #Инициируем логику вкладок
-        self.digit_tab = DigitTab(digit_frame, self.db, self.ml_core)
-        self.verify_tab = VerifyTab(verify_frame, self.db, self.ml_core)
-        self.config_tab = ConfigTab(config_frame, self.db, self.ml_core)
-        #self.db_tab = DBTab(db_frame, self.db)
-        self.results_tab = ResultsTab(results_frame, self.db)
-        self.about_tab = AboutTab(about_frame)
-
-        #Добавляем вкладки в консоль
-        notebook.add(digit_frame, text="Работа с числами")
-        notebook.add(verify_frame, text="Верификация")
-        notebook.add(config_frame, text="Настройки ИИ")
-        #otebook.add(db_frame, text="Управление БД")
-        notebook.add(results_frame, text="Результаты")
-        notebook.add(about_frame, text="О программе")
-
-        notebook.pack(expand=True, fill='both', padx=10, pady=10)
+        """Добавляет вкладки в панель; содержимое строится при первой активации"""
+        notebook = self.notebook
+
+        # (атрибут, заголовок, фабрика содержимого)
+        tab_specs = [
+            ('digit_tab', "Работа с числами", self._create_digit_tab),
+            ('verify_tab', "Верификация", self._create_verify_tab),
+            ('config_tab', "Настройки ИИ", self._create_config_tab),
+            #('db_tab', "Управление БД", lambda frame: DBTab(frame, self.db)),
+            ('results_tab', "Результаты", self._create_results_tab),
+            ('about_tab', "О программе", self._create_about_tab),
+        ]
+
+        self._tabs = {}  # имя фрейма -> (атрибут, фабрика, фрейм)
+        self._current_tab = None
+        for attr, title, factory in tab_specs:
+            setattr(self, attr, None)
+            frame = ttk.Frame(notebook)
+            notebook.add(frame, text=title)
+            self._tabs[str(frame)] = (attr, factory, frame)
+
+        notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed, add='+')
+        self._activate_selected_tab()
+
+    def _create_digit_tab(self, frame):
+        from digit_tab import DigitTab
+        return DigitTab(frame, self.db, self.ml_core)
+
+    def _create_verify_tab(self, frame):
+        from verify_tab import VerifyTab
+        return VerifyTab(frame, self.db, self.ml_core)
+
+    def _create_config_tab(self, frame):
+        from config_tab import ConfigTab
+        return ConfigTab(frame, self.db, self.ml_core)
+
+    def _create_results_tab(self, frame):
+        from results_tab import ResultsTab
+        return ResultsTab(frame, self.db)
+
+    def _create_about_tab(self, frame):
+        from about_tab import AboutTab
+        return AboutTab(frame)
+
+    def _on_tab_changed(self, event):
+        """Обработчик смены вкладки: строит новую, усыпляет скрытую"""
+        try:
+            self._activate_selected_tab()
+        except Exception as e:
+            print(f"⚠️ Ошибка обработки смены вкладки: {e}")
+
+    def _activate_selected_tab(self):
+        selected = self.notebook.select()
+        if not selected or selected == self._current_tab:
+            return
+
+        # Скрытая вкладка приостанавливает периодическую работу
+        if self._current_tab is not None:
+            previous = getattr(self, self._tabs[self._current_tab][0])
+            if previous is not None and hasattr(previous, 'on_hide'):
+                previous.on_hide()
+        self._current_tab = selected
+
+        attr, factory, frame = self._tabs[selected]
+        tab = getattr(self, attr)
+        if tab is None and not self._tab_ready(attr):
+            # Вкладка построится, когда будет готово ее требование (_build_selected_tab)
+            if attr not in self._placeholders:
+                self._placeholders[attr] = tk.Label(frame, text=PLACEHOLDER_TEXTS[TAB_REQUIREMENTS[attr]],
+                                                    font=("Arial", 11), fg="gray")
+                self._placeholders[attr].pack(pady=20)
+        elif tab is None:
+            self._build_selected_tab()
+        elif hasattr(tab, 'on_show'):
+            with perf.timed(f"show {attr}", log=True):
+                tab.on_show()
+
+    def on_close(self):
+        """Закрытие окна: останавливаем фоновую работу вкладок, дописываем очередь записи в БД и выходим"""
+        for attr, _, _ in getattr(self, '_tabs', {}).values():
+            tab = getattr(self, attr)
+            if tab is not None and hasattr(tab, 'on_hide'):
+                try:
+                    tab.on_hide()
+                except Exception as e:
+                    print(f"⚠️ Ошибка остановки вкладки {attr}: {e}")
+        try:
+            if self.db is not None:
+                self.flush_cluster_weights()
+                self.db.close_connection()
+        except Exception as e:
+            print(f"⚠️ Ошибка закрытия БД: {e}")
+        perf.report()
+        self.window.destroy()
 
     def run(self):
         self.window.mainloop()
@@ -61,4 +340,4 @@ class HybridTrainer:
 if __name__ == "__main__":
     app = HybridTrainer()
     app.run()
-    print("Тест гибридной модели запущен")
\ No newline at end of file
+    print("Тест гибридной модели запущен")
@@ -1,10 +1,42 @@
 import numpy as np
-from sklearn.cluster import KMeans, DBSCAN
-from sklearn.metrics.pairwise import cosine_distances, euclidean_distances
-import tensorflow as tf
-from tensorflow import keras
 import pickle
 import os
+import time
+import threading
+from collections import deque
+from weight_store import ClusterWeightStore, FEEDBACK_CODES, UNSURE, event_rate
+from feedback_replay import DEFAULT_PARAMS
+
+_MIX_MUL1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_MUL2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix64(x):
+    """Финализатор splitmix64 по массиву uint64 (переполнение - по модулю 2^64)"""
+    x = (x ^ (x >> np.uint64(30))) * _MIX_MUL1
+    x = (x ^ (x >> np.uint64(27))) * _MIX_MUL2
+    return x ^ (x >> np.uint64(31))
+
+
+def tie_break_scores(features, seed, n_digits=10):
+    """Псевдослучайные оценки (N x n_digits) для выбора при равных весах.
+
+    Зависят только от признаков и seed: один и тот же вход дает один и тот же
+    выбор в любом потоке и в любом порядке вызовов. Без признаков (None)
+    оценки одинаковые, и выигрывает первая из равных цифр.
+    """
+    if features is None:
+        return None
+    bits = np.ascontiguousarray(features, dtype=np.float32)
+    bits = bits.reshape(len(bits), -1).view(np.uint32).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        # Хеш строки: взвешенная сумма слов по модулю 2^64, затем перемешивание
+        multipliers = _mix64(np.arange(1, bits.shape[1] + 1, dtype=np.uint64) * _GOLDEN)
+        keys = _mix64((bits * multipliers).sum(axis=1, dtype=np.uint64) ^ np.uint64(seed))
+        digits = np.arange(n_digits, dtype=np.uint64) * _GOLDEN
+        return _mix64(keys[:, np.newaxis] + digits[np.newaxis, :])
+
 
 class HybridMLCore:
     def __init__(self):
@@ -13,9 +45,42 @@ class HybridMLCore:
         self.clusters = []  # Текущие кластеры с весами
         self.is_trained = False
         self.cluster_metric = 'cosine'  # Метрика по умолчанию
+
+        # Центроиды одной непрерывной матрицей (K x D) для быстрого поиска
+        self._centroid_matrix = None
+        self._centroid_sq_norms = None
+        self._centroid_ids = None
+
+        # Seed для выбора при равных весах (см. tie_break_scores)
+        self.tie_break_seed = 42
+
+        # Быстрый путь инференса для одиночных/маленьких пачек
+        self.fast_path_max_batch = 64
+        self._infer_fn = None
+        self._latencies_ms = deque(maxlen=1000)
+        self._latency_calls = 0  # Всего вызовов быстрого пути (deque ограничена и для счета не годится)
+
+        # Версии состояния: model_version меняется при смене кластеров или
+        # экстрактора, weights_version - при каждом обновлении весов
+        self.model_version = 0
+        self.weights_version = 0
+        self._state_lock = threading.RLock()
+
+        # Кластеры, веса которых изменились после последней записи в БД,
+        # и события фидбека, еще не попавшие в журнал
+        self._dirty_clusters = set()
+        self._pending_events = []
+
+        # Веса всех кластеров одной матрицей (K x 10); cluster['weights'] - ее представления
+        self._weight_store = ClusterWeightStore()
+
+        # Коэффициенты обновления весов из настроек (см. on_config_changed)
+        self.feedback_params = dict(DEFAULT_PARAMS)
     
     def create_feature_extractor(self, architecture, embedding_size):
         """Создает нейросеть-экстрактор признаков"""
+        from tensorflow import keras
+
         try:
             if architecture == "Маленький перцептрон":
                 model = keras.Sequential([
@@ -47,6 +112,7 @@ class HybridMLCore:
                 raise ValueError(f"Неизвестная архитектура: {architecture}")
             
             self.feature_extractor = model
+            self._build_inference_fn()
             print(f"✅ Создан экстрактор: {architecture}, размерность: {embedding_size}")
             return model
             
@@ -54,8 +120,10 @@ class HybridMLCore:
             print(f"❌ Ошибка создания экстрактора: {e}")
             raise
     
-    def train_feature_extractor(self, training_data, epochs=5):
+    def train_feature_extractor(self, training_data, epochs=5, callbacks=None):
         """Обучает экстрактор признаков на наших данных"""
+        from tensorflow import keras
+
         try:
             if self.feature_extractor is None:
                 raise ValueError("Сначала создайте экстрактор!")
@@ -64,10 +132,16 @@ class HybridMLCore:
             y_train = training_data['y_train']
             
             # Проверяем форму данных
-            if len(x_train.shape) == 3:  # (samples, 28, 28)
+            if len(x_train.shape) != 3:  # (samples, 28, 28)
+                raise ValueError(f"Неожиданная форма данных: {x_train.shape}")
+            if isinstance(x_train, np.ndarray):
                 x_train = x_train.astype('float32')
+                fit_data = dict(x=x_train, y=y_train, batch_size=32, validation_split=0.2)
             else:
-                raise ValueError(f"Неожиданная форма данных: {x_train.shape}")
+                # Ленивая выборка (training_worker.TrainingSet): uint8 -> float32 по пачкам
+                from training_worker import make_batch_sequences
+                train_batches, val_batches = make_batch_sequences(x_train, batch_size=32, validation_split=0.2)
+                fit_data = dict(x=train_batches, validation_data=val_batches)
             
             # Добавляем выходной слой для обучения
             training_model = keras.Sequential([
@@ -86,10 +160,9 @@ class HybridMLCore:
             
             # Обучаем
             history = training_model.fit(
-                x_train, y_train,
+                **fit_data,
                 epochs=epochs,
-                batch_size=32,
-                validation_split=0.2,
+                callbacks=callbacks,
                 verbose=1
             )
             
@@ -103,21 +176,73 @@ class HybridMLCore:
             print(f"❌ Ошибка обучения экстрактора: {e}")
             raise
     
+    def _build_inference_fn(self):
+        """Готовит трассированную функцию инференса с фиксированной сигнатурой.
+
+        Keras predict() на каждый вызов создает адаптер данных и цикл шагов,
+        для одной цифры это дороже самого вычисления. tf.function трассируется
+        один раз здесь (прогрев), чтобы первый клик в DigitTab был быстрым.
+        """
+        import tensorflow as tf
+
+        self.model_version += 1
+        if self.feature_extractor is None:
+            self._infer_fn = None
+            return
+
+        model = self.feature_extractor
+
+        @tf.function(input_signature=[tf.TensorSpec(shape=[None, 28, 28], dtype=tf.float32)])
+        def infer(images):
+            return model(images, training=False)
+
+        start = time.perf_counter()
+        infer(tf.zeros((1, 28, 28), dtype=tf.float32))
+        print(f"🔥 Инференс прогрет за {(time.perf_counter() - start) * 1000:.1f} мс")
+        self._infer_fn = infer
+
     def extract_features(self, images):
         """Извлекает признаки из изображений"""
         if not self.is_trained:
             raise ValueError("Экстрактор не обучен!")
-        
+        return self._extract_features_with(images, self.feature_extractor, self._infer_fn)
+
+    def _extract_features_with(self, images, feature_extractor, infer_fn):
+        """Инференс заданным экстрактором; не трогает состояние ядра и идет без блокировки"""
         # Подготавливаем данные
         if len(images.shape) == 3:
             images = images.astype('float32')
         
+        # Одиночные и маленькие пачки идут через трассированную функцию
+        if infer_fn is not None and len(images) <= self.fast_path_max_batch:
+            import tensorflow as tf
+            start = time.perf_counter()
+            features = infer_fn(tf.convert_to_tensor(images, dtype=tf.float32)).numpy()
+            self._latencies_ms.append((time.perf_counter() - start) * 1000)
+            self._latency_calls += 1
+            if self._latency_calls % 100 == 0:
+                stats = self.get_inference_latency_stats()
+                print(f"⏱️  Инференс: p50={stats['p50_ms']:.2f} мс, p99={stats['p99_ms']:.2f} мс "
+                      f"({self._latency_calls} вызовов)")
+            return features
+
         # Извлекаем признаки
-        features = self.feature_extractor.predict(images, verbose=0)
+        features = feature_extractor.predict(images, verbose=0)
         return features
+
+    def get_inference_latency_stats(self):
+        """Возвращает p50/p99 задержки быстрого пути инференса в миллисекундах"""
+        if not self._latencies_ms:
+            return {'count': 0, 'p50_ms': None, 'p99_ms': None}
+
+        latencies = np.fromiter(self._latencies_ms, dtype=np.float64)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        return {'count': len(latencies), 'p50_ms': float(p50), 'p99_ms': float(p99)}
     
     def perform_clustering(self, features, clustering_config, true_labels=None):
         """Выполняет кластеризацию признаков с настройками из интерфейса"""
+        from sklearn.cluster import KMeans, DBSCAN
+
         try:
             algorithm = clustering_config['algorithm']
             self.cluster_metric = clustering_config.get('metric', 'cosine')
@@ -235,6 +360,9 @@ class HybridMLCore:
                 'size': len(cluster_points)
                 }
             self.clusters.append(cluster_data)
+
+        self._rebuild_weight_store()
+        self._rebuild_centroid_matrix()
     
     def _create_fallback_clusters(self, features, params, true_labels=None):
         """Создает резервные кластеры когда алгоритм не нашел кластеры"""
@@ -249,60 +377,190 @@ class HybridMLCore:
         self.clusterer = kmeans
         self._initialize_clusters(features, cluster_labels, params, true_labels)
     
-    def find_nearest_cluster(self, features):
-        """Находит ближайший кластер для данных признаков"""
+    def _rebuild_weight_store(self):
+        """Переносит веса кластеров в общую матрицу; cluster['weights'] становится ее представлением"""
+        self._weight_store = ClusterWeightStore.from_clusters(self.clusters)
+        for row, cluster in enumerate(self.clusters):
+            cluster['weights'] = self._weight_store.view(row)
+
+    def _rebuild_centroid_matrix(self, centroids=None):
+        """Собирает центроиды в одну float32 матрицу (K x D).
+
+        Для косинусной метрики строки заранее нормализуются, чтобы поиск
+        ближайшего кластера сводился к одному умножению матрицы на вектор.
+        Готовую матрицу centroids (в порядке self.clusters) можно передать сразу.
+        """
+        self.model_version += 1
+        if not self.clusters:
+            self._centroid_matrix = None
+            self._centroid_sq_norms = None
+            self._centroid_ids = None
+            return
+
+        if centroids is not None:
+            matrix = np.array(centroids, dtype=np.float32)  # Копия: нормализуем на месте
+        else:
+            matrix = np.ascontiguousarray(
+                np.stack([np.asarray(c['centroid'], dtype=np.float32).ravel() for c in self.clusters])
+            )
+
+        if self.cluster_metric == 'cosine':
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0  # Нулевой центроид оставляем нулевым, как sklearn
+            matrix /= norms
+            self._centroid_sq_norms = None
+        else:  # euclidean
+            self._centroid_sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+
+        self._centroid_matrix = matrix
+        self._centroid_ids = np.array([c['cluster_id'] for c in self.clusters], dtype=np.int64)
+
+    def find_nearest_clusters(self, features):
+        """Находит ближайшие кластеры сразу для пачки признаков (N x D).
+
+        Возвращает (индексы строк в self.clusters, ID кластеров, расстояния).
+        """
         if not self.clusters:
             raise ValueError("Кластеры не инициализированы!")
-        
-        # Для одного примера
-        if len(features.shape) == 1:
+
+        if self._centroid_matrix is None:
+            self._rebuild_centroid_matrix()
+
+        return self._nearest_clusters_in(features, self._centroid_matrix, self._centroid_sq_norms,
+                                         self._centroid_ids, self.cluster_metric)
+
+    @staticmethod
+    def _nearest_clusters_in(features, centroid_matrix, centroid_sq_norms, centroid_ids, metric):
+        """Поиск ближайших кластеров по заданным матрицам центроидов (без обращения к ядру)"""
+        features = np.asarray(features, dtype=np.float32)
+        if features.ndim == 1:
             features = features.reshape(1, -1)
-        
-        nearest_cluster_id = None
-        min_distance = float('inf')
-        
-        for cluster in self.clusters:
-            if self.cluster_metric == 'cosine':
-                dist = cosine_distances(features, [cluster['centroid']])[0][0]
-            else:  # euclidean
-                dist = np.linalg.norm(features - cluster['centroid'])
-            
-            if dist < min_distance:
-                min_distance = dist
-                nearest_cluster_id = cluster['cluster_id']
-        
-        return nearest_cluster_id, min_distance
+
+        products = features @ centroid_matrix.T  # (N x K)
+
+        if metric == 'cosine':
+            norms = np.linalg.norm(features, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            distances = 1.0 - products / norms
+        else:  # euclidean
+            sq = (centroid_sq_norms[np.newaxis, :] - 2.0 * products
+                  + np.einsum('ij,ij->i', features, features)[:, np.newaxis])
+            distances = np.sqrt(np.maximum(sq, 0.0))
+
+        rows = np.argmin(distances, axis=1)
+        return rows, centroid_ids[rows], distances[np.arange(len(rows)), rows]
+
+    def find_nearest_cluster(self, features):
+        """Находит ближайший кластер для данных признаков"""
+        _, cluster_ids, distances = self.find_nearest_clusters(np.asarray(features).ravel())
+        return int(cluster_ids[0]), float(distances[0])
+
+    def _weights_matrix(self):
+        """Матрица весов (K x 10) в порядке self.clusters"""
+        return self._weight_store.matrix
+
+    def _choose_digits(self, weight_rows, features=None):
+        """Выбирает цифру с максимальным весом для каждой строки.
+
+        При равных весах выбор псевдослучайный, но определяется признаками
+        строки (tie_break_scores), а не общим генератором: результат не
+        зависит от того, какой поток и в каком порядке вызвал предсказание.
+        """
+        max_weights = weight_rows.max(axis=1, keepdims=True)
+        is_candidate = weight_rows == max_weights
+        scores = tie_break_scores(features, self.tie_break_seed, weight_rows.shape[1])
+        if scores is None:
+            digits = np.argmax(is_candidate, axis=1)
+        else:
+            digits = np.argmax(np.where(is_candidate, scores, np.uint64(0)), axis=1)
+        return digits, weight_rows[np.arange(len(digits)), digits]
+
+    def score_cluster(self, cluster_id, features=None):
+        """Пересчитывает (цифра, уверенность) для кластера по текущим весам.
+
+        features - признаки примера, чтобы ничьи разбивались так же, как в predict.
+        """
+        with self._state_lock:
+            row = self._weight_store.row(cluster_id)
+            weight_rows = self._weights_matrix()[row:row + 1].copy()
+        if features is not None:
+            features = np.asarray(features).reshape(1, -1)
+        digits, confidences = self._choose_digits(weight_rows, features)
+        return int(digits[0]), float(confidences[0])
+
+    def _inference_snapshot(self):
+        """Ссылки на состояние модели для предсказания, снятые под блокировкой.
+
+        Экстрактор, матрицы центроидов и хранилище весов при смене модели
+        заменяются целиком, поэтому инференс и поиск кластеров по этим
+        ссылкам идут без блокировки и не задерживают обновление весов.
+        Возвращает None, если модель не готова.
+        """
+        with self._state_lock:
+            if not self.is_trained or not self.clusters:
+                return None
+            if self._centroid_matrix is None:
+                self._rebuild_centroid_matrix()
+            return (self.feature_extractor, self._infer_fn, self._centroid_matrix,
+                    self._centroid_sq_norms, self._centroid_ids, self.cluster_metric,
+                    self._weight_store)
+
+    def _weight_rows(self, weight_store, rows):
+        """Копия строк весов; в матрице веса меняются на месте, поэтому под блокировкой"""
+        with self._state_lock:
+            return weight_store.matrix[rows]
+
+    def predict_batch(self, images):
+        """Предсказывает цифры для пачки изображений (N x 28 x 28).
+
+        Признаки извлекаются одним вызовом экстрактора, кластеры назначаются
+        одной векторной операцией. Возвращает массивы
+        (цифры, уверенности, ID кластеров, признаки).
+        """
+        images = np.asarray(images)
+        n = len(images)
+
+        snapshot = self._inference_snapshot()
+        if snapshot is None:
+            print(f"⚠️  Fallback предсказание для {n} изображений (модель не готова)")
+            digits = np.random.default_rng().integers(0, 10, size=n)
+            return digits, np.full(n, 0.1), np.full(n, -1, dtype=np.int64), None
+
+        if n == 0:
+            return (np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64),
+                    np.empty((0, 0), dtype=np.float32))
+
+        feature_extractor, infer_fn, centroids, sq_norms, centroid_ids, metric, weight_store = snapshot
+        features = self._extract_features_with(images, feature_extractor, infer_fn)
+        rows, cluster_ids, _ = self._nearest_clusters_in(features, centroids, sq_norms, centroid_ids, metric)
+
+        digits, confidences = self._choose_digits(self._weight_rows(weight_store, rows), features)
+        return digits, confidences, cluster_ids, features
     
     def predict(self, image):
         """Предсказывает цифру для одного изображения"""
         try:
-            if not self.is_trained or not self.clusters:
+            snapshot = self._inference_snapshot()
+            if snapshot is None:
                 # Fallback: случайная цифра вместо всегда 0
                 import random
                 random_digit = random.randint(0, 9)
                 print(f"⚠️  Fallback предсказание: {random_digit} (модель не готова)")
                 return random_digit, 0.1, -1, None  # ← cluster_id = -1 для fallback
             
-            # Извлекаем признаки
-            features = self.extract_features(np.array([image]))
+            feature_extractor, infer_fn, centroids, sq_norms, centroid_ids, metric, weight_store = snapshot
+
+            # Извлекаем признаки (без блокировки: обновление весов не ждет инференса)
+            features = self._extract_features_with(np.array([image]), feature_extractor, infer_fn)
             features = features[0]  # Берем первый (и единственный) пример
             
             # Находим ближайший кластер
-            cluster_id, distance = self.find_nearest_cluster(features)
-            cluster = self.get_cluster_by_id(cluster_id)
-            
-            # ⭐⭐ УЛУЧШЕННЫЙ ВЫБОР ЦИФРЫ ПРИ ОДИНАКОВЫХ ВЕСАХ ⭐⭐
-            max_weight = max(cluster['weights'].values())
-            candidates = [digit for digit, weight in cluster['weights'].items() if weight == max_weight]
-
-            # Если несколько цифр с одинаковым максимальным весом - выбираем случайную
-            if len(candidates) > 1:
-                predicted_digit = np.random.choice(candidates)
-            else:
-                predicted_digit = candidates[0]
-            
-            confidence = cluster['weights'][predicted_digit]
-            return predicted_digit, confidence, cluster_id, features
+            rows, cluster_ids, _ = self._nearest_clusters_in(features, centroids, sq_norms, centroid_ids, metric)
+            cluster_id = int(cluster_ids[0])
+            # ⭐⭐ ВЫБОР ЦИФРЫ ПРИ ОДИНАКОВЫХ ВЕСАХ - ПО ПРИЗНАКАМ, КАК В predict_batch ⭐⭐
+            digits, confidences = self._choose_digits(self._weight_rows(weight_store, rows),
+                                                      features.reshape(1, -1))
+            return int(digits[0]), float(confidences[0]), cluster_id, features
             
         except Exception as e:
             print(f"❌ Ошибка предсказания: {e}")
@@ -310,53 +568,126 @@ class HybridMLCore:
     
     def get_cluster_by_id(self, cluster_id):
         """Возвращает кластер по ID"""
-        for cluster in self.clusters:
-            if cluster['cluster_id'] == cluster_id:
-                return cluster
-        raise ValueError(f"Кластер с ID {cluster_id} не найден")
+        return self.clusters[self._weight_store.row(cluster_id)]
     
-    def update_cluster_weights(self, cluster_id, user_feedback, true_label=None, 
-                             alpha=0.2, beta=0.5, gamma=0.5, min_weight=0.05):
+    def on_config_changed(self, config):
+        """Подписчик Database.subscribe_config: запоминает коэффициенты весов"""
+        self.feedback_params = config.feedback_params if config else dict(DEFAULT_PARAMS)
+
+    def _resolve_feedback_params(self, alpha, beta, gamma, min_weight):
+        """Не переданные коэффициенты берутся из настроек"""
+        params = self.feedback_params
+        return (params['alpha'] if alpha is None else alpha,
+                params['beta'] if beta is None else beta,
+                params['gamma'] if gamma is None else gamma,
+                params['min_weight'] if min_weight is None else min_weight)
+
+    def update_cluster_weights(self, cluster_id, user_feedback, true_label=None,
+                             alpha=None, beta=None, gamma=None, min_weight=None):
         """Обновляет веса в кластере на основе обратной связи"""
         try:
-            cluster = self.get_cluster_by_id(cluster_id)
-            
+            alpha, beta, gamma, min_weight = self._resolve_feedback_params(alpha, beta, gamma, min_weight)
+            with self._state_lock:
+                row = self._weight_store.row(cluster_id)
+                kind = FEEDBACK_CODES.get(user_feedback, UNSURE)
+                label = int(true_label) if true_label is not None else -1
+                rate = event_rate(user_feedback, alpha, beta, gamma)
+
+                # Порог min_weight и нормализация - внутри apply_events
+                digit = int(self._weight_store.apply_events([row], [kind], [label], [rate], [min_weight])[0])
+                self._record_feedback([cluster_id], [kind], [label], [rate], min_weight)
+
             if user_feedback == 'yes':
-                # Увеличиваем вес предсказанной цифры
-                predicted_digit = max(cluster['weights'].items(), key=lambda x: x[1])[0]
-                old_weight = cluster['weights'][predicted_digit]
-                cluster['weights'][predicted_digit] = old_weight + alpha * (1 - old_weight)
-                print(f"✅ Увеличили вес цифры {predicted_digit} в кластере {cluster_id}")
-                
+                print(f"✅ Увеличили вес цифры {digit} в кластере {cluster_id}")
             elif user_feedback == 'no':
-                # Уменьшаем вес предсказанной цифры
-                predicted_digit = max(cluster['weights'].items(), key=lambda x: x[1])[0]
-                cluster['weights'][predicted_digit] *= gamma
-                print(f"✅ Уменьшили вес цифры {predicted_digit} в кластере {cluster_id}")
-                
-            elif user_feedback == 'verified' and true_label is not None:
-                # Сильное обновление на основе верификации
-                old_weight = cluster['weights'][true_label]
-                cluster['weights'][true_label] = old_weight + beta * (1 - old_weight)
-                print(f"✅ Верификация: усилили вес цифры {true_label} в кластере {cluster_id}")
-            
-            # Нормализуем веса и применяем минимальный порог
-            self._normalize_weights(cluster, min_weight)
-            
+                print(f"✅ Уменьшили вес цифры {digit} в кластере {cluster_id}")
+            elif user_feedback == 'verified' and digit >= 0:
+                print(f"✅ Верификация: усилили вес цифры {digit} в кластере {cluster_id}")
+
         except Exception as e:
             print(f"❌ Ошибка обновления весов: {e}")
-    
-    def _normalize_weights(self, cluster, min_weight):
-        """Нормализует веса и применяет минимальный порог"""
-        # Применяем минимальный порог
-        for digit in cluster['weights']:
-            cluster['weights'][digit] = max(cluster['weights'][digit], min_weight)
-        
-        # Нормализуем чтобы сумма была = 1
-        total = sum(cluster['weights'].values())
-        for digit in cluster['weights']:
-            cluster['weights'][digit] /= total
-    
+
+    def update_cluster_weights_batch(self, cluster_ids, user_feedbacks, true_labels=None,
+                                     alpha=None, beta=None, gamma=None, min_weight=None):
+        """Применяет сразу много событий фидбека одной векторной операцией.
+
+        События одного кластера применяются в переданном порядке, результат
+        тот же, что у последовательных вызовов update_cluster_weights.
+        Возвращает число примененных событий.
+        """
+        try:
+            alpha, beta, gamma, min_weight = self._resolve_feedback_params(alpha, beta, gamma, min_weight)
+            cluster_ids = np.asarray(cluster_ids, dtype=np.int64).ravel()
+            kinds = np.array([FEEDBACK_CODES.get(f, UNSURE) for f in user_feedbacks], dtype=np.int64)
+            if true_labels is None:
+                labels = np.full(len(kinds), -1, dtype=np.int64)
+            else:
+                labels = np.array([int(l) if l is not None else -1 for l in true_labels], dtype=np.int64)
+            rates = np.array([event_rate(f, alpha, beta, gamma) for f in user_feedbacks], dtype=np.float64)
+
+            with self._state_lock:
+                rows = self._weight_store.rows(cluster_ids)
+                known = rows >= 0
+                if not known.all():
+                    print(f"⚠️  Пропущено {int((~known).sum())} событий неизвестных кластеров")
+
+                self._weight_store.apply_events(rows[known], kinds[known], labels[known],
+                                                rates[known], min_weight)
+                self._record_feedback(cluster_ids[known], kinds[known], labels[known],
+                                      rates[known], min_weight)
+            return int(known.sum())
+
+        except Exception as e:
+            print(f"❌ Ошибка пакетного обновления весов: {e}")
+            return 0
+
+    def _record_feedback(self, cluster_ids, kinds, labels, rates, min_weight):
+        """Отмечает измененные кластеры и копит события для журнала"""
+        self.weights_version += 1
+        for cluster_id, kind, label, rate in zip(cluster_ids, kinds, labels, rates):
+            self._dirty_clusters.add(int(cluster_id))
+            self._pending_events.append((int(cluster_id), int(kind),
+                                         int(label) if label >= 0 else None,
+                                         float(rate), float(min_weight)))
+
+    def take_dirty_weights(self):
+        """Забирает веса измененных кластеров для записи в БД.
+
+        Возвращает строки (cluster_id, digit, weight) и сбрасывает отметки.
+        """
+        with self._state_lock:
+            dirty, self._dirty_clusters = self._dirty_clusters, set()
+            store = self._weight_store
+            return store.as_rows(sorted(store.row(c) for c in dirty if c in store))
+
+    def take_feedback_events(self):
+        """Забирает события (cluster_id, код фидбека, true_label, rate, min_weight) для журнала"""
+        with self._state_lock:
+            events, self._pending_events = self._pending_events, []
+        return events
+
+    def get_weights_snapshot(self):
+        """Текущие веса как (cluster_ids, матрица K x 10) или None без кластеров"""
+        with self._state_lock:
+            if not self.clusters:
+                return None
+            return self._weight_store.ids.copy(), self._weights_matrix().copy()
+
+    def mark_weights_dirty(self, cluster_ids, events=()):
+        """Снова помечает кластеры измененными (например, если запись не удалась)"""
+        with self._state_lock:
+            self._dirty_clusters.update(cluster_ids)
+            self._pending_events[:0] = events  # Сохраняем порядок журнала
+
+    def assign_cluster_ids(self, cluster_ids):
+        """Заменяет ID кластеров на ID, выданные БД при сохранении (в порядке self.clusters)"""
+        with self._state_lock:
+            for cluster, cluster_id in zip(self.clusters, cluster_ids):
+                cluster['cluster_id'] = int(cluster_id)
+            self._weight_store.renumber([c['cluster_id'] for c in self.clusters])
+            self._dirty_clusters.clear()
+            self._rebuild_centroid_matrix()
+
     def get_clusters_data_for_db(self):
         """Подготавливает данные кластеров для сохранения в БД"""
         # Конвертируем numpy arrays в списки для сериализации
@@ -364,6 +695,7 @@ class HybridMLCore:
         for cluster in self.clusters:
             cluster_copy = cluster.copy()
             cluster_copy['centroid'] = cluster['centroid'].tolist()  # numpy -> list
+            cluster_copy['weights'] = dict(cluster['weights'])  # представление -> dict
             clusters_data.append(cluster_copy)
         
         return clusters_data
@@ -376,16 +708,75 @@ class HybridMLCore:
             cluster_copy = cluster.copy()
             cluster_copy['centroid'] = np.array(cluster['centroid'])  # list -> numpy
             self.clusters.append(cluster_copy)
-        
+
+        self._dirty_clusters.clear()
+        self._rebuild_weight_store()
+        self._rebuild_centroid_matrix()
         print(f"✅ Загружено {len(self.clusters)} кластеров из БД")
     
+    def load_generation(self, cluster_ids, centroids, weights, params):
+        """Загружает поколение из готовых матриц БД без разбора по кластерам"""
+        with self._state_lock:
+            self._weight_store = ClusterWeightStore(cluster_ids, weights)
+            self.clusters = [{
+                'cluster_id': int(cluster_id),
+                'centroid': centroids[row],
+                'params': params,
+                'weights': self._weight_store.view(row)
+            } for row, cluster_id in enumerate(cluster_ids)]
+            self.cluster_metric = params.get('metric', self.cluster_metric)
+            self._dirty_clusters.clear()
+            self._rebuild_centroid_matrix(centroids)
+        print(f"✅ Загружено {len(self.clusters)} кластеров из БД")
+
+    def adopt_extractor(self, other, model_version=None):
+        """Берет у другого ядра только экстрактор (фоновая загрузка при запуске).
+
+        model_version - версия модели на момент начала загрузки: если с тех
+        пор модель сменилась (например, обучением), ничего не меняется.
+        Возвращает True, если экстрактор подключен.
+        """
+        with self._state_lock:
+            if model_version is not None and model_version != self.model_version:
+                print("⚠️ Модель сменилась во время загрузки - загруженный экстрактор не используется")
+                return False
+            self.feature_extractor = other.feature_extractor
+            self.clusterer = other.clusterer
+            self._infer_fn = other._infer_fn
+            self.is_trained = other.is_trained
+            self.model_version += 1
+            return True
+
+    def swap_state(self, other):
+        """Атомарно подменяет состояние модели состоянием другого ядра.
+
+        Используется после фонового обучения: новое ядро собирается целиком
+        отдельно, а вкладки продолжают держать ссылку на этот же объект.
+        """
+        with self._state_lock:
+            self.feature_extractor = other.feature_extractor
+            self.clusterer = other.clusterer
+            self.clusters = other.clusters
+            self.is_trained = other.is_trained
+            self.cluster_metric = other.cluster_metric
+            self._dirty_clusters = set(other._dirty_clusters)
+            self._centroid_matrix = other._centroid_matrix
+            self._centroid_sq_norms = other._centroid_sq_norms
+            self._centroid_ids = other._centroid_ids
+            self._weight_store = other._weight_store
+            self._infer_fn = other._infer_fn
+            self.model_version = max(self.model_version, other.model_version) + 1
+            self.weights_version += 1
+        print(f"🔄 Состояние модели обновлено ({len(self.clusters)} кластеров)")
+
     def get_system_info(self):
         """Возвращает информацию о системе"""
         return {
             'is_trained': self.is_trained,
             'clusters_count': len(self.clusters),
             'extractor_architecture': self.feature_extractor._name if self.feature_extractor else None,
-            'clusterer_type': type(self.clusterer).__name__ if self.clusterer else None
+            'clusterer_type': type(self.clusterer).__name__ if self.clusterer else None,
+            'inference_latency': self.get_inference_latency_stats()
         }
     
     def save_models(self, filepath='models/hybrid_system'):
@@ -406,8 +797,11 @@ class HybridMLCore:
     def load_models(self, filepath='models/hybrid_system'):
         """Загружает обученные модели"""
         try:
+            from tensorflow import keras
+
             if os.path.exists(f'{filepath}_extractor.h5'):
                 self.feature_extractor = keras.models.load_model(f'{filepath}_extractor.h5')
+                self._build_inference_fn()
             if os.path.exists(f'{filepath}_clusterer.pkl'):
                 with open(f'{filepath}_clusterer.pkl', 'rb') as f:
                     self.clusterer = pickle.load(f)
@@ -0,0 +1,64 @@
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Момент импорта модуля считаем моментом запуска (main.py импортирует его первым)
+PROCESS_START = time.perf_counter()
+
+_marks = {}
+_timings = defaultdict(lambda: deque(maxlen=500))
+
+
+def mark(name):
+    """Фиксирует однократное событие запуска (например, первую отрисовку)"""
+    if name not in _marks:
+        _marks[name] = time.perf_counter() - PROCESS_START
+        print(f"⏱️  {name}: {_marks[name] * 1000:.0f} мс от запуска")
+    return _marks[name]
+
+
+def get_marks():
+    """Возвращает все отметки запуска в секундах"""
+    return dict(_marks)
+
+
+@contextmanager
+def timed(name, log=False):
+    """Замеряет длительность блока и сохраняет ее в журнал замеров"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _timings[name].append(elapsed_ms)
+        if log:
+            print(f"⏱️  {name}: {elapsed_ms:.1f} мс")
+
+
+def get_timing_stats():
+    """Возвращает {имя: {'count', 'last_ms', 'p50_ms', 'p99_ms'}} по журналу замеров"""
+    import numpy as np
+
+    stats = {}
+    for name, values in list(_timings.items()):
+        if not values:
+            continue
+        samples = np.fromiter(values, dtype=np.float64)
+        p50, p99 = np.percentile(samples, [50, 99])
+        stats[name] = {
+            'count': len(samples),
+            'last_ms': float(samples[-1]),
+            'p50_ms': float(p50),
+            'p99_ms': float(p99)
+        }
+    return stats
+
+
+def report():
+    """Печатает отметки запуска и сводку замеров"""
+    print("=== ЗАМЕРЫ ВРЕМЕНИ ===")
+    for name, seconds in _marks.items():
+        print(f"   {name}: {seconds * 1000:.0f} мс от запуска")
+    for name, s in sorted(get_timing_stats().items()):
+        print(f"   {name}: n={s['count']}, p50={s['p50_ms']:.1f} мс, p99={s['p99_ms']:.1f} мс")
+    print("======================")
@@ -0,0 +1,97 @@
+import queue
+import threading
+import numpy as np
+
+
+class PredictionPrefetcher:
+    """Фоновый производитель предсказаний для DigitTab.
+
+    Держит ограниченную очередь готовых элементов (индекс, предсказание,
+    отрисованное изображение), чтобы клик забирал следующий элемент сразу,
+    без инференса и отрисовки на потоке Tk.
+    """
+
+    def __init__(self, ml_core, images, render_fn, size=8):
+        self.ml_core = ml_core
+        self.images = images
+        self.render_fn = render_fn  # render_fn(idx) -> PIL Image, должна быть потокобезопасной
+        self._queue = queue.Queue(maxsize=size)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Запускает фоновый поток"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="digit-prefetch", daemon=True)
+        self._thread.start()
+        print(f"🚀 Предзагрузка предсказаний запущена (очередь: {self._queue.maxsize})")
+
+    def stop(self):
+        """Останавливает фоновый поток"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                item = self.produce()
+            except Exception as e:
+                print(f"⚠️ Ошибка предзагрузки: {e}")
+                self._stop_event.wait(1.0)
+                continue
+
+            while not self._stop_event.is_set():
+                try:
+                    self._queue.put(item, timeout=0.2)
+                    break
+                except queue.Full:
+                    continue
+
+    def produce(self):
+        """Готовит один элемент: случайный индекс, предсказание и картинку"""
+        model_version = self.ml_core.model_version
+        weights_version = self.ml_core.weights_version
+
+        idx = np.random.randint(0, len(self.images))
+        digit_image = self.images[idx]
+        predicted_digit, confidence, cluster_id, features = self.ml_core.predict(digit_image)
+
+        return {
+            'idx': idx,
+            'prediction': predicted_digit,
+            'confidence': confidence,
+            'cluster_id': cluster_id,
+            'features': features,
+            'image': self.render_fn(idx),
+            'model_version': model_version,
+            'weights_version': weights_version
+        }
+
+    def take(self):
+        """Забирает готовый элемент из очереди или возвращает None.
+
+        Элементы от старой модели (другие кластеры) отбрасываются, а элементы,
+        посчитанные до изменения весов, пересчитываются по кластеру.
+        """
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return None
+
+            if item['model_version'] != self.ml_core.model_version:
+                continue  # Кластеры сменились - предсказание недействительно
+
+            if item['weights_version'] != self.ml_core.weights_version and item['cluster_id'] != -1:
+                try:
+                    item['prediction'], item['confidence'] = self.ml_core.score_cluster(
+                        item['cluster_id'], item['features'])
+                except ValueError:
+                    continue
+                item['weights_version'] = self.ml_core.weights_version
+
+            return item
@@ -2,28 +2,54 @@ import tkinter as tk
 from tkinter import ttk
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import numpy as np
-from datetime import datetime, timedelta
+import perf
+
+# Как часто проверять PRAGMA data_version (сама проверка ничего не читает из таблиц)
+POLL_INTERVAL_MS = 2000
+
+FEEDBACK_TYPES = ['yes', 'no', 'unsure', 'verified']
+FEEDBACK_LABELS = ['✅ Да', '❌ Нет', '⏰ Не знаю', '🎯 Верификация']
 
 class ResultsTab:
     def __init__(self, parent_frame, database):
         self.frame = parent_frame
         self.db = database
+        self._refresh_job = None
+        self._visible = True
+        self._data_version = None   # data_version, для которой показаны данные
+        self._last_stats = None     # последняя отрисованная статистика
+        self._stats_rows = {}       # метрика -> строка stats_tree
         self.setup_ui()
-        self.refresh_data()
 
         self.auto_refresh()
 
     def auto_refresh(self):
-        """Автоматическое обновление данных"""
+        """Автоматическое обновление: пересчет только если БД изменилась"""
+        self._refresh_job = None
+        if not self._visible:
+            return  # Скрытая вкладка не обновляется
         try:
-            self.refresh_data()
+            if self.db.data_version() != self._data_version:
+                self.refresh_data()
             # Если успешно, продолжаем автообновление
-            self.frame.after(5000, self.auto_refresh)
+            self._refresh_job = self.frame.after(POLL_INTERVAL_MS, self.auto_refresh)
         except Exception as e:
             print(f"⚠️ Остановлено автообновление из-за ошибки: {e}")
             # Не планируем следующее обновление при ошибке
 
+    def on_show(self):
+        """Вкладка снова видна - обновляем сразу и возобновляем автообновление"""
+        self._visible = True
+        if self._refresh_job is None:
+            self.auto_refresh()
+
+    def on_hide(self):
+        """Вкладка скрыта - останавливаем автообновление"""
+        self._visible = False
+        if self._refresh_job is not None:
+            self.frame.after_cancel(self._refresh_job)
+            self._refresh_job = None
+
     def setup_ui(self):
         # Основной контейнер с прокруткой
         main_container = tk.Frame(self.frame)
@@ -110,6 +136,17 @@ class ResultsTab:
         chart_title.pack()
         
         self.feedback_fig, self.feedback_ax = plt.subplots(figsize=(5, 3))
+
+        # Столбцы и подписи создаются один раз, дальше меняются только высоты и тексты
+        self.feedback_bars = self.feedback_ax.bar(FEEDBACK_LABELS, [0] * len(FEEDBACK_TYPES),
+                                                  color=['green', 'red', 'orange', 'blue'])
+        self.feedback_texts = [self.feedback_ax.text(bar.get_x() + bar.get_width()/2., 0, '0',
+                                                     ha='center', va='bottom')
+                               for bar in self.feedback_bars]
+        self.feedback_ax.set_title('Распределение ответов пользователя')
+        self.feedback_ax.tick_params(axis='x', rotation=45)
+        self.feedback_fig.tight_layout()
+
         self.feedback_canvas = FigureCanvasTkAgg(self.feedback_fig, chart_frame)
         self.feedback_canvas.get_tk_widget().pack(fill='x')
 
@@ -123,6 +160,18 @@ class ResultsTab:
         chart_title.pack()
         
         self.accuracy_fig, self.accuracy_ax = plt.subplots(figsize=(5, 3))
+
+        digits = list(range(10))
+        self.accuracy_bars = self.accuracy_ax.bar(digits, [0] * len(digits), color='skyblue')
+        self.accuracy_texts = [self.accuracy_ax.text(bar.get_x() + bar.get_width()/2., 0, f'{0:.1%}',
+                                                     ha='center', va='bottom')
+                               for bar in self.accuracy_bars]
+        self.accuracy_ax.set_title('Точность по цифрам')
+        self.accuracy_ax.set_xlabel('Цифра')
+        self.accuracy_ax.set_ylabel('Точность')
+        self.accuracy_ax.set_ylim(0, 1)
+        self.accuracy_fig.tight_layout()
+
         self.accuracy_canvas = FigureCanvasTkAgg(self.accuracy_fig, chart_frame)
         self.accuracy_canvas.get_tk_widget().pack(fill='x')
 
@@ -145,11 +194,18 @@ class ResultsTab:
         """Обновляет все данные на вкладке"""
         try:
             print("🔍 DEBUG: Начинаем обновление результатов...")
-            stats = self.calculate_statistics()
-            print(f"🔍 DEBUG: Статистика получена: {stats.keys()}")
-            self.update_metrics(stats)
-            self.update_charts(stats)
-            self.update_detailed_stats(stats)
+            # Версию запоминаем до чтения: изменения во время пересчета
+            # поймает следующая проверка
+            data_version = self.db.data_version()
+            with perf.timed("ResultsTab.refresh", log=True):
+                stats = self.calculate_statistics()
+                print(f"🔍 DEBUG: Статистика получена: {stats.keys()}")
+                if stats != self._last_stats:
+                    self.update_metrics(stats)
+                    self.update_charts(stats)
+                    self.update_detailed_stats(stats)
+                    self._last_stats = stats
+            self._data_version = data_version
             print("✅ Результаты успешно обновлены")
             
         except Exception as e:
@@ -158,88 +214,29 @@ class ResultsTab:
             traceback.print_exc()  # ⭐⭐ ДОБАВИМ ПОДРОБНЫЙ ТРЕЙСБЭК
 
     def calculate_statistics(self):
-        """Вычисляет всю статистику системы"""
+        """Собирает статистику системы из агрегатов БД (GROUP BY и счетчики)"""
         try:
-            cursor = self.db.conn.cursor()
-        
-            # Получаем последнюю статистику из таблицы statistics
-            latest_stats = self.db.get_latest_statistics()
-        
-            if latest_stats:
-                print(f"🔍 DEBUG: latest_stats = {latest_stats}")
-                # ⭐⭐ ПРЕОБРАЗУЕМ БАЙТЫ В ЧИСЛА ЕСЛИ НУЖНО
-                def safe_convert(value):
-                    if isinstance(value, bytes):
-                        return int.from_bytes(value, byteorder='little')
-                    return value
-            
-                stats = {
-                    'total_samples': safe_convert(latest_stats[2]),
-                    'correct_predictions': safe_convert(latest_stats[3]),
-                    'overall_accuracy': safe_convert(latest_stats[4]),
-                    'total_clusters': safe_convert(latest_stats[5]),
-                    'feedback_stats': {
-                        'yes': safe_convert(latest_stats[6]),
-                        'no': safe_convert(latest_stats[7]),
-                        'unsure': safe_convert(latest_stats[8]),
-                        'verified': safe_convert(latest_stats[9])
-                    }
-                }
-            else:
-                print("🔍 DEBUG: Нет saved statistics, вычисляем вручную")
-                # Fallback: вычисляем вручную
-                cursor.execute("SELECT COUNT(*) FROM samples")
-                total_samples = cursor.fetchone()[0]
-            
-                cursor.execute("SELECT COUNT(*) FROM samples WHERE user_feedback = 'yes'")
-                correct_predictions = cursor.fetchone()[0]
-            
-                cursor.execute("SELECT COUNT(*) FROM clusters")
-                total_clusters = cursor.fetchone()[0]
-            
-                cursor.execute('SELECT user_feedback, COUNT(*) FROM samples GROUP BY user_feedback')
-                feedback_results = cursor.fetchall()
-                feedback_stats = {}
-                for feedback, count in feedback_results:
-                    # ⭐⭐ ПРЕОБРАЗУЕМ БАЙТЫ ЕСЛИ НУЖНО
-                    if isinstance(feedback, bytes):
-                        feedback = feedback.decode('utf-8')
-                    if isinstance(count, bytes):
-                        count = int.from_bytes(count, byteorder='little')
-                    feedback_stats[feedback] = count
-            
-                stats = {
-                    'total_samples': total_samples,
-                    'correct_predictions': correct_predictions,
-                    'total_clusters': total_clusters,
-                    'feedback_stats': feedback_stats,
-                    'overall_accuracy': correct_predictions / total_samples if total_samples > 0 else 0
-                }
-        
-            # Дополнительно: точность по цифрам
-            cursor.execute('''
-                SELECT predicted_label, true_label, verified_label 
-                FROM samples 
-                WHERE verified_label IS NOT NULL AND true_label IS NOT NULL
-            ''')
-            accuracy_data = cursor.fetchall()
-        
-            digit_accuracy = {i: {'correct': 0, 'total': 0} for i in range(10)}
-            for row in accuracy_data:
-                pred, true, verified = row
-            
-                # ⭐⭐ ПРЕОБРАЗУЕМ БАЙТЫ ЕСЛИ НУЖНО
-                if isinstance(true, bytes):
-                    true = int.from_bytes(true, byteorder='little')
-                if isinstance(verified, bytes):
-                    verified = int.from_bytes(verified, byteorder='little')
-            
-                digit_accuracy[true]['total'] += 1
-                if verified == true:
-                    digit_accuracy[true]['correct'] += 1
-        
-            stats['digit_accuracy'] = digit_accuracy
-            return stats
+            # Без flush: поток Tk не ждет очередь записи, а новые фиксации
+            # поймает следующая проверка data_version
+            aggregates = self.db.get_result_aggregates()
+            counters = aggregates['counters']
+
+            total_samples = counters['total_samples']
+            correct_predictions = counters['feedback_yes']
+            return {
+                'total_samples': total_samples,
+                'correct_predictions': correct_predictions,
+                'overall_accuracy': correct_predictions / total_samples if total_samples > 0 else 0,
+                'total_clusters': counters['active_clusters'],
+                'feedback_stats': {
+                    'yes': counters['feedback_yes'],
+                    'no': counters['feedback_no'],
+                    'unsure': counters['feedback_unsure'],
+                    'verified': counters['feedback_verified']
+                },
+                'digit_accuracy': aggregates['digit_accuracy'],
+                'confusion': aggregates['confusion']
+            }
         
         except Exception as e:
             print(f"❌ Ошибка вычисления статистики: {e}")
@@ -255,61 +252,32 @@ class ResultsTab:
         
         # Эффективность фидбека = (correct + verified) / total
         feedback_eff = (stats['correct_predictions'] + 
-                       stats['feedback_stats'].get('verified', 0)) / stats['total_samples']
+                       stats['feedback_stats'].get('verified', 0)) / max(stats['total_samples'], 1)
         self.feedback_label.config(text=f"{feedback_eff:.1%}")
 
     def update_charts(self, stats):
-        """Обновляет графики"""
+        """Обновляет графики на месте: высоты столбцов и подписи, без ax.clear()"""
         # График распределения фидбеков
-        self.feedback_ax.clear()
-        feedback_types = ['yes', 'no', 'unsure', 'verified']
-        feedback_counts = [stats['feedback_stats'].get(fb, 0) for fb in feedback_types]
-        feedback_labels = ['✅ Да', '❌ Нет', '⏰ Не знаю', '🎯 Верификация']
-        
-        bars = self.feedback_ax.bar(feedback_labels, feedback_counts, color=['green', 'red', 'orange', 'blue'])
-        self.feedback_ax.set_title('Распределение ответов пользователя')
-        self.feedback_ax.tick_params(axis='x', rotation=45)
-        
-        # Добавляем подписи значений
-        for bar, count in zip(bars, feedback_counts):
-            height = bar.get_height()
-            self.feedback_ax.text(bar.get_x() + bar.get_width()/2., height,
-                                f'{count}', ha='center', va='bottom')
-        
-        self.feedback_fig.tight_layout()
-        self.feedback_canvas.draw()
+        feedback_counts = [stats['feedback_stats'].get(fb, 0) for fb in FEEDBACK_TYPES]
+        for bar, text, count in zip(self.feedback_bars, self.feedback_texts, feedback_counts):
+            bar.set_height(count)
+            text.set_y(count)
+            text.set_text(f'{count}')
+        # Запас сверху под подписи значений
+        self.feedback_ax.set_ylim(0, max(max(feedback_counts) * 1.15, 1))
+        self.feedback_canvas.draw_idle()
         
         # График точности по цифрам
-        self.accuracy_ax.clear()
-        digits = list(range(10))
-        accuracies = []
-        
-        for digit in digits:
+        for digit, (bar, text) in enumerate(zip(self.accuracy_bars, self.accuracy_texts)):
             data = stats['digit_accuracy'][digit]
             accuracy = data['correct'] / data['total'] if data['total'] > 0 else 0
-            accuracies.append(accuracy)
-        
-        bars = self.accuracy_ax.bar(digits, accuracies, color='skyblue')
-        self.accuracy_ax.set_title('Точность по цифрам')
-        self.accuracy_ax.set_xlabel('Цифра')
-        self.accuracy_ax.set_ylabel('Точность')
-        self.accuracy_ax.set_ylim(0, 1)
-        
-        # Добавляем подписи значений
-        for bar, acc in zip(bars, accuracies):
-            height = bar.get_height()
-            self.accuracy_ax.text(bar.get_x() + bar.get_width()/2., height,
-                                f'{acc:.1%}', ha='center', va='bottom')
-        
-        self.accuracy_fig.tight_layout()
-        self.accuracy_canvas.draw()
+            bar.set_height(accuracy)
+            text.set_y(accuracy)
+            text.set_text(f'{accuracy:.1%}')
+        self.accuracy_canvas.draw_idle()
 
     def update_detailed_stats(self, stats):
-        """Обновляет детальную статистику"""
-        # Очищаем таблицу
-        for item in self.stats_tree.get_children():
-            self.stats_tree.delete(item)
-        
+        """Обновляет детальную статистику (строки таблицы меняются на месте)"""
         detailed_stats = [
             ("Всего обработано цифр", f"{stats['total_samples']}"),
             ("Правильных предсказаний", f"{stats['correct_predictions']}"),
@@ -319,7 +287,7 @@ class ResultsTab:
             ("Ответов 'Нет'", f"{stats['feedback_stats'].get('no', 0)}"), 
             ("Ответов 'Не знаю'", f"{stats['feedback_stats'].get('unsure', 0)}"),
             ("Верифицировано", f"{stats['feedback_stats'].get('verified', 0)}"),
-            ("Эффективность микрофидбека", f"{(stats['correct_predictions'] / stats['total_samples']):.1%}"),
+            ("Эффективность микрофидбека", f"{(stats['correct_predictions'] / max(stats['total_samples'], 1)):.1%}"),
         ]
         
         # Добавляем точность по цифрам
@@ -328,9 +296,27 @@ class ResultsTab:
             if data['total'] > 0:
                 accuracy = data['correct'] / data['total']
                 detailed_stats.append((f"Точность цифры {digit}", f"{accuracy:.1%}"))
-        
-        for metric, value in detailed_stats:
-            self.stats_tree.insert('', 'end', values=(metric, value))
+
+        # Самые частые ошибки по матрице ошибок верификации
+        mistakes = sorted(((count, true, chosen)
+                           for true, row in enumerate(stats['confusion'])
+                           for chosen, count in enumerate(row)
+                           if chosen != true and count > 0), reverse=True)
+        for count, true, chosen in mistakes[:3]:
+            detailed_stats.append((f"Путаница {true} → {chosen}", f"{count}"))
+
+        # Исчезнувшие метрики удаляем, новые вставляем по порядку
+        shown = {metric for metric, _ in detailed_stats}
+        for metric in list(self._stats_rows):
+            if metric not in shown:
+                self.stats_tree.delete(self._stats_rows.pop(metric))
+
+        for position, (metric, value) in enumerate(detailed_stats):
+            item = self._stats_rows.get(metric)
+            if item is None:
+                self._stats_rows[metric] = self.stats_tree.insert('', position, values=(metric, value))
+            elif self.stats_tree.set(item, 'value') != value:
+                self.stats_tree.set(item, 'value', value)
 
     def get_fallback_stats(self):
         """Возвращает статистику по умолчанию при ошибках"""
@@ -340,5 +326,6 @@ class ResultsTab:
             'overall_accuracy': 0,
             'total_clusters': 0,
             'feedback_stats': {'yes': 0, 'no': 0, 'unsure': 0, 'verified': 0},
-            'digit_accuracy': {i: {'correct': 0, 'total': 0} for i in range(10)}
+            'digit_accuracy': {i: {'correct': 0, 'total': 0} for i in range(10)},
+            'confusion': [[0] * 10 for _ in range(10)]
         }
\ No newline at end of file
@@ -0,0 +1,41 @@
+import json
+from dataclasses import dataclass
+from types import MappingProxyType
+from feedback_replay import DEFAULT_PARAMS
+
+
+def freeze(value):
+    """Рекурсивно делает JSON-значение неизменяемым: dict -> MappingProxyType, list -> tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+@dataclass(frozen=True)
+class SystemConfig:
+    """Настройки системы (строка system_config), только для чтения"""
+
+    feature_extractor: MappingProxyType
+    clustering: MappingProxyType
+    weights: MappingProxyType
+    created_at: str = None
+    updated_at: str = None
+
+    @classmethod
+    def from_row(cls, row):
+        """Разбирает строку SELECT * FROM system_config"""
+        _, feature_json, clustering_json, weights_json, created_at, updated_at = row[:6]
+        return cls(
+            feature_extractor=freeze(json.loads(feature_json or '{}')),
+            clustering=freeze(json.loads(clustering_json or '{}')),
+            weights=freeze(json.loads(weights_json or '{}')),
+            created_at=created_at,
+            updated_at=updated_at
+        )
+
+    @property
+    def feedback_params(self):
+        """Коэффициенты обновления весов (alpha, beta, gamma, min_weight)"""
+        return {name: self.weights.get(name, default) for name, default in DEFAULT_PARAMS.items()}
@@ -0,0 +1,287 @@
+import time
+import traceback
+import numpy as np
+from dataset_store import IMAGE_SHAPE, get_mnist_store
+
+# Путь, куда рабочий процесс сохраняет обученный экстрактор до подмены
+PENDING_MODELS_PATH = 'models/hybrid_system_pending'
+# Размер пачки, которой изображения нормализуются при извлечении признаков
+EXTRACT_BATCH_SIZE = 1024
+
+
+class TrainingSet:
+    """Обучающая выборка без float32-копии реальных изображений.
+
+    Реальные примеры - индексы в uint8 memmap MnistStore, нормализуются
+    пачками только при обращении (batch). Синтетические примеры
+    сгенерированы заранее и хранятся как есть.
+    """
+
+    def __init__(self, store, indices, x_synth=None, y_synth=None):
+        self.store = store
+        self.indices = np.asarray(indices)
+        self.x_synth = x_synth if x_synth is not None and len(x_synth) else np.empty((0,) + IMAGE_SHAPE, np.float32)
+        y_real = store.get_labels(self.indices)
+        self.labels = np.concatenate([y_real, y_synth]) if y_synth is not None and len(y_synth) else y_real
+
+    def __len__(self):
+        return len(self.indices) + len(self.x_synth)
+
+    @property
+    def shape(self):
+        return (len(self),) + IMAGE_SHAPE
+
+    def __getitem__(self, position):
+        """Одно float32 изображение (например, основа для синтетики)"""
+        return self.batch([position])[0]
+
+    def batch(self, positions):
+        """float32 изображения в [0, 1] по позициям в выборке"""
+        positions = np.asarray(positions)
+        images = np.empty((len(positions),) + IMAGE_SHAPE, dtype=np.float32)
+        real = positions < len(self.indices)
+        if real.any():
+            images[real] = self.store.get_normalized(self.indices[positions[real]])
+        if not real.all():
+            images[~real] = self.x_synth[positions[~real] - len(self.indices)]
+        return images
+
+
+def make_batch_sequences(training_set, batch_size=32, validation_split=0.2):
+    """keras.utils.Sequence для обучения и валидации по TrainingSet.
+
+    Как validation_split в fit(): валидация - последние примеры выборки,
+    обучающая часть перемешивается каждую эпоху.
+    """
+    from tensorflow import keras
+
+    class BatchSequence(keras.utils.Sequence):
+        def __init__(self, positions, shuffle):
+            super().__init__()
+            self.positions = positions
+            self.shuffle = shuffle
+            self.on_epoch_end()
+
+        def __len__(self):
+            return int(np.ceil(len(self.positions) / batch_size))
+
+        def __getitem__(self, i):
+            positions = self.positions[i * batch_size:(i + 1) * batch_size]
+            return training_set.batch(positions), training_set.labels[positions]
+
+        def on_epoch_end(self):
+            if self.shuffle:
+                np.random.shuffle(self.positions)
+
+    split = int(len(training_set) * (1 - validation_split))
+    positions = np.arange(len(training_set))
+    return BatchSequence(positions[:split], shuffle=True), BatchSequence(positions[split:], shuffle=False)
+
+
+def extract_features_batched(core, images, batch_size=EXTRACT_BATCH_SIZE):
+    """Признаки для всей выборки; TrainingSet нормализуется пачками"""
+    if isinstance(images, np.ndarray):
+        return core.extract_features(images)
+    return np.concatenate([core.extract_features(images.batch(np.arange(start, min(start + batch_size, len(images)))))
+                           for start in range(0, len(images), batch_size)])
+
+
+def prepare_training_data(feature_config):
+    """Подготовить обучающие данные согласно настройкам"""
+    try:
+        store = get_mnist_store()  # train + test в одном uint8 memmap
+    except ImportError:
+        print("❌ TensorFlow не установлен. Используем заглушку.")
+        return prepare_dummy_data(feature_config)
+
+    # Выбираем случайные реальные данные
+    real_count = feature_config['real_data_count']
+    if real_count > len(store):
+        real_count = len(store)
+        print(f"⚠️  Запрошено больше реальных данных чем есть. Используем {real_count}")
+
+    # Реальные изображения остаются uint8 в memmap: храним только индексы,
+    # нормализация - пачками во время обучения (TrainingSet.batch)
+    indices = np.random.choice(len(store), real_count, replace=False)
+    real = TrainingSet(store, indices)
+    y_real = real.labels
+
+    # Генерируем синтетические данные
+    synth_count = feature_config['synthetic_data_count']
+    if synth_count > 0:
+        x_synth, y_synth = generate_synthetic_data(real, y_real,
+                                                   synth_count,
+                                                   feature_config['noise_level'])
+    else:
+        x_synth, y_synth = np.array([]), np.array([])
+
+    # Объединяем (синтетика добавляется к индексам, реальные пиксели не копируются)
+    training = TrainingSet(store, indices, x_synth, y_synth) if synth_count > 0 else real
+
+    print(f"✅ Данные подготовлены: {len(real)} реальных + {len(x_synth)} синтетических")
+
+    return {
+        'x_train': training,
+        'y_train': training.labels,
+        'x_real': real,
+        'y_real': y_real,
+        'x_synthetic': x_synth if synth_count > 0 else None,
+        'y_synthetic': y_synth if synth_count > 0 else None,
+        'real_count': len(real),
+        'synthetic_count': len(x_synth),
+        'noise_level': feature_config['noise_level']
+    }
+
+
+def generate_synthetic_data(x_real, y_real, synth_count, noise_level):
+    """Генерируем зашумленные синтетические данные"""
+    if len(x_real) == 0:
+        return np.array([]), np.array([])
+
+    x_synth = []
+    y_synth = []
+
+    for i in range(synth_count):
+        # Выбираем случайный реальный пример как основу
+        base_idx = np.random.randint(0, len(x_real))
+        image = x_real[base_idx].copy()
+        true_label = y_real[base_idx]
+
+        # Применяем различные искажения в зависимости от уровня шума
+        if noise_level > 0.3:
+            # Поворот
+            if np.random.random() < noise_level:
+                k = np.random.randint(1, 4)  # 1, 2 или 3 поворота на 90°
+                image = np.rot90(image, k)
+
+            # Отражение
+            if np.random.random() < noise_level * 0.7:
+                image = np.flipud(image) if np.random.random() < 0.5 else np.fliplr(image)
+
+        if noise_level > 0.5:
+            # Добавляем гауссов шум
+            noise = np.random.normal(0, noise_level * 0.3, image.shape)
+            image = np.clip(image + noise, 0, 1)
+
+            # Размытие (простое)
+            if np.random.random() < noise_level * 0.5:
+                from scipy.ndimage import gaussian_filter
+                image = gaussian_filter(image, sigma=0.5)
+
+        # Иногда меняем метку (ошибочная разметка)
+        final_label = true_label
+        if np.random.random() < noise_level * 0.3:  # До 30% ошибок при высоком шуме
+            wrong_label = np.random.randint(0, 10)
+            while wrong_label == true_label:
+                wrong_label = np.random.randint(0, 10)
+            final_label = wrong_label
+
+        x_synth.append(image)
+        y_synth.append(final_label)
+
+    return np.array(x_synth), np.array(y_synth)
+
+
+def prepare_dummy_data(feature_config):
+    """Заглушка если нет TensorFlow"""
+    print("🔶 Используем заглушечные данные (без TensorFlow)")
+    return {
+        'x_train': np.random.random((100, 28, 28)),
+        'y_train': np.random.randint(0, 10, 100),
+        'real_count': feature_config['real_data_count'],
+        'synthetic_count': feature_config['synthetic_data_count'],
+        'noise_level': feature_config['noise_level']
+    }
+
+
+def _make_progress_callback(progress_queue, cancel_event, train_examples):
+    """Создает Keras callback, который шлет прогресс эпох и проверяет отмену"""
+    from tensorflow import keras
+
+    class ProgressCallback(keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self._epoch_start = time.perf_counter()
+
+        def on_train_batch_end(self, batch, logs=None):
+            if cancel_event.is_set():
+                self.model.stop_training = True
+
+        def on_epoch_end(self, epoch, logs=None):
+            logs = logs or {}
+            elapsed = time.perf_counter() - self._epoch_start
+            progress_queue.put(('epoch', {
+                'epoch': epoch + 1,
+                'epochs': self.params.get('epochs'),
+                'loss': float(logs.get('loss', 0.0)),
+                'accuracy': float(logs.get('accuracy', 0.0)),
+                'examples_per_sec': train_examples / elapsed if elapsed > 0 else 0.0,
+                'seconds': elapsed
+            }))
+
+    return ProgressCallback()
+
+
+def run_training(feature_config, clustering_config, progress_queue, cancel_event, epochs=5):
+    """Точка входа рабочего процесса обучения.
+
+    Подготавливает данные, обучает экстрактор, кластеризует признаки и
+    сохраняет экстрактор в PENDING_MODELS_PATH. Все события отправляются в
+    progress_queue кортежами (тип, данные); последним всегда идет 'done',
+    'cancelled' или 'failed'.
+    """
+    from ml_core import HybridMLCore
+
+    stage_times = {}
+
+    def run_stage(name, func, *args, **kwargs):
+        if cancel_event.is_set():
+            raise InterruptedError
+        progress_queue.put(('stage_started', name))
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        stage_times[name] = time.perf_counter() - start
+        progress_queue.put(('stage_finished', {'stage': name, 'seconds': stage_times[name]}))
+        return result
+
+    try:
+        core = HybridMLCore()
+
+        # 1. Данные
+        training_data = run_stage('Подготовка данных', prepare_training_data, feature_config)
+
+        # 2. Создаем и обучаем экстрактор
+        run_stage('Создание экстрактора', core.create_feature_extractor,
+                  feature_config['architecture'], feature_config['embedding_size'])
+
+        train_examples = int(len(training_data['x_train']) * 0.8)  # validation_split=0.2
+        callback = _make_progress_callback(progress_queue, cancel_event, train_examples)
+        history = run_stage('Обучение экстрактора', core.train_feature_extractor,
+                            training_data, epochs=epochs, callbacks=[callback])
+        if cancel_event.is_set():
+            raise InterruptedError
+
+        # 3. Извлекаем признаки
+        features = run_stage('Извлечение признаков', extract_features_batched, core, training_data['x_train'])
+
+        # 4. Кластеризация c передачей настоящих меток
+        run_stage('Кластеризация', core.perform_clustering,
+                  features, clustering_config, true_labels=training_data['y_train'])
+
+        # 5. Сохраняем экстрактор для загрузки в основном процессе
+        run_stage('Сохранение моделей', core.save_models, PENDING_MODELS_PATH)
+
+        progress_queue.put(('done', {
+            'clusters_data': core.get_clusters_data_for_db(),
+            'cluster_metric': core.cluster_metric,
+            'models_path': PENDING_MODELS_PATH,
+            'history': history,
+            'real_count': training_data['real_count'],
+            'synthetic_count': training_data['synthetic_count'],
+            'stage_times': stage_times
+        }))
+
+    except InterruptedError:
+        progress_queue.put(('cancelled', stage_times))
+    except Exception as e:
+        traceback.print_exc()
+        progress_queue.put(('failed', str(e)))
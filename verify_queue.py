@@ -0,0 +1,169 @@
+import threading
+from collections import deque
+from itertools import islice
+from database import PENDING_SAMPLES_SQL, PENDING_COUNT_SQL
+
+
+class VerificationQueue:
+    """Очередь отложенной верификации для VerifyTab.
+
+    Метаданные читаются страницами по ключу sample_id (keyset, без OFFSET)
+    и без изображений. Изображения ближайших lookahead примеров заранее
+    загружает фоновый поток через собственное соединение на чтение.
+    """
+
+    def __init__(self, db, page_size=200, lookahead=4):
+        self.db = db
+        self.page_size = page_size
+        self.lookahead = lookahead
+
+        self._items = deque()       # Метаданные примеров в порядке sample_id
+        self._images = {}           # sample_id -> uint8 изображение (None - нет изображения)
+        self._loading = set()       # sample_id, которые сейчас грузит фоновый поток
+        self._last_id = 0           # Наибольший прочитанный sample_id (курсор)
+        self._unread = 0            # Ожидающие примеры после курсора, еще не прочитанные
+        self._exhausted = False     # Последняя страница была неполной
+
+        self._lock = threading.Lock()
+        self._wanted = threading.Condition(self._lock)
+        self._stop = False
+        self._thread = None
+
+    def __len__(self):
+        """Сколько примеров осталось: в очереди и еще не прочитанных из БД"""
+        return len(self._items) + self._unread
+
+    def start(self):
+        """Запускает фоновую загрузку изображений"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="verify-images", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает фоновую загрузку"""
+        with self._wanted:
+            self._stop = True
+            self._wanted.notify()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def refresh(self):
+        """Дочитывает только новые примеры после последнего прочитанного sample_id.
+
+        Очередь записи не дожидаемся (вызывается из потока Tk): примеры, еще
+        не зафиксированные потоком записи, появятся при следующем обновлении.
+        """
+        cursor = self.db.conn.cursor()
+        cursor.execute(PENDING_COUNT_SQL, (self._last_id,))
+        self._unread = cursor.fetchone()[0]
+        self._exhausted = False
+        if len(self._items) <= self.lookahead:
+            self._fetch_page()
+
+    def reset(self):
+        """Перечитывает очередь с начала"""
+        with self._lock:
+            self._items.clear()
+            self._images.clear()
+        self._last_id = 0
+        self.refresh()
+
+    def take(self):
+        """Следующий пример с изображением (uint8, как хранится - сразу для отрисовки) или None"""
+        while True:
+            if len(self._items) <= self.lookahead and not self._exhausted:
+                self._fetch_page()
+
+            with self._wanted:
+                if not self._items:
+                    return None
+                sample = self._items.popleft()
+                sample_id = sample['sample_id']
+                ready = sample_id in self._images
+                image = self._images.pop(sample_id, None)
+                self._wanted.notify()  # Освободилось место для предзагрузки
+
+            if not ready:
+                # Фоновый поток не успел - читаем одно изображение сами
+                try:
+                    image = self.db.load_sample_images([sample_id]).get(sample_id)
+                except Exception as e:
+                    print(f"❌ Ошибка загрузки sample_id {sample_id}: {e}")
+                    continue
+
+            if image is None:
+                print(f"⚠️ Пропускаем sample_id {sample_id}: нет изображения")
+                continue
+
+            sample['image_data'] = image
+            return sample
+
+    def _fetch_page(self):
+        """Читает следующую страницу метаданных после курсора"""
+        cursor = self.db.conn.cursor()
+        cursor.execute(PENDING_SAMPLES_SQL, (self._last_id, self.page_size))
+        rows = cursor.fetchall()
+
+        page = []
+        for sample_id, predicted_label, user_feedback, cluster_id, true_label in rows:
+            # ⭐⭐ ИСПРАВЛЕНИЕ: ПРЕОБРАЗУЕМ TRUE_LABEL В INT ⭐⭐
+            if isinstance(true_label, bytes):
+                true_label = int.from_bytes(true_label, byteorder='little')
+            elif true_label is not None:
+                true_label = int(true_label)
+
+            page.append({
+                'sample_id': sample_id,
+                'predicted_label': predicted_label,
+                'user_feedback': user_feedback,
+                'cluster_id': cluster_id,
+                'true_label': true_label
+            })
+
+        if rows:
+            self._last_id = rows[-1][0]
+        self._exhausted = len(rows) < self.page_size
+        self._unread = 0 if self._exhausted else max(self._unread - len(rows), 0)
+
+        with self._wanted:
+            self._items.extend(page)
+            self._wanted.notify()
+        return len(page)
+
+    def _next_missing(self):
+        """sample_id ближайших примеров, изображения которых еще не загружены"""
+        return [s['sample_id'] for s in islice(self._items, self.lookahead)
+                if s['sample_id'] not in self._images and s['sample_id'] not in self._loading]
+
+    def _run(self):
+        conn = self.db.open_read_connection()  # sqlite3-соединение нельзя делить между потоками
+        try:
+            while True:
+                with self._wanted:
+                    while not self._stop and not self._next_missing():
+                        self._wanted.wait()
+                    if self._stop:
+                        return
+                    sample_ids = self._next_missing()
+                    self._loading.update(sample_ids)
+
+                try:
+                    images = self.db.load_sample_images(sample_ids, conn=conn)
+                except Exception as e:
+                    print(f"⚠️ Ошибка предзагрузки изображений: {e}")
+                    images = None
+
+                with self._wanted:
+                    self._loading.difference_update(sample_ids)
+                    if images is None:
+                        self._wanted.wait(timeout=1.0)  # Пауза перед повтором; take() грузит сам
+                        continue
+                    # Пример мог быть уже забран из очереди - его изображение не храним
+                    queued = {s['sample_id'] for s in islice(self._items, self.lookahead)}
+                    self._images.update((sample_id, image) for sample_id, image in images.items()
+                                        if sample_id in queued)
+        finally:
+            conn.close()
@@ -1,10 +1,8 @@
 import tkinter as tk
-from tkinter import ttk
-import numpy as np
-import matplotlib.pyplot as plt
 from PIL import Image, ImageTk
-import io
-import pickle
+from digit_render import RenderCache
+from verify_queue import VerificationQueue
+import perf
 
 class VerifyTab:
     def __init__(self, parent_frame, database, ml_core):
@@ -12,35 +10,25 @@ class VerifyTab:
         self.db = database
         self.ml_core = ml_core
         self.current_sample = None
-        self.pending_samples = []
+        self.render_cache = RenderCache(scale=10)  # 28 x 10 = 280 пикселей
+        # Постраничная очередь: метаданные по курсору, изображения - фоном
+        self.pending = VerificationQueue(self.db)
         
         self.setup_ui()
         self.load_pending_samples()
+        self.pending.start()
         self.show_next_sample()
-        
-        # ⭐⭐ ДОБАВЛЯЕМ ОБРАБОТЧИК АКТИВАЦИИ ВКЛАДКИ ⭐⭐
-        self._bind_tab_events()
 
-    def _bind_tab_events(self):
-        """Привязывает обработчики событий для автоматического обновления"""
-        # Находим родительский notebook
-        parent = self.frame.winfo_parent()
-        if parent:
-            notebook = self.frame.nametowidget(parent)
-            if isinstance(notebook, ttk.Notebook):
-                # Привязываем обработчик когда эта вкладка становится активной
-                notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed)
-    
-    def _on_tab_changed(self, event):
-        """Обработчик смены вкладки"""
-        try:
-            notebook = event.widget
-            current_tab = notebook.select()
-            if current_tab == str(self.frame):
-                print("🔁 Активна вкладка VerifyTab - обновляем данные...")
-                self.refresh_verification_list()
-        except Exception as e:
-            print(f"⚠️ Ошибка обработки смены вкладки: {e}")
+    def on_show(self):
+        """Вызывается главным окном при повторной активации вкладки"""
+        print("🔁 Активна вкладка VerifyTab - обновляем данные...")
+        self.pending.start()
+        self.refresh_verification_list()
+
+    def on_hide(self):
+        """Вкладка скрыта (или окно закрывается) - останавливаем фоновую загрузку
+        изображений; ее соединение на чтение закрывается вместе с потоком"""
+        self.pending.stop()
 
     def setup_ui(self):
         # Основной контейнер
@@ -123,8 +111,8 @@ class VerifyTab:
         """Принудительное обновление всего интерфейса"""
         print("💥 ПРИНУДИТЕЛЬНОЕ ОБНОВЛЕНИЕ...")
         
-        # Перезагружаем данные
-        self.load_pending_samples()
+        # Перечитываем очередь с начала
+        self.load_pending_samples(full=True)
         
         # Принудительно перерисовываем интерфейс
         self.show_next_sample()
@@ -132,101 +120,26 @@ class VerifyTab:
         # Обновляем все элементы
         self.frame.update_idletasks()
 
-    def load_pending_samples(self):
-        """Загружает примеры для отложенной верификации"""
+    def load_pending_samples(self, full=False):
+        """Дочитывает новые примеры для отложенной верификации (full=True - с начала)"""
         print("🔍 Загрузка примеров для верификации...")
-        
-        try:
-            cursor = self.db.conn.cursor()
-            
-            
-            
-            # Загружаем непроверенные примеры
-            cursor.execute('''
-                SELECT sample_id, image_data, predicted_label, user_feedback, cluster_id, true_label
-                FROM samples 
-                WHERE verified_label IS NULL 
-                AND user_feedback IN ('no', 'unsure')
-                ORDER BY sample_id
-                ''')
-            
-            results = cursor.fetchall()
-            self.pending_samples = []
-            
-            print(f"✅ Найдено для верификации: {len(results)} примеров")
-            
-            for row in results:
-                sample_id, image_blob, predicted_label, user_feedback, cluster_id, true_label = row
-                
-                if image_blob is None:
-                    print(f"⚠️ Пропускаем sample_id {sample_id}: нет изображения")
-                    continue
-                    
-                try:
-                    image_data = pickle.loads(image_blob)
-                    
-                    # Конвертируем в numpy array если нужно
-                    if isinstance(image_data, list):
-                        image_array = np.array(image_data, dtype=np.float32)
-                    else:
-                        image_array = image_data
-                    
-                    # Нормализуем если нужно
-                    if image_array.max() > 1.0:
-                        image_array = image_array / 255.0
 
-                    # ⭐⭐ ИСПРАВЛЕНИЕ: ПРЕОБРАЗУЕМ TRUE_LABEL В INT ⭐⭐
-                    if isinstance(true_label, bytes):
-                        true_label = int.from_bytes(true_label, byteorder='little')
-                    elif true_label is not None:
-                        true_label = int(true_label)
-                    
-                    self.pending_samples.append({
-                        'sample_id': sample_id,
-                        'image_data': image_array,
-                        'predicted_label': predicted_label,
-                        'user_feedback': user_feedback,
-                        'cluster_id': cluster_id,
-                        'true_label': true_label
-                    })
-                    
-                except Exception as e:
-                    print(f"❌ Ошибка загрузки sample_id {sample_id}: {e}")
-                    continue
-                    
+        try:
+            # Только строки после последнего прочитанного sample_id, без изображений
+            if full:
+                self.pending.reset()
+            else:
+                self.pending.refresh()
+            print(f"✅ Найдено для верификации: {len(self.pending)} примеров")
         except Exception as e:
             print(f"❌ Ошибка загрузки из БД: {e}")
-            self.pending_samples = []
 
-    def array_to_image(self, digit_array):
-        """Конвертируем numpy array в изображение для tkinter"""
+    def array_to_image(self, digit_array, key=None):
+        """Конвертируем numpy array в изображение для tkinter (без matplotlib)"""
         try:
-            # Убедимся что это 2D array
-            if len(digit_array.shape) == 1:
-                side = int(np.sqrt(digit_array.shape[0]))
-                digit_array = digit_array.reshape(side, side)
-            
-            # Денормализуем для отображения
-            if digit_array.max() <= 1.0:
-                display_array = (digit_array * 255).astype(np.uint8)
-            else:
-                display_array = digit_array.astype(np.uint8)
-            
-            # Создаем изображение
-            plt.figure(figsize=(4, 4))
-            plt.imshow(display_array, cmap='gray')
-            plt.axis('off')
-            plt.tight_layout()
-            
-            # Сохраняем в буфер
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', bbox_inches='tight', 
-                       pad_inches=0, dpi=70)
-            buf.seek(0)
-            plt.close()
-            
-            return Image.open(buf)
-            
+            if key is None:
+                return self.render_cache.render(digit_array)
+            return self.render_cache.get(key, digit_array)
         except Exception as e:
             print(f"❌ Ошибка создания изображения: {e}")
             # Создаем заглушку
@@ -237,18 +150,23 @@ class VerifyTab:
         # Очищаем текущее состояние
         self.current_sample = None
         
-        if not self.pending_samples:
+        # Берем следующий пример (изображение обычно уже загружено фоном)
+        try:
+            sample = self.pending.take()
+        except Exception as e:
+            print(f"❌ Ошибка загрузки из БД: {e}")
+            sample = None
+        if sample is None:
             self.show_no_samples()
             return
-        
-        # Берем следующий пример
-        self.current_sample = self.pending_samples.pop(0)
-        
+        self.current_sample = sample
+
         print(f"🔍 Показываем sample_id {self.current_sample['sample_id']}")
         
         try:
             # Показываем изображение
-            image = self.array_to_image(self.current_sample['image_data'])
+            image = self.array_to_image(self.current_sample['image_data'],
+                                        key=self.current_sample['sample_id'])
             photo = ImageTk.PhotoImage(image)
             
             self.image_label.configure(image=photo)
@@ -289,7 +207,7 @@ class VerifyTab:
                 btn.config(state="normal", bg="#f0f0f0")
             
             # Обновляем счетчик
-            remaining = len(self.pending_samples)
+            remaining = len(self.pending)
             self.counter_label.config(text=f"Осталось: {remaining} чисел")
             
         except Exception as e:
@@ -323,39 +241,20 @@ class VerifyTab:
         try:
             # ⭐⭐ ОБНОВЛЯЕМ ВЕСА КЛАСТЕРА ⭐⭐
             if self.ml_core and self.ml_core.is_trained and cluster_id != -1:
-                config = self.db.load_system_config()
-                if config and 'weights' in config:
-                    alpha = config['weights'].get('alpha', 0.2)
-                    beta = config['weights'].get('beta', 0.5)
-                    gamma = config['weights'].get('gamma', 0.5)
-                    min_weight = config['weights'].get('min_weight', 0.05) 
-                else:
-                    alpha, beta, gamma, min_weight = 0.2, 0.5, 0.5, 0.05
-               
-                
+                # Коэффициенты (alpha, beta, gamma, min_weight) - из настроек, по подписке ядра
                 self.ml_core.update_cluster_weights(
-                    cluster_id, 
+                    cluster_id,
                     'verified',
-                    true_label=true_digit,
-                    alpha=alpha,
-                    beta=beta,
-                    gamma=gamma,
-                    min_weight=min_weight
+                    true_label=true_digit
                 )
                 print(f"✅ Обновлены веса кластера {cluster_id}")
             elif cluster_id == -1:
                 print(f"⚠️  Пропуск обновления весов: cluster_id = -1")
             
-            # ⭐⭐ ОБНОВЛЯЕМ БАЗУ ДАННЫХ ⭐⭐
-            cursor = self.db.conn.cursor()
-            cursor.execute('''
-                UPDATE samples 
-                SET verified_label = ?, user_feedback = 'verified'
-                WHERE sample_id = ?
-            ''', (true_digit, sample_id))
-            self.db.conn.commit()
+            # ⭐⭐ ОБНОВЛЯЕМ БАЗУ ДАННЫХ (через очередь записи) ⭐⭐
+            self.db.save_verification(sample_id, true_digit)
             
-            print(f"✅ БД обновлена: sample_id {sample_id}")
+            print(f"✅ Верификация поставлена в очередь записи: sample_id {sample_id}")
             
             # Показываем успех
             self.status_label.config(
@@ -380,15 +279,24 @@ class VerifyTab:
     def refresh_verification_list(self):
         """Обновляет список примеров"""
         print("🔄 Обновление списка верификации...")
-        self.load_pending_samples()
-        self.show_next_sample()
+        with perf.timed("VerifyTab.refresh", log=True):
+            self.load_pending_samples()
+            if self.current_sample is None:
+                self.show_next_sample()
+            else:
+                # Текущий пример остается на экране, обновляем только счетчик
+                self.counter_label.config(text=f"Осталось: {len(self.pending)} чисел")
 
     def debug_info(self):
         """Показывает отладочную информацию"""
         print("\n=== ОТЛАДОЧНАЯ ИНФОРМАЦИЯ ===")
         print(f"Модель готова: {self.ml_core and self.ml_core.is_trained}")
         print(f"Кластеров: {len(self.ml_core.clusters) if self.ml_core else 0}")
-        print(f"Примеров для верификации: {len(self.pending_samples)}")
+        if self.ml_core:
+            latency = self.ml_core.get_inference_latency_stats()
+            if latency['count']:
+                print(f"Инференс: p50={latency['p50_ms']:.2f} мс, p99={latency['p99_ms']:.2f} мс")
+        print(f"Примеров для верификации: {len(self.pending)}")
         print(f"Текущий sample: {self.current_sample['sample_id'] if self.current_sample else 'None'}")
         print("============================\n")
         
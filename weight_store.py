@@ -0,0 +1,162 @@
+from collections.abc import MutableMapping
+import numpy as np
+
+# Коды событий фидбека (они же пишутся в журнал feedback_events)
+FEEDBACK_CODES = {'yes': 0, 'no': 1, 'verified': 2, 'unsure': 3}
+YES, NO, VERIFIED, UNSURE = (FEEDBACK_CODES[name] for name in ('yes', 'no', 'verified', 'unsure'))
+
+N_DIGITS = 10
+
+
+def event_rate(user_feedback, alpha, beta, gamma):
+    """Коэффициент, который событие реально применяет к весу"""
+    return {'yes': alpha, 'no': gamma, 'verified': beta}.get(user_feedback, 0.0)
+
+
+class ClusterWeights(MutableMapping):
+    """Представление строки матрицы весов как словаря {цифра: вес}.
+
+    Нужно для старого кода, который работает с cluster['weights'];
+    чтение и запись идут прямо в матрицу хранилища.
+    """
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, digit):
+        if not 0 <= digit < N_DIGITS:
+            raise KeyError(digit)
+        return float(self._store.matrix[self._row, digit])
+
+    def __setitem__(self, digit, weight):
+        if not 0 <= digit < N_DIGITS:
+            raise KeyError(digit)
+        self._store.matrix[self._row, digit] = weight
+
+    def __delitem__(self, digit):
+        raise TypeError("Веса цифр нельзя удалять")
+
+    def __iter__(self):
+        return iter(range(N_DIGITS))
+
+    def __len__(self):
+        return N_DIGITS
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ClusterWeightStore:
+    """Веса всех кластеров одной float32 матрицей (K x 10) с индексом ID -> строка"""
+
+    def __init__(self, cluster_ids=(), weights=None):
+        self.ids = np.array(cluster_ids, dtype=np.int64).ravel()
+        if weights is None:
+            weights = np.full((len(self.ids), N_DIGITS), 1.0 / N_DIGITS)
+        self.matrix = np.array(weights, dtype=np.float32).reshape(len(self.ids), N_DIGITS)
+        self._row_of = {int(cluster_id): row for row, cluster_id in enumerate(self.ids)}
+
+    @classmethod
+    def from_clusters(cls, clusters):
+        """Собирает хранилище из кластеров со словарями весов (в порядке clusters)"""
+        return cls([c['cluster_id'] for c in clusters],
+                   [[c['weights'][digit] for digit in range(N_DIGITS)] for c in clusters])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, cluster_id):
+        return int(cluster_id) in self._row_of
+
+    def row(self, cluster_id):
+        """Строка матрицы для кластера"""
+        try:
+            return self._row_of[int(cluster_id)]
+        except KeyError:
+            raise ValueError(f"Кластер с ID {cluster_id} не найден") from None
+
+    def rows(self, cluster_ids):
+        """Строки для массива ID; неизвестные кластеры получают -1"""
+        return np.array([self._row_of.get(int(c), -1) for c in np.ravel(cluster_ids)], dtype=np.int64)
+
+    def view(self, row):
+        """Словарное представление весов одной строки"""
+        return ClusterWeights(self, row)
+
+    def renumber(self, cluster_ids):
+        """Меняет ID кластеров, не трогая веса (строки остаются на местах)"""
+        self.ids = np.array(cluster_ids, dtype=np.int64).ravel()
+        self._row_of = {int(cluster_id): row for row, cluster_id in enumerate(self.ids)}
+
+    def copy(self):
+        return ClusterWeightStore(self.ids, self.matrix)
+
+    def apply_events(self, rows, kinds, labels, rates, min_weights):
+        """Применяет пачку событий фидбека scatter-операциями по матрице.
+
+        Правило то же, что было в update_cluster_weights: yes тянет вес
+        текущей предсказанной цифры (первый максимум) к 1 с коэффициентом
+        rate, no умножает его на rate, verified тянет вес метки к 1; затем
+        порог min_weight и нормализация строки.
+
+        События одной строки зависят друг от друга, поэтому применяются по
+        порядку; на шаге r векторно обрабатывается r-е событие каждой строки.
+        Возвращает измененную цифру для каждого события (-1, если ни одной).
+        """
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        kinds = np.asarray(kinds, dtype=np.int64).ravel()
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        rates = np.broadcast_to(np.asarray(rates, dtype=np.float32), rows.shape)
+        min_weights = np.broadcast_to(np.asarray(min_weights, dtype=np.float32), rows.shape)
+        touched = np.full(len(rows), -1, dtype=np.int64)
+        if len(rows) == 0:
+            return touched
+
+        # Верификация без метки и прочие события только нормализуют строку
+        kinds = np.where((kinds == VERIFIED) & (labels < 0), UNSURE, kinds)
+        is_verified = kinds == VERIFIED
+        changes_digit = (kinds == YES) | (kinds == NO) | is_verified
+
+        # Новый вес цифры: w * keep + pull * (1 - w)
+        # yes/verified: keep = 1, pull = rate; no: keep = rate, pull = 0
+        one = np.float32(1.0)
+        keep = np.where(kinds == NO, rates, one)
+        pull = np.where((kinds == YES) | is_verified, rates, np.float32(0.0))
+
+        if len(rows) == 1:
+            order_by_step = [np.zeros(1, dtype=np.int64)]
+        else:
+            # Номер события внутри своей строки (стабильная сортировка хранит порядок)
+            order = np.argsort(rows, kind='stable')
+            sorted_rows = rows[order]
+            starts = np.flatnonzero(np.r_[True, sorted_rows[1:] != sorted_rows[:-1]])
+            step = np.empty(len(rows), dtype=np.int64)
+            step[order] = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+
+            by_step = np.argsort(step, kind='stable')
+            bounds = np.flatnonzero(np.r_[True, np.diff(step[by_step]) != 0, True])
+            order_by_step = [by_step[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+        matrix = self.matrix
+        for idx in order_by_step:
+            r = rows[idx]
+            block = matrix[r]
+            positions = np.arange(len(r))
+
+            digits = np.where(is_verified[idx], labels[idx], block.argmax(axis=1))
+            current = block[positions, digits]
+            block[positions, digits] = current * keep[idx] + pull[idx] * (one - current)
+            touched[idx] = np.where(changes_digit[idx], digits, -1)
+
+            np.maximum(block, min_weights[idx][:, None], out=block)
+            block /= block.sum(axis=1, keepdims=True)
+            matrix[r] = block
+
+        return touched
+
+    def as_rows(self, rows=None):
+        """Веса строками (cluster_id, digit, weight) для записи в БД"""
+        rows = range(len(self.ids)) if rows is None else rows
+        return [(int(self.ids[row]), digit, float(self.matrix[row, digit]))
+                for row in rows for digit in range(N_DIGITS)]